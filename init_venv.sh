@@ -9,12 +9,19 @@ if [ ! -d "$VENV_DIR" ]; then
   source "$VENV_DIR/bin/activate"
 
   # Define packages
-  BASE_PACKAGES="pandas requests beautifulsoup4 tqdm psutil numpy openpyxl xlsxwriter flask"
-  ML_PACKAGES="torch scikit-learn datasets transformers accelerate"
+  # zstandard is required: compressed web_data.db text can't be read without it
+  BASE_PACKAGES="pandas requests beautifulsoup4 tqdm psutil numpy openpyxl xlsxwriter pyahocorasick zstandard"
+  ML_PACKAGES="torch scikit-learn datasets transformers accelerate starlette uvicorn prometheus-client"
+  # Optional speed-ups, each with a fallback when missing: Parquet export and
+  # DuckDB engine (analysis), faster JSON (json_codec), int8 ONNX backend
+  OPTIONAL_PACKAGES="pyarrow duckdb orjson onnx onnxruntime"
 
   if [[ "$1" == "--ml" ]]; then
-    echo "Installing all packages (including ML)..."
-    pip install $BASE_PACKAGES $ML_PACKAGES
+    echo "Installing all packages (including ML and optional extras)..."
+    pip install $BASE_PACKAGES $ML_PACKAGES $OPTIONAL_PACKAGES
+  elif [[ "$1" == "--extras" ]]; then
+    echo "Installing base packages and optional extras..."
+    pip install $BASE_PACKAGES $OPTIONAL_PACKAGES
   else
     echo "Installing base packages for fetching only..."
     pip install $BASE_PACKAGES
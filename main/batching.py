@@ -0,0 +1,239 @@
+# =============================================================================
+# Dynamic micro-batching for the prediction server
+# =============================================================================
+# classify-new.py posts from many threads at once. Instead of every request
+# thread running its own forward pass (all contending for the same model and
+# cores), request threads enqueue their texts and block; one worker thread
+# coalesces whatever is queued into a batch of up to `max_batch_size` texts,
+# waiting at most `max_wait` for stragglers, runs a single forward pass and
+# hands each request its slice of the results.
+#
+# The server coalesces a larger pool than one forward pass holds and splits it
+# with length_buckets, so each pass groups paragraphs of similar token length
+# instead of padding short ones to the longest; PaddingStats measures how
+# many of the processed tokens were padding.
+#
+# With a `prepare_fn` (the server's tokenizer), batching becomes a two-stage
+# pipeline: a collector thread hands each batch to a pool of prepare threads
+# and queues the pending result, so batch N+1 is tokenized while the model
+# runs batch N. The fast tokenizer and the model both release the GIL.
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+MAX_BATCH_SIZE = 64
+MAX_WAIT_SECONDS = 0.010
+# Padded tokens per forward pass (batch size x longest sequence)
+MAX_BATCH_TOKENS = 16384
+
+
+def length_buckets(
+    lengths: Sequence[int],
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_tokens: int = MAX_BATCH_TOKENS,
+) -> List[List[int]]:
+    """
+    Groups item indices into batches of similar length: indices are sorted
+    by length and cut whenever a batch would exceed `max_batch_size` items or
+    `max_tokens` padded tokens. Callers put results back by index.
+    """
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so this item sets the padded length of the batch
+        padded = (len(current) + 1) * lengths[i]
+        if current and (len(current) >= max_batch_size or padded > max_tokens):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+class PaddingStats:
+    """Real vs. padded tokens processed, and the time spent on them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+        self.passes = 0
+
+    def record(self, lengths: Sequence[int], seconds: float):
+        """One forward pass over sequences of `lengths` (padded to the longest)."""
+        with self._lock:
+            self.tokens += sum(lengths)
+            self.padded_tokens += len(lengths) * max(lengths, default=0)
+            self.seconds += seconds
+            self.passes += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "forward_passes": self.passes,
+                "tokens": self.tokens,
+                "padded_tokens": self.padded_tokens,
+                "padding_fraction": round(1 - self.tokens / self.padded_tokens, 4)
+                if self.padded_tokens
+                else 0.0,
+                "tokens_per_second": round(self.tokens / self.seconds, 1)
+                if self.seconds
+                else 0.0,
+            }
+
+
+class _Job:
+    __slots__ = ("texts", "future", "results", "remaining", "created")
+
+    def __init__(self, texts: Sequence[str]):
+        self.texts = list(texts)
+        self.created = time.monotonic()
+        self.future: Future = Future()
+        self.results: List = [None] * len(self.texts)
+        self.remaining = len(self.texts)
+
+
+class MicroBatcher:
+    """
+    Coalesces texts from concurrent `submit` calls into batches for
+    `predict_fn(texts) -> list of results` (one result per text, same order).
+
+    A batch is dispatched as soon as it holds `max_batch_size` texts or
+    `max_wait` seconds after its first text arrived, so a lone request waits
+    at most `max_wait` longer than it would have unbatched. Requests larger
+    than `max_batch_size` are split across consecutive batches.
+
+    With `num_dispatchers` > 1, that many threads collect and dispatch
+    batches concurrently, for a `predict_fn` that can run several at once
+    (e.g. worker_pool.WorkerPool).
+
+    With `prepare_fn`, each batch goes through `prepare_fn(texts)` on one of
+    `prepare_workers` threads first and `predict_fn` receives its output.
+    Batches are collected and prepared ahead of the dispatchers, at most
+    `num_dispatchers` prepared batches waiting at a time.
+
+    With `max_queue`, `submit` raises queue.Full instead of queueing a
+    request that would leave more than `max_queue` texts waiting.
+    `on_batch(batch_size, queued_seconds)` is called as each batch is
+    collected, with how long its oldest text waited.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[str]], List],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT_SECONDS,
+        num_dispatchers: int = 1,
+        prepare_fn: Optional[Callable[[List[str]], Any]] = None,
+        prepare_workers: int = 2,
+        max_queue: Optional[int] = None,
+        on_batch: Optional[Callable[[int, float], None]] = None,
+    ):
+        self.predict_fn = predict_fn
+        self.prepare_fn = prepare_fn
+        self.max_queue = max_queue
+        self.on_batch = on_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # Items are (job, index of the text within the job)
+        self._queue: "queue.Queue" = queue.Queue()
+        # Guards the counters and job bookkeeping shared by dispatchers
+        self._lock = threading.Lock()
+        self.batches_run = 0
+        self.texts_run = 0
+        threads = [
+            threading.Thread(target=self._run, name=f"micro-batcher-{n}", daemon=True)
+            for n in range(num_dispatchers)
+        ]
+        if prepare_fn is not None:
+            self._prepare_pool = ThreadPoolExecutor(prepare_workers, "micro-batcher-prepare")
+            # (items, Future of prepare_fn's output), in collection order
+            self._prepared: "queue.Queue" = queue.Queue(maxsize=num_dispatchers)
+            threads.append(
+                threading.Thread(target=self._prepare, name="micro-batcher-collect", daemon=True)
+            )
+        self._dispatchers = threads
+        for thread in self._dispatchers:
+            thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Texts submitted but not yet collected into a batch"""
+        return self._queue.qsize()
+
+    def submit(self, texts: Sequence[str]) -> Future:
+        job = _Job(texts)
+        if not job.texts:
+            job.future.set_result([])
+            return job.future
+        if self.max_queue is not None and self.queue_depth + len(job.texts) > self.max_queue:
+            raise queue.Full(f"{self.queue_depth} texts already queued (max {self.max_queue})")
+        for i in range(len(job.texts)):
+            self._queue.put((job, i))
+        return job.future
+
+    def predict(self, texts: Sequence[str], timeout: float = None) -> List:
+        """Blocking submit: the results for `texts`, in order."""
+        return self.submit(texts).result(timeout)
+
+    def _collect(self) -> list:
+        items = [self._queue.get()]  # Block until there is work
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Drain what is already queued without waiting
+                items.append(self._queue.get(block=remaining > 0, timeout=max(remaining, 0)))
+            except queue.Empty:
+                break
+        if self.on_batch is not None:
+            oldest = min(job.created for job, _ in items)
+            self.on_batch(len(items), time.monotonic() - oldest)
+        return items
+
+    def _prepare(self):
+        while True:
+            items = self._collect()
+            texts = [job.texts[i] for job, i in items]
+            # Blocks while the dispatchers are this many batches behind
+            self._prepared.put((items, self._prepare_pool.submit(self.prepare_fn, texts)))
+
+    def _next_batch(self):
+        """(items, predict_fn input) of the next batch to run"""
+        if self.prepare_fn is None:
+            items = self._collect()
+            return items, lambda: [job.texts[i] for job, i in items]
+        items, prepared = self._prepared.get()
+        return items, prepared.result
+
+    def _run(self):
+        while True:
+            items, batch = self._next_batch()
+            try:
+                results = self.predict_fn(batch())
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"predict_fn returned {len(results)} results for {len(items)} texts"
+                    )
+            except Exception as e:
+                # Fail every request that had texts in this batch
+                with self._lock:
+                    for job, _ in items:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches_run += 1
+                self.texts_run += len(items)
+                for (job, i), result in zip(items, results):
+                    if job.future.done():
+                        continue  # Already failed by an earlier batch
+                    job.results[i] = result
+                    job.remaining -= 1
+                    if job.remaining == 0:
+                        job.future.set_result(job.results)
@@ -0,0 +1,868 @@
+# =============================================================================
+# Benchmarks - run from the data directory (colab.py loads its CSV on import)
+#   python benchmark.py            # run everything
+#   python benchmark.py keywords   # run a single benchmark
+# =============================================================================
+# %%
+import random
+import sys
+import time
+
+SENTENCE_COUNTS = [1000, 5000, 10000]
+
+DERIVATIVE_SENTENCES = [
+    "We entered into interest rate swaps to convert fixed-rate debt to floating.",
+    "The notional amount of our foreign currency forward contracts was $120 million.",
+    "Commodity futures are used to hedge natural gas purchases.",
+    "Gains and losses on derivative instruments designated as cash flow hedges are deferred.",
+    "The Company does not hold derivative financial instruments for trading purposes.",
+]
+NEUTRAL_SENTENCES = [
+    "Revenue increased due to higher volumes in the retail segment.",
+    "Our headquarters are located in a leased facility.",
+    "The board of directors approved the annual budget.",
+    "Employees participate in a defined contribution plan.",
+    "Inventories are stated at the lower of cost or market.",
+    "Management believes the outcome of litigation will not be material.",
+]
+
+
+def timed(fn, *args, repeat: int = 3, **kwargs):
+    """Returns (best wall time in seconds, last result) over `repeat` runs."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def make_filing_text(num_sentences: int, derivative_share: float = 0.1, seed: int = 42) -> str:
+    """Synthetic filing body: mostly boilerplate with a sprinkle of derivative language."""
+    rng = random.Random(seed)
+    sentences = [
+        rng.choice(DERIVATIVE_SENTENCES if rng.random() < derivative_share else NEUTRAL_SENTENCES)
+        for _ in range(num_sentences)
+    ]
+    return " ".join(sentences)
+
+
+# =============================================================================
+# KEYWORD FILTERING
+# =============================================================================
+
+
+def bench_keywords():
+    """Legacy per-call substring scan vs. the precomputed keyword automaton."""
+    import colab
+
+    keywords = [kw.lower() for kw in colab.ALLOWED_KEYWORDS]
+    automaton = colab.ALLOWED_KEYWORD_AUTOMATON
+    backend = "pyahocorasick" if colab.ahocorasick else "substring fallback"
+    print(f"Automaton backend: {backend} ({len(keywords)} keywords)")
+
+    def legacy_scan(sentences):
+        return [any(kw in s.lower() for kw in keywords) for s in sentences]
+
+    def automaton_scan(sentences):
+        return [automaton.mask(s) != 0 for s in sentences]
+
+    print(f"{'sentences':>10} {'legacy':>10} {'automaton':>10} {'filter_by_keywords':>20}")
+    for n in SENTENCE_COUNTS:
+        text = make_filing_text(n)
+        sentences = [s for s in colab.SENTENCE_SPLIT_PATTERN.split(text) if s.strip()]
+        legacy_time, legacy = timed(legacy_scan, sentences)
+        automaton_time, fast = timed(automaton_scan, sentences)
+        assert legacy == fast, "automaton disagrees with substring scan"
+        filter_time, _ = timed(colab.filter_by_keywords, text, repeat=1)
+        print(f"{n:>10,} {legacy_time:>9.3f}s {automaton_time:>9.3f}s {filter_time:>19.3f}s")
+
+
+# =============================================================================
+# SNAPSHOTS
+# =============================================================================
+
+
+def bench_snapshot(checkpoints: int = 20, rows_per_chunk: int = 2000):
+    """Bytes shipped by full-file copies vs. incremental snapshots, plus a verified restore."""
+    import json
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+
+    from snapshot import DatabaseSnapshotter, _page_digests
+
+    paragraph = " ".join(DERIVATIVE_SENTENCES)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "web_data.db"
+        snapshotter = DatabaseSnapshotter(str(db_path), str(Path(tmp) / "snapshots"))
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE webpage_result (url TEXT, matches TEXT)")
+
+        full_bytes = incremental_bytes = 0
+        start = time.perf_counter()
+        for chunk in range(checkpoints):
+            rows = [
+                (f"https://example.com/{chunk}/{i}", json.dumps({"gen": [paragraph]}))
+                for i in range(rows_per_chunk)
+            ]
+            conn.executemany("INSERT INTO webpage_result VALUES (?, ?)", rows)
+            conn.commit()
+            full_bytes += db_path.stat().st_size
+            incremental_bytes += snapshotter.checkpoint()["bytes"]
+        checkpoint_time = time.perf_counter() - start
+        conn.close()
+
+        # Every checkpoint reads and hashes the whole file to find changed pages
+        hash_time, _ = timed(_page_digests, db_path, 4096)
+        db_mb = db_path.stat().st_size / 1024**2
+
+        restore_time, _ = timed(snapshotter.restore, str(Path(tmp) / "restored.db"), repeat=1)
+        restored = sqlite3.connect(Path(tmp) / "restored.db")
+        restored_rows = restored.execute("SELECT COUNT(*) FROM webpage_result").fetchone()[0]
+        restored.close()
+
+    print(f"Checkpoints: {checkpoints} x {rows_per_chunk:,} rows ({checkpoint_time:.2f}s total)")
+    print(f"Full copies shipped:   {full_bytes / 1024**2:10.1f} MB")
+    print(f"Incremental shipped:   {incremental_bytes / 1024**2:10.1f} MB")
+    print(f"Change scan per checkpoint: {hash_time:.3f}s for {db_mb:.1f} MB ({db_mb / hash_time:,.0f} MB/s)")
+    print(f"Restore + verify: {restore_time:.2f}s, {restored_rows:,} rows")
+    assert restored_rows == checkpoints * rows_per_chunk, "restore lost rows"
+
+
+# =============================================================================
+# SQLITE CONNECTIONS
+# =============================================================================
+
+
+def bench_connections(num_urls: int = 20000, lookups: int = 5000):
+    """Per-call sqlite3.connect vs. the shared per-thread connection for the URL existence check."""
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+
+    from db_connection import ConnectionManager
+
+    sql = "SELECT 1 FROM webpage_result WHERE url = ?"
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "web_data.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE webpage_result (url TEXT PRIMARY KEY, matches TEXT)")
+        conn.executemany(
+            "INSERT INTO webpage_result VALUES (?, '{}')",
+            [(f"https://example.com/{i}",) for i in range(num_urls)],
+        )
+        conn.commit()
+        conn.close()
+        urls = [f"https://example.com/{i * 7 % (2 * num_urls)}" for i in range(lookups)]
+
+        def per_call():
+            hits = 0
+            for url in urls:
+                conn = sqlite3.connect(db_path)
+                hits += conn.execute(sql, (url,)).fetchone() is not None
+                conn.close()
+            return hits
+
+        manager = ConnectionManager(db_path)
+
+        def shared():
+            return sum(manager.execute(sql, (url,)).fetchone() is not None for url in urls)
+
+        per_call_time, per_call_hits = timed(per_call)
+        shared_time, shared_hits = timed(shared)
+        manager.close_all()
+        assert per_call_hits == shared_hits, "lookups disagree"
+
+    print(f"Lookups: {lookups:,} ({shared_hits:,} hits)")
+    print(f"connect per call:  {per_call_time:8.3f}s ({per_call_time / lookups * 1e6:6.1f} us/lookup)")
+    print(f"shared connection: {shared_time:8.3f}s ({shared_time / lookups * 1e6:6.1f} us/lookup)")
+
+
+# =============================================================================
+# SCHEMA INDEXES
+# =============================================================================
+
+
+def bench_schema(num_reports: int = 20000, lookups: int = 2000):
+    """Existence check and report joins before and after the v2 keys/covering indexes."""
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+
+    import schema
+
+    queries = {
+        "existence check": None,
+        "webpage/report/server join": """
+            SELECT r.cik, r.year, w.url, LENGTH(w.matches), LENGTH(s.server_response)
+            FROM webpage_result w
+            JOIN report_data r ON w.url = r.url
+            JOIN server_result s ON w.url = s.url
+        """,
+        "report lookup by url": """
+            SELECT r.cik, r.year FROM server_result s JOIN report_data r ON s.url = r.url
+        """,
+    }
+    # Whichever script ran first owned url_idx; the other CREATE INDEX was a no-op
+    layouts = {
+        "url_idx on report_data": "CREATE INDEX url_idx ON report_data (url)",
+        "url_idx on server_result": "CREATE INDEX url_idx ON server_result (url)",
+    }
+
+    for layout, index_sql in layouts.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "web_data.db")
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE report_data (cik INTEGER, year INTEGER, url TEXT, form_type TEXT)")
+            conn.execute("CREATE TABLE webpage_result (url TEXT, matches TEXT)")
+            conn.execute("CREATE TABLE server_result (url TEXT PRIMARY KEY, server_response BLOB)")
+            conn.execute(index_sql)
+            rows = [(i, 2000 + i % 20, f"https://example.com/{i}") for i in range(num_reports)]
+            conn.executemany("INSERT INTO report_data VALUES (?, ?, ?, '10-K')", rows)
+            conn.executemany("INSERT INTO webpage_result VALUES (?, '{}')", [(r[2],) for r in rows])
+            conn.executemany("INSERT INTO server_result VALUES (?, x'0110')", [(r[2],) for r in rows])
+            conn.commit()
+            urls = [f"https://example.com/{i * 13 % (2 * num_reports)}" for i in range(lookups)]
+
+            def run(name):
+                if queries[name] is None:
+                    return sum(
+                        conn.execute("SELECT 1 FROM webpage_result WHERE url = ?", (u,)).fetchone()
+                        is not None
+                        for u in urls
+                    )
+                return len(conn.execute(queries[name]).fetchall())
+
+            before = {name: timed(run, name) for name in queries}
+            schema.migrate(conn)
+            after = {name: timed(run, name) for name in queries}
+            conn.close()
+
+        print(f"\n{layout} ({num_reports:,} reports, {lookups:,} lookups)")
+        print(f"{'query':>28} {'before':>10} {'after':>10} {'speedup':>8}")
+        for name in queries:
+            (t0, r0), (t1, r1) = before[name], after[name]
+            assert r0 == r1, f"{name} changed its result"
+            print(f"{name:>28} {t0:>9.3f}s {t1:>9.3f}s {t0 / t1:>7.1f}x")
+
+
+# =============================================================================
+# QUANTIZED PREDICTION STORAGE
+# =============================================================================
+
+
+def bench_quantization(num_reports: int = 200, sentences_per_report: int = 100):
+    """Size and decode time of server_response as JSON vs. quantized uint16 BLOBs."""
+    import json
+
+    import numpy as np
+
+    from quantization import LABELS, decode_matrix, decode_predictions, encode_predictions
+
+    rng = random.Random(42)
+    reports = [
+        [
+            {label: round(rng.random(), 3) for label in LABELS}
+            for _ in range(sentences_per_report)
+        ]
+        for _ in range(num_reports)
+    ]
+    json_blobs = [json.dumps(report) for report in reports]
+    packed_blobs = [encode_predictions(report) for report in reports]
+
+    json_time, _ = timed(lambda: [json.loads(b) for b in json_blobs])
+    matrix_time, matrices = timed(lambda: [decode_matrix(b) for b in packed_blobs])
+    dict_time, decoded = timed(lambda: [decode_predictions(b) for b in packed_blobs])
+    for report, matrix, restored in zip(reports, matrices, decoded):
+        expected = np.array([[row[l] for l in LABELS] for row in report], dtype=np.float32)
+        assert np.array_equal(matrix, expected), "lossy at 0.001"
+        assert restored == report, "lossy at 0.001"
+
+    json_bytes = sum(len(b) for b in json_blobs)
+    packed_bytes = sum(len(b) for b in packed_blobs)
+    print(f"Reports: {num_reports} x {sentences_per_report} sentences")
+    print(f"JSON:            {json_bytes / 1024**2:8.2f} MB, decode {json_time:.3f}s")
+    print(f"uint16 (matrix): {packed_bytes / 1024**2:8.2f} MB, decode {matrix_time:.3f}s "
+          f"({json_bytes / packed_bytes:.1f}x smaller, lossless at 0.001)")
+    print(f"uint16 (dicts):  {'':8s}    decode {dict_time:.3f}s")
+
+
+# =============================================================================
+# JSON CODEC
+# =============================================================================
+
+
+def bench_json_codec(num_blobs: int = 500, sentences_per_blob: int = 128):
+    """stdlib json vs. json_codec on /predict-response-sized prediction blobs."""
+    import json
+
+    import json_codec
+    from quantization import LABELS
+
+    rng = random.Random(42)
+    responses = [
+        {
+            "predictions": [
+                {label: round(rng.random(), 3) for label in LABELS}
+                for _ in range(sentences_per_blob)
+            ]
+        }
+        for _ in range(num_blobs)
+    ]
+    blobs = [json.dumps(r).encode() for r in responses]
+
+    cases = [
+        ("encode", lambda: [json.dumps(r).encode() for r in responses],
+         lambda: [json_codec.dumpb(r) for r in responses]),
+        ("decode", lambda: [json.loads(b) for b in blobs],
+         lambda: [json_codec.decode_predictions(b) for b in blobs]),
+        ("decode to arrays",
+         lambda: [[[p[l] for l in LABELS] for p in json.loads(b)["predictions"]] for b in blobs],
+         lambda: [json_codec.decode_probabilities(b, LABELS) for b in blobs]),
+    ]
+    print(f"Backend: {json_codec.BACKEND}")
+    print(f"Blobs: {num_blobs} x {sentences_per_blob} sentences "
+          f"({sum(map(len, blobs)) / num_blobs / 1024:.1f} KB each)")
+    print(f"{'':>18} {'stdlib':>10} {'codec':>10} {'speedup':>8}")
+    for name, stdlib_fn, codec_fn in cases:
+        t0, _ = timed(stdlib_fn)
+        t1, _ = timed(codec_fn)
+        print(f"{name:>18} {t0:>9.3f}s {t1:>9.3f}s {t0 / t1:>7.1f}x")
+
+    decoded = json_codec.decode_probabilities(blobs[0], LABELS)
+    expected = responses[0]["predictions"]
+    assert all(
+        abs(row[i] - p[label]) < 1e-6
+        for row, p in zip(decoded, expected)
+        for i, label in enumerate(LABELS)
+    ), "typed decode changed the probabilities"
+
+
+def bench_response_formats(num_responses: int = 200, texts_per_response: int = 256):
+    """/predict response bytes and encode + decode time: JSON dicts vs. binary matrices."""
+    import io
+
+    import numpy as np
+
+    import json_codec
+    from quantization import LABELS, decode_matrix, encode_matrix
+
+    rng = np.random.default_rng(42)
+    matrices = [
+        rng.random((texts_per_response, len(LABELS)), dtype=np.float32)
+        for _ in range(num_responses)
+    ]
+
+    def json_encode(m):
+        # Old server: per-element .item()/round() into one dict per text
+        return json_codec.dumpb(
+            {"predictions": [{l: round(float(p), 3) for l, p in zip(LABELS, row)} for row in m]}
+        )
+
+    def npy_encode(m):
+        buffer = io.BytesIO()
+        np.save(buffer, m.astype(np.float16), allow_pickle=False)
+        return buffer.getvalue()
+
+    formats = [
+        ("json", json_encode, lambda b: json_codec.decode_probabilities(b, LABELS)),
+        ("packed uint16", encode_matrix, decode_matrix),
+        ("npy float16", npy_encode, lambda b: np.load(io.BytesIO(b))),
+    ]
+    print(f"Responses: {num_responses} x {texts_per_response} texts")
+    print(f"{'':>14} {'KB each':>9} {'encode':>9} {'decode':>9} {'total':>9}")
+    baseline = None
+    for name, encode, decode in formats:
+        t_encode, blobs = timed(lambda: [encode(m) for m in matrices])
+        t_decode, decoded = timed(lambda: [decode(b) for b in blobs])
+        total = t_encode + t_decode
+        baseline = baseline or total
+        size = sum(map(len, blobs)) / num_responses / 1024
+        print(f"{name:>14} {size:>9.1f} {t_encode:>8.3f}s {t_decode:>8.3f}s "
+              f"{total:>8.3f}s ({baseline / total:.1f}x)")
+        error = np.abs(np.stack(decoded[0]).astype(np.float32) - matrices[0]).max()
+        assert error < 1e-3, f"{name} changed the probabilities"
+
+
+# =============================================================================
+# DICTIONARY-COMPRESSED TEXT
+# =============================================================================
+
+
+def bench_text_compression(num_paragraphs: int = 20_000, sentences_per_paragraph: int = 8):
+    """Stored paragraph size: raw vs. per-value zstd vs. zstd with a trained dictionary."""
+    import zstandard
+
+    from text_compression import DICT_SIZE, LEVEL, RECOMPRESS_LEVEL
+
+    rng = random.Random(42)
+    paragraphs = [
+        make_filing_text(sentences_per_paragraph, derivative_share=0.5, seed=rng.random())
+        + f" As of December 31, {rng.randint(2000, 2024)}, the fair value was "
+        f"${rng.randint(1, 999)}.{rng.randint(0, 9)} million."
+        for _ in range(num_paragraphs)
+    ]
+    encoded = [p.encode("utf-8") for p in paragraphs]
+    # Train on a sample, as text_compression.train does
+    dictionary = zstandard.train_dictionary(
+        DICT_SIZE, rng.sample(encoded, 5000), level=RECOMPRESS_LEVEL
+    )
+
+    plain = zstandard.ZstdCompressor(level=LEVEL)
+    plain_frames = [plain.compress(p) for p in encoded]
+    # Live writes (LEVEL) vs. the offline recompression (RECOMPRESS_LEVEL)
+    levels = {}
+    for level in (LEVEL, RECOMPRESS_LEVEL):
+        with_dict = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+        levels[level] = timed(lambda: [with_dict.compress(p) for p in encoded])
+    dict_frames = levels[RECOMPRESS_LEVEL][1]
+
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    decode_time, restored = timed(lambda: [decompressor.decompress(f) for f in dict_frames])
+    assert restored == encoded
+
+    raw_bytes = sum(map(len, encoded))
+    print(f"Paragraphs: {num_paragraphs:,} (avg {raw_bytes / num_paragraphs:.0f} bytes)")
+    print(f"{'zstd':>24}: {sum(map(len, plain_frames)) / 1024**2:6.2f} MB "
+          f"({raw_bytes / sum(map(len, plain_frames)):.1f}x smaller)")
+    for level, (seconds, frames) in levels.items():
+        size = sum(map(len, frames))
+        print(f"{f'zstd + dictionary, -{level}':>24}: {size / 1024**2:6.2f} MB "
+              f"({raw_bytes / size:.1f}x smaller), compress {seconds:.3f}s")
+    print(f"Decompress all with dictionary: {decode_time:.3f}s")
+
+
+# =============================================================================
+# SENTENCE LOADING (SQL vs. PARQUET)
+# =============================================================================
+
+
+def bench_parquet(num_reports: int = 2000, sentences_per_report: int = 50):
+    """Full SQL sentence load vs. the Parquet export with projection and a year filter."""
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+
+    import sentence_store
+    from custom_analyzers.analysis import Config, DataLoader
+    from custom_analyzers.export import ParquetExporter
+
+    rng = random.Random(42)
+    paragraph = " ".join(DERIVATIVE_SENTENCES)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "web_data.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE report_data (cik INTEGER, year INTEGER, url TEXT, form_type TEXT)")
+        conn.execute("CREATE INDEX url_idx ON report_data (url)")
+        sentence_store.create_tables(conn)
+        for r in range(num_reports):
+            url = f"https://example.com/{r}"
+            conn.execute(
+                "INSERT INTO report_data VALUES (?, ?, ?, '10-K')", (r, 2000 + r % 20, url)
+            )
+            sentence_store.save_sentences(conn, url, {"gen": [paragraph] * sentences_per_report})
+            sentence_store.save_predictions(
+                conn,
+                url,
+                [
+                    {label: round(rng.random(), 3) for label in sentence_store.LABELS}
+                    for _ in range(sentences_per_report)
+                ],
+            )
+        conn.commit()
+        conn.close()
+
+        config = Config(db_path=str(db_path), output_dir=Path(tmp) / "out", is_colab=False)
+        loader = DataLoader(config)
+        columns = ["cik", "year", "url", "p_ir_use", "p_curr"]
+
+        sql_time, sql_df = timed(loader.load_sentence_data, repeat=1)
+        export_time, _ = timed(ParquetExporter(config).export, repeat=1)
+        full_time, full_df = timed(loader.load_sentence_data)
+        projected_time, _ = timed(loader.load_sentence_data, columns=columns)
+        year_time, year_df = timed(loader.load_sentence_data, columns=columns, years=[2015])
+        assert len(full_df) == len(sql_df), "Parquet export lost rows"
+
+    print(f"Sentences: {len(sql_df):,}")
+    print(f"SQL join (all columns):     {sql_time:8.3f}s")
+    print(f"Parquet export (one-off):   {export_time:8.3f}s")
+    print(f"Parquet (all columns):      {full_time:8.3f}s")
+    print(f"Parquet ({len(columns)} columns):        {projected_time:8.3f}s")
+    print(f"Parquet (+ year=2015):      {year_time:8.3f}s, {len(year_df):,} rows")
+
+
+# =============================================================================
+# ENTRY POINT
+# =============================================================================
+
+# =============================================================================
+# SERVER MICRO-BATCHING
+# =============================================================================
+
+
+def _latency_run(predict, num_clients: int, requests_per_client: int, texts_per_request: int):
+    """Concurrent clients calling predict(texts); returns (seconds, latencies)."""
+    import threading
+
+    latencies = []
+    lock = threading.Lock()
+
+    def client(c):
+        for r in range(requests_per_client):
+            texts = [f"client {c} request {r} text {i}" for i in range(texts_per_request)]
+            start = time.perf_counter()
+            results = predict(texts)
+            elapsed = time.perf_counter() - start
+            assert results == [len(t) for t in texts]
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(num_clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def bench_batching(
+    num_clients: int = 32,
+    requests_per_client: int = 10,
+    texts_per_request: int = 4,
+    pass_overhead: float = 0.015,
+    per_text: float = 0.0005,
+):
+    """
+    Per-request forward passes vs. MicroBatcher, with a simulated model whose
+    forward pass costs a fixed overhead plus a per-text cost and runs one at
+    a time (passes compete for the same cores).
+    """
+    import threading
+
+    from batching import MicroBatcher
+
+    model_lock = threading.Lock()
+
+    def forward(texts):
+        with model_lock:
+            time.sleep(pass_overhead + per_text * len(texts))
+        return [len(t) for t in texts]
+
+    batcher = MicroBatcher(forward)
+    total_texts = num_clients * requests_per_client * texts_per_request
+    print(f"{num_clients} clients x {requests_per_client} requests x {texts_per_request} texts; "
+          f"forward = {pass_overhead * 1000:.0f} ms + {per_text * 1000:.1f} ms/text")
+    print(f"{'':>12} {'texts/s':>9} {'p50':>8} {'p99':>8}")
+    for name, predict in [("per-request", forward), ("batched", batcher.predict)]:
+        seconds, latencies = _latency_run(
+            predict, num_clients, requests_per_client, texts_per_request
+        )
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:>12} {total_texts / seconds:>9.0f} {p50 * 1000:>6.0f}ms {p99 * 1000:>6.0f}ms")
+    print(f"Batched: {batcher.texts_run / batcher.batches_run:.1f} texts per forward pass")
+
+
+def bench_tokenizer_pipeline(
+    num_clients: int = 32,
+    requests_per_client: int = 10,
+    texts_per_request: int = 8,
+    tokenize_per_text: float = 0.0004,
+    pass_overhead: float = 0.010,
+    per_text: float = 0.001,
+):
+    """
+    Tokenizing inside the batch's predict_fn vs. the pipelined prepare stage,
+    with simulated tokenizer and model calls that release the GIL (as the
+    Rust tokenizer and the model's kernels do); the model runs one pass at a
+    time.
+    """
+    import threading
+
+    from batching import MicroBatcher
+
+    model_lock = threading.Lock()
+
+    def tokenize(texts):
+        time.sleep(tokenize_per_text * len(texts))
+        return texts
+
+    def forward(texts):
+        with model_lock:
+            time.sleep(pass_overhead + per_text * len(texts))
+        return [len(t) for t in texts]
+
+    total_texts = num_clients * requests_per_client * texts_per_request
+    print(f"{num_clients} clients x {requests_per_client} requests x {texts_per_request} texts; "
+          f"tokenize = {tokenize_per_text * 1000:.1f} ms/text, "
+          f"forward = {pass_overhead * 1000:.0f} ms + {per_text * 1000:.1f} ms/text")
+    print(f"{'':>10} {'texts/s':>9} {'p50':>8} {'p99':>8}")
+    batchers = [
+        ("inline", MicroBatcher(lambda texts: forward(tokenize(texts)))),
+        ("pipelined", MicroBatcher(forward, prepare_fn=tokenize)),
+    ]
+    for name, batcher in batchers:
+        seconds, latencies = _latency_run(
+            batcher.predict, num_clients, requests_per_client, texts_per_request
+        )
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:>10} {total_texts / seconds:>9.0f} {p50 * 1000:>6.0f}ms {p99 * 1000:>6.0f}ms")
+
+
+def bench_length_buckets(
+    num_texts: int = 20_000, pool_size: int = 256, batch_size: int = 64, hidden: int = 768
+):
+    """
+    Padding and modeled encoder cost of arrival-order batches vs. length
+    buckets. Token lengths follow the extracted paragraphs (500-1200 chars,
+    ~4.5 chars/token, a few short or truncated ones). Cost per pass is
+    batch x L x (linear + attention terms), i.e. proportional to the FLOPs
+    spent on padded sequences of length L.
+    """
+    from batching import PaddingStats, length_buckets
+
+    rng = random.Random(42)
+    lengths = []
+    for _ in range(num_texts):
+        roll = rng.random()
+        chars = rng.randint(500, 1200) if roll < 0.9 else rng.randint(150, 2600)
+        lengths.append(min(512, max(8, round(chars / 4.5))))
+
+    def pass_cost(batch_lengths):
+        longest = max(batch_lengths)
+        # Per layer: ~12 h^2 per token for projections/FFN + 2 L h for attention
+        return len(batch_lengths) * longest * (12 * hidden * hidden + 2 * longest * hidden)
+
+    strategies = {
+        "arrival order": lambda pool: [
+            list(range(i, min(i + batch_size, len(pool)))) for i in range(0, len(pool), batch_size)
+        ],
+        "length buckets": lambda pool: length_buckets(pool, max_batch_size=batch_size),
+    }
+    print(f"{num_texts:,} texts, pools of {pool_size}, batches of <= {batch_size}")
+    print(f"{'':>15} {'padding':>8} {'relative tokens/s':>18}")
+    baseline = None
+    for name, split in strategies.items():
+        stats = PaddingStats()
+        for start in range(0, num_texts, pool_size):
+            pool = lengths[start : start + pool_size]
+            for bucket in split(pool):
+                batch_lengths = [pool[i] for i in bucket]
+                stats.record(batch_lengths, pass_cost(batch_lengths))
+        snap = stats.snapshot()
+        rate = snap["tokens"] / stats.seconds
+        baseline = baseline or rate
+        print(f"{name:>15} {snap['padding_fraction']:>8.1%} {rate / baseline:>17.2f}x")
+
+
+def bench_sliding_windows(
+    num_texts: int = 20_000, pool_size: int = 256, batch_size: int = 64, hidden: int = 768
+):
+    """
+    Mixed-length inputs (10% longer than 512 tokens): truncation vs. sliding
+    windows run per input vs. windows batched with everything else. Reports
+    the share of input tokens the model saw and the modeled encoder cost
+    (same FLOP model as length_buckets) relative to truncation.
+    """
+    from batching import PaddingStats, length_buckets
+    from inference import MAX_LENGTH, sliding_windows
+
+    rng = random.Random(42)
+    lengths = []
+    for _ in range(num_texts):
+        roll = rng.random()
+        if roll < 0.9:
+            lengths.append(rng.randint(60, 300))
+        else:
+            lengths.append(rng.randint(513, 2500))  # Expanded hedge-policy paragraphs
+
+    def pass_cost(batch_lengths):
+        longest = max(batch_lengths)
+        return len(batch_lengths) * longest * (12 * hidden * hidden + 2 * longest * hidden)
+
+    def windows(length):
+        return [len(w) for w in sliding_windows(list(range(length)))]
+
+    def run(split_pool):
+        stats = PaddingStats()
+        for start in range(0, num_texts, pool_size):
+            for batch in split_pool(lengths[start : start + pool_size]):
+                stats.record(batch, pass_cost(batch))
+        return stats
+
+    def truncated(pool):
+        sequences = [min(n, MAX_LENGTH) for n in pool]
+        return [[sequences[i] for i in b] for b in length_buckets(sequences, max_batch_size=batch_size)]
+
+    def per_input(pool):
+        short = [n for n in pool if n <= MAX_LENGTH]
+        batches = [[short[i] for i in b] for b in length_buckets(short, max_batch_size=batch_size)]
+        return batches + [windows(n) for n in pool if n > MAX_LENGTH]
+
+    def batched(pool):
+        sequences = [w for n in pool for w in windows(n)]
+        return [[sequences[i] for i in b] for b in length_buckets(sequences, max_batch_size=batch_size)]
+
+    total = sum(lengths)
+    covered = {
+        "truncate": sum(min(n, MAX_LENGTH) for n in lengths),
+        # Nothing is dropped below MAX_WINDOWS windows (~6,000 tokens)
+        "windows per input": total,
+        "windows batched": total,
+    }
+    print(f"{num_texts:,} texts, {sum(n > MAX_LENGTH for n in lengths):,} longer than {MAX_LENGTH} tokens")
+    print(f"{'':>18} {'tokens seen':>12} {'passes':>7} {'padding':>8} {'cost':>7}")
+    baseline = None
+    for name, split in (("truncate", truncated), ("windows per input", per_input), ("windows batched", batched)):
+        stats = run(split)
+        baseline = baseline or stats.seconds
+        snap = stats.snapshot()
+        print(f"{name:>18} {covered[name] / total:>12.1%} {snap['forward_passes']:>7,} "
+              f"{snap['padding_fraction']:>8.1%} {stats.seconds / baseline:>6.2f}x")
+
+
+def _cpu_forward(texts):
+    """Stand-in for a forward pass: CPU-bound work proportional to the batch."""
+    total = 0
+    for text in texts:
+        for i in range(20_000):
+            total += i * len(text)
+    return [len(t) for t in texts]
+
+
+def bench_worker_pool(num_requests: int = 64, texts_per_request: int = 8):
+    """Batched throughput with 1..N pinned worker processes (N = cores, up to 8)."""
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    from batching import MicroBatcher
+    from worker_pool import WorkerPool
+
+    cores = len(os.sched_getaffinity(0))
+    requests = [[f"request {r} text {i}" for i in range(texts_per_request)] for r in range(num_requests)]
+    counts = sorted({1, 2, 4, min(cores, 8)} & set(range(1, cores + 1)))
+    print(f"{num_requests} requests x {texts_per_request} texts, {cores} cores available")
+    baseline = None
+    for workers in counts:
+        pool = WorkerPool(_cpu_forward, workers)
+        batcher = MicroBatcher(pool.call, max_batch_size=16, num_dispatchers=workers)
+        with ThreadPoolExecutor(max_workers=32) as clients:
+            seconds, _ = timed(lambda: list(clients.map(batcher.predict, requests)), repeat=1)
+        pool.close()
+        rate = num_requests * texts_per_request / seconds
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {rate:8.0f} texts/s ({rate / baseline:.2f}x)")
+
+
+def bench_prediction_cache(num_requests: int = 100, texts_per_request: int = 32, boilerplate_share: float = 0.6):
+    """Server time with and without the prediction cache on a boilerplate-heavy stream."""
+    import os
+    import tempfile
+
+    import numpy as np
+
+    from prediction_cache import PredictionCache
+    from quantization import LABELS
+
+    rng = random.Random(42)
+    boilerplate = [make_filing_text(4, seed=i) for i in range(200)]
+    requests = [
+        [
+            rng.choice(boilerplate) if rng.random() < boilerplate_share
+            else make_filing_text(4, seed=1000 + r * texts_per_request + i)
+            for i in range(texts_per_request)
+        ]
+        for r in range(num_requests)
+    ]
+
+    def forward(texts):
+        _cpu_forward(texts)
+        return np.full((len(texts), len(LABELS)), 0.5, dtype=np.float32)
+
+    def serve(cache):
+        for texts in requests:
+            if cache is None:
+                forward(texts)
+            else:
+                cache.predict(texts, forward)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t_none, _ = timed(serve, None, repeat=1)
+        cold = PredictionCache("bench", len(LABELS), path=os.path.join(tmp, "cache.db"))
+        t_cold, _ = timed(serve, cold, repeat=1)
+        snap = cold.snapshot()
+        cold.close()
+        # Restarted server: memory empty, rows come back from disk
+        warm = PredictionCache("bench", len(LABELS), path=os.path.join(tmp, "cache.db"))
+        t_warm, _ = timed(serve, warm, repeat=1)
+        warm.close()
+
+    print(f"{num_requests} requests x {texts_per_request} texts, {boilerplate_share:.0%} boilerplate")
+    print(f"{'no cache':>22}: {t_none:.3f}s")
+    print(f"{'cold cache':>22}: {t_cold:.3f}s ({t_none / t_cold:.1f}x, hit rate {snap['hit_rate']:.1%})")
+    print(f"{'restarted (disk hits)':>22}: {t_warm:.3f}s ({t_none / t_warm:.1f}x)")
+
+
+def bench_year_buckets(
+    num_firms: int = 200, years: range = range(2001, 2021), paragraphs: int = 30, carry_over: float = 0.8
+):
+    """
+    Prediction-cache hit rate of a crawl by server.py's YEAR_BUCKET_SIZE. The
+    cache key includes the year prefix, so a paragraph a firm repeats from
+    one year to the next only hits when both years fall into the same bucket.
+    Each firm keeps `carry_over` of its paragraphs from the previous year.
+    """
+    rng = random.Random(42)
+    reports = []
+    for firm in range(num_firms):
+        current = [f"firm {firm} paragraph {i}" for i in range(paragraphs)]
+        for year in years:
+            current = [
+                text if rng.random() < carry_over else f"firm {firm} {year} paragraph {i}"
+                for i, text in enumerate(current)
+            ]
+            reports.append((year, current))
+
+    total = num_firms * len(years) * paragraphs
+    print(f"{num_firms} firms x {len(years)} years x {paragraphs} paragraphs, {carry_over:.0%} carried over")
+    for size in (1, 2, 5, 10, 0):
+        seen = set()
+        hits = 0
+        for year, texts in reports:
+            bucket = year - year % size if size > 0 else None
+            for text in texts:
+                hits += (bucket, text) in seen
+                seen.add((bucket, text))
+        label = "0 (no year)" if size == 0 else str(size)
+        print(f"YEAR_BUCKET_SIZE={label:>11}: hit rate {hits / total:6.1%}, {len(seen):,} cache entries")
+
+
+BENCHMARKS = {
+    "keywords": bench_keywords,
+    "snapshot": bench_snapshot,
+    "connections": bench_connections,
+    "schema": bench_schema,
+    "quantization": bench_quantization,
+    "json_codec": bench_json_codec,
+    "response_formats": bench_response_formats,
+    "text_compression": bench_text_compression,
+    "batching": bench_batching,
+    "length_buckets": bench_length_buckets,
+    "tokenizer_pipeline": bench_tokenizer_pipeline,
+    "sliding_windows": bench_sliding_windows,
+    "worker_pool": bench_worker_pool,
+    "prediction_cache": bench_prediction_cache,
+    "year_buckets": bench_year_buckets,
+    "parquet": bench_parquet,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        print("=" * 70)
+        print(f"BENCHMARK: {name}")
+        print("=" * 70)
+        BENCHMARKS[name]()
@@ -10,11 +10,18 @@ import time
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from collections import Counter
-import subprocess
 from pathlib import Path
 import multiprocessing as mp
 import psutil
 
+from snapshot import restore_or_copy, save_snapshot
+import schema
+import json_codec
+import sentence_store
+from batching import length_buckets
+from quantization import LABELS, decode_matrix
+from db_connection import get_manager
+
 
 # =============================================================================
 # CONFIGURATION
@@ -23,6 +30,8 @@ import psutil
 DB_PATH = "web_data.db"
 REPORT_CSV_PATH = "./report_data.csv"
 SERVER_URL = "http://127.0.0.1:5000/predict"
+PACKED_MIMETYPE = "application/x-predictions"  # See server.py
+SERVER_MAX_RETRIES = 5  # 503s (server queue full) retried after Retry-After
 KEYWORDS_FILE = "./keywords_find.json"
 DEBUG = False  # Debug printing
 CHUNK_SIZE = 100  # Base chunk size, will be adjusted based on RAM
@@ -34,7 +43,7 @@ DRIVE_PATH = "./drive/MyDrive/db"
 DRIVE_SENTENCE_PATH = "sentence_results"
 DRIVE_KEYWORDS_PATH = "keywords_results"
 LOAD_SHELL_CMD = f"cp {DRIVE_PATH}/{DB_PATH} ."
-SAVE_SHELL_CMD = f"cp {DB_PATH} {DRIVE_PATH}/."
+SNAPSHOT_DIR = f"{DRIVE_PATH}/snapshots"  # Incremental page snapshots of DB_PATH
 IS_COLAB = Path(DRIVE_PATH).exists()
 
 def get_system_config():
@@ -67,7 +76,7 @@ if IS_COLAB:
     print("Running in Google Colab environment")
     if not Path(DB_PATH).exists():
         print("Loading database from Google Drive...")
-        subprocess.run(LOAD_SHELL_CMD, shell=True)
+        restore_or_copy(DB_PATH, SNAPSHOT_DIR, LOAD_SHELL_CMD)
 else:
     print("Running in local environment")
 # %%
@@ -99,95 +108,42 @@ def format_time(seconds):
 
 
 def create_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS server_result (
-                url TEXT PRIMARY KEY,
-                server_response TEXT,
-                FOREIGN KEY (url) REFERENCES report_data (url)
-            )
-        """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fail_results (
-                cik INTEGER,
-                year INTEGER,
-                url TEXT PRIMARY KEY
-            )
-        """
-        )
-        c.execute(
-            """
-            CREATE INDEX IF NOT EXISTS url_idx ON server_result (url)
-            """
-        )
-    except sqlite3.IntegrityError:
-        debug_print("Something went wrong creating the database")
-    finally:
-        conn.commit()
-        conn.close()
+    """Creates missing tables and applies pending schema migrations (schema.py)."""
+    schema.migrate(get_manager(DB_PATH).connection())
 
 
 def get_matches(url):
     """
-    Fetch matches from webpage_result, which has (url, matches).
+    Fetch the paragraphs of a report in classification order, from the
+    sentences table (create_db has backfilled it from the old JSON matches).
     Return: a list
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM webpage_result WHERE url=?", (url,))
-    columns = [col[0] for col in c.description]
-    result = c.fetchone()
-    conn.close()
-    if not result:
-        return []
-    data = pd.DataFrame([result], columns=columns)    
-    # Load the matches, which is now a dictionary from colab.py
-    categorized_matches = json.loads(data.matches.iloc[0])
-
-    # Flatten the dictionary of lists into a single list of sentences
-    # Ensure it's a dictionary before trying to iterate over its values
-    if isinstance(categorized_matches, dict):
-        flattened_sentences = []
-        for category_sentences in categorized_matches.values():
-            if isinstance(category_sentences, list): # Ensure the value is a list
-                flattened_sentences.extend(category_sentences)
-        return flattened_sentences
-    else:
-        # Fallback for old format or unexpected data, treat as a list if it is
-        if isinstance(categorized_matches, list):
-            return categorized_matches
-        else:
-            return [] # Return empty list if it's neither a dict nor a list
+    return sentence_store.get_sentence_texts(get_manager(DB_PATH).connection(), url)
 
 
 def fetch_server_results():
     """
-    Fetch results from server_result
+    Fetch classified reports, with server_response rebuilt from the
+    predictions table as a list of {label: probability} dicts
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM server_result")
-    columns = [col[0] for col in c.description]
-    rows = c.fetchall()
-    pre_data = pd.DataFrame(rows, columns=columns)
-    conn.close()
-    return pre_data
+    c = get_manager(DB_PATH).connection().cursor()
+    c.execute(
+        f"SELECT s.url, p.idx, p.failed, {', '.join('p.' + col for col in sentence_store.PROB_COLUMNS)} "
+        "FROM server_result s LEFT JOIN predictions p ON p.url = s.url ORDER BY s.url, p.idx"
+    )
+    responses = {}
+    for url, idx, failed, *values in c:
+        report = responses.setdefault(url, [])
+        if idx is not None:
+            report.append(sentence_store.prediction_from_row(values, failed))
+    return pd.DataFrame({"url": list(responses), "server_response": list(responses.values())})
 
 
 def get_processed_server_urls() -> set:
     """
     Return a set of URLs that are already processed in `server_result`.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT url FROM server_result")
-    rows = c.fetchall()
-    conn.close()
+    rows = get_manager(DB_PATH).execute("SELECT url FROM server_result").fetchall()
     return set(url for (url,) in rows)
 
 
@@ -195,14 +151,14 @@ def save_process_result(df):
     """
     Inserts a new item into the server_result table
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_manager(DB_PATH).connection()
     c = conn.cursor()
     try:
-        c.execute(
-            "INSERT OR REPLACE INTO server_result (url, server_response) VALUES (?, ?)",
-            (df.url, json.dumps(df.server_response)),
-        )
+        # server_result only marks the report as classified; predictions holds the rows
+        c.execute("INSERT OR IGNORE INTO server_result (url) VALUES (?)", (df.url,))
+        sentence_store.save_predictions(conn, df.url, df.server_response)
     except sqlite3.Error as e:
+        conn.rollback()
         debug_print(f"DB error on {df.url}: {e}")
         # Get cik and year from report_data for fail_results
         c.execute("SELECT cik, year FROM report_data WHERE url=?", (df.url,))
@@ -215,7 +171,6 @@ def save_process_result(df):
             )
 
     conn.commit()
-    conn.close()
 
 
 def save_batch_results(results_buffer):
@@ -225,7 +180,7 @@ def save_batch_results(results_buffer):
     if not results_buffer:
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_manager(DB_PATH).connection()
     c = conn.cursor()
 
     success_count = 0
@@ -234,11 +189,14 @@ def save_batch_results(results_buffer):
     try:
         # Prepare batch data
         batch_data = []
+        saved_results = []
         fail_data = []
 
         for result in results_buffer:
             try:
-                batch_data.append((result.url, json.dumps(result.server_response)))
+                rows = sentence_store.prediction_rows(result.url, result.server_response)
+                batch_data.append((result.url,))
+                saved_results.append((result, rows))
             except Exception as e:
                 debug_print(f"Error preparing data for {result.url}: {e}")
                 # Get cik and year from report_data for fail_results
@@ -253,10 +211,9 @@ def save_batch_results(results_buffer):
 
         # Batch insert successful results
         if batch_data:
-            c.executemany(
-                "INSERT OR REPLACE INTO server_result (url, server_response) VALUES (?, ?)",
-                batch_data,
-            )
+            c.executemany("INSERT OR IGNORE INTO server_result (url) VALUES (?)", batch_data)
+            for result, rows in saved_results:
+                sentence_store.save_predictions(conn, result.url, result.server_response, rows)
             success_count = len(batch_data)
 
         # Batch insert failures
@@ -272,8 +229,6 @@ def save_batch_results(results_buffer):
     except sqlite3.Error as e:
         print(f"Batch DB error: {e}")
         conn.rollback()
-    finally:
-        conn.close()
 
     return success_count, fail_count
 
@@ -283,8 +238,7 @@ def fetch_report_data(valid=True):
     try:
         return pd.read_csv(REPORT_CSV_PATH)
     except:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        c = get_manager(DB_PATH).connection().cursor()
         if valid:
             c.execute("SELECT * FROM report_data WHERE NOT url =''")
         else:
@@ -292,7 +246,6 @@ def fetch_report_data(valid=True):
         columns = [col[0] for col in c.description]
         rows = c.fetchall()
         pre_data = pd.DataFrame(rows, columns=columns)
-        conn.close()
         return pre_data
 
 
@@ -301,36 +254,71 @@ def fetch_report_data(valid=True):
 # =============================================================================
 
 
-def get_result_from_server(sentences, batch_size=128):
-    predictions = []
-    headers = {"Content-Type": "application/json"}
+def decode_packed_response(response):
+    """
+    Float32 probability rows from an application/x-predictions response,
+    parsed as one matrix rather than per value.
+    """
+    if response.headers.get("X-Labels", "").split(",") != LABELS:
+        raise ValueError(f"Server label order {response.headers.get('X-Labels')!r} != LABELS")
+    return list(decode_matrix(response.content))
 
-    for i in range(0, len(sentences), batch_size):
-        batch = sentences[i : i + batch_size]
-        payload = {"texts": batch}
+
+def post_with_retry(payload, headers, max_retries=SERVER_MAX_RETRIES):
+    """POST to the server, waiting out 503s (queue full) for their Retry-After"""
+    for attempt in range(max_retries + 1):
+        response = requests.post(SERVER_URL, headers=headers, data=json_codec.dumpb(payload))
+        if response.status_code != 503 or attempt == max_retries:
+            return response
+        delay = float(response.headers.get("Retry-After", 1))
+        debug_print(f"Server saturated; retrying in {delay:.0f}s")
+        time.sleep(delay)
+    return response
+
+
+def get_result_from_server(sentences, year=None, batch_size=128):
+    """
+    Returns one float32 probability array per sentence, in LABELS order
+    (None where the server failed), ready for sentence_store.save_predictions.
+    Sentences are sent in batches of similar length (character count as a
+    proxy for tokens) so the server pads less; results come back in the
+    original order. `year` is sent alongside the texts for the server's
+    <reportYear> prefix. Responses are requested as packed uint16 matrices;
+    a server that only speaks JSON still works.
+    """
+    predictions = [None] * len(sentences)
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": f"{PACKED_MIMETYPE}, application/json;q=0.5",
+    }
+
+    for batch_idx in length_buckets(
+        [len(s) for s in sentences], max_batch_size=batch_size, max_tokens=float("inf")
+    ):
+        batch = [sentences[i] for i in batch_idx]
+        payload = {"texts": batch, "year": year}
         try:
-            response = requests.post(
-                SERVER_URL, headers=headers, data=json.dumps(payload)
-            )
+            response = post_with_retry(payload, headers)
             response.raise_for_status()
-            resp_json = response.json()
-            preds = resp_json.get("predictions")  # Server returns a list of prediction dicts
-            if not isinstance(preds, list):
-                preds = []
+            if response.headers.get("Content-Type", "").startswith(PACKED_MIMETYPE):
+                preds = decode_packed_response(response)
+            else:
+                # {"predictions": [{label: probability}, ...]}
+                preds = json_codec.decode_probabilities(response.content, LABELS)
 
-            # If response length doesn't match batch, fill with error objects
+            # If response length doesn't match batch, leave the whole batch failed (None)
             if len(preds) != len(batch):
                 debug_print(
                     f"Warning: batch size {len(batch)} vs response {len(preds)} mismatch"
                 )
-                # Use a consistent error object instead of -1
-                predictions.extend([{"error": -1}] * len(batch))
                 continue  # Continue to the next batch
-            predictions.extend(preds)
+            for i, pred in zip(batch_idx, preds):
+                predictions[i] = pred
         except requests.exceptions.RequestException as e:
+            # Failed predictions are stored as all-missing rows
             print(f"Error communicating with server: {e}")
-            # Use a consistent error object for network errors
-            predictions.extend([{"error": -1}] * len(batch))
+        except json_codec.DecodeError as e:  # Includes ValueError
+            print(f"Invalid response from server: {e}")
     return predictions
 
 
@@ -345,13 +333,10 @@ def process_report_fully(report):
     matches = get_matches(report.url)
     server_predictions = []
 
-    # Prepend <reportYear> to each sentence
     if matches:
-        matches_with_year = [
-            f"<reportYear>{report.year}</reportYear> {s}" for s in matches
-        ]
-        # Get sentence analysis from the server
-        server_predictions = get_result_from_server(matches_with_year)
+        # Get sentence analysis from the server, which adds the <reportYear>
+        # prefix itself so repeated paragraphs share cache entries
+        server_predictions = get_result_from_server(matches, int(report.year))
     else:
         server_predictions = []
 
@@ -457,7 +442,7 @@ def process_reports_in_chunks():
         # Save to Google Drive if in Colab
         if IS_COLAB:
             print(f"  -> Saving to Google Drive...")
-            subprocess.run(SAVE_SHELL_CMD, shell=True)
+            save_snapshot(DB_PATH, SNAPSHOT_DIR)
 
         # Progress summary
         processed_so_far = chunk_idx * CHUNK_SIZE
@@ -513,7 +498,7 @@ if __name__ == "__main__":
     # Final save to Drive if in Colab
     if IS_COLAB:
         print("\nFinal database sync to Google Drive...")
-        subprocess.run(SAVE_SHELL_CMD, shell=True)
+        save_snapshot(DB_PATH, SNAPSHOT_DIR)
 
     print("\n" + "=" * 70)
     print("All done!")
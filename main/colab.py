@@ -2,12 +2,11 @@
 # COMPLETE OPTIMIZED CODE
 # =============================================================================
 # %%
-# pip install pandas requests beautifulsoup4 tqdm psutil
+# pip install pandas requests beautifulsoup4 tqdm psutil pyahocorasick
 import pandas as pd
 import requests
 import time
 from bs4 import BeautifulSoup
-import json
 import sqlite3
 from typing import List
 import random
@@ -18,9 +17,22 @@ import multiprocessing as mp
 import psutil
 from pathlib import Path
 import threading
-
-# Importing required module
-import subprocess
+import math
+
+from snapshot import restore_or_copy, save_snapshot
+from work_queue import WorkQueue, PENDING, LEASED, DONE, FAILED
+import schema
+import json_codec
+import sentence_store
+import text_compression
+from filing_documents import resolve_filing_documents
+from db_connection import get_manager
+
+# Optional: pyahocorasick gives a C-level multi-pattern keyword scan
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # =============================================================================
 # CONFIGURATION - DEFAULT
@@ -44,7 +56,7 @@ NUM_THREADS = 5
 # =============================================================================
 DRIVE_PATH = "./drive/MyDrive/db"
 LOAD_SHELL_CMD = f"cp {DB_PATH} {DRIVE_PATH}/{DB_PATH} ."
-SAVE_SHELL_CMD = f"cp {DB_PATH} {DRIVE_PATH}/."
+SNAPSHOT_DIR = f"{DRIVE_PATH}/snapshots"  # Incremental page snapshots of DB_PATH
 IS_COLAB = Path(DRIVE_PATH).exists()
 
 # Auto-detect system capabilities
@@ -83,7 +95,7 @@ if IS_COLAB:
     print("Running in Google Colab environment")
     if not Path(DB_PATH).exists():
         print("Loading database from Google Drive...")
-        subprocess.run(LOAD_SHELL_CMD, shell=True)
+        restore_or_copy(DB_PATH, SNAPSHOT_DIR, LOAD_SHELL_CMD)
 else:
     print("Running in local environment")
 # %%
@@ -101,6 +113,8 @@ FILING_TYPES = {
     "10KSB40",
 }
 
+# Which documents of each filing are fetched: see filing_documents.py
+
 PLACEHOLDERS = {
     "€": "__EURO__",
     "£": "__POUND__",
@@ -149,6 +163,31 @@ CAPTION_PATTERN = re.compile(r"<CAPTION>", re.IGNORECASE)
 COLUMN_SPLIT_PATTERN = re.compile(r"\s{2,}")
 TABLE_SPLIT_PATTERN = re.compile(
     r"(<TABLE>.*?</TABLE>)", re.DOTALL | re.IGNORECASE)
+
+# Table cells that carry only figures: "1,250", "(3.5)", "$ 12", "4%", "—"
+NUMERIC_CELL_PATTERN = re.compile(r"^[\(\$\s]*-?[\d,]*\.?\d+\s*%?\)?$|^[-\u2014\u2013$%)]+$")
+NUMERIC_GRID_RATIO = 0.5  # Share of value cells that must be numeric
+# Column headings that are bare fiscal years ("2004", "1999"); no $ or commas
+YEAR_CELL_PATTERN = re.compile(r"^(?:19|20)\d{2}$")
+
+# Header keywords used to detect and rank derivative tables, matched on word
+# boundaries. "forward", "option" and "futures" only count as instruments
+# ("forward contract"), so loss carryforward and stock option tables don't
+# qualify. A table qualifies on an instrument keyword; "fair value" only adds rank.
+DERIVATIVE_TABLE_KEYWORDS = [
+    r"notional",
+    r"swaps?",
+    r"derivatives?",
+    r"hedg(?:e|es|ed|ing)",
+    r"forward\s+(?:(?:foreign\s+)?exchange\s+|currency\s+)?contracts?",
+    r"option\s+contracts?",
+    r"futures\s+contracts?",
+]
+TABLE_RANK_KEYWORDS = DERIVATIVE_TABLE_KEYWORDS + [r"fair\s+value"]
+DERIVATIVE_TABLE_PATTERNS = [re.compile(rf"\b{kw}\b") for kw in DERIVATIVE_TABLE_KEYWORDS]
+TABLE_RANK_PATTERNS = [re.compile(rf"\b{kw}\b") for kw in TABLE_RANK_KEYWORDS]
+TABLE_HEADER_ROWS = 3  # Rows scanned for header keywords
+TABLE_TAG_PATTERN = re.compile(r"</?(?:TABLE|CAPTION|S|C|FN)>", re.IGNORECASE)
 # %%
 # =============================================================================
 # SMART REGEX BUILDER - Generates optimized patterns from keyword lists
@@ -413,8 +452,42 @@ def generate_allowed_keywords() -> set:
     return cleaned_keywords
 
 
+class KeywordAutomaton:
+    """
+    Multi-pattern matcher built once over a keyword set.
+    `mask()` returns a bitmask with bit i set when keyword i occurs in the text,
+    scanning the text once with pyahocorasick (substring scans as a fallback).
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted(kw.lower() for kw in keywords)
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for i, kw in enumerate(self.keywords):
+                self._automaton.add_word(kw, i)
+            self._automaton.make_automaton()
+
+    def mask(self, text: str) -> int:
+        normalized = text.lower()
+        bits = 0
+        if self._automaton is not None:
+            for _, i in self._automaton.iter(normalized):
+                bits |= 1 << i
+        else:
+            for i, kw in enumerate(self.keywords):
+                if kw in normalized:
+                    bits |= 1 << i
+        return bits
+
+    def matched(self, mask: int) -> list:
+        """Decode a bitmask back into keyword strings (debugging aid)."""
+        return [kw for i, kw in enumerate(self.keywords) if mask >> i & 1]
+
+
 # Dynamically generate ALLOWED_KEYWORDS
 ALLOWED_KEYWORDS = generate_allowed_keywords()
+ALLOWED_KEYWORD_AUTOMATON = KeywordAutomaton(ALLOWED_KEYWORDS)
 # EXPORT PATTERNS
 # =============================================================================
 
@@ -457,57 +530,12 @@ def debug_print(*args):
 
 
 def create_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS report_data (
-                cik INTEGER,
-                year INTEGER,
-                url TEXT
-            )
-        """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS names (
-                cik INTEGER,
-                name TEXT
-            )
-        """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS webpage_result (
-                url TEXT,
-                matches TEXT,
-                FOREIGN KEY (url) REFERENCES report_data(url)
-            )
-        """
-        )
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fail_results (
-                cik INTEGER,
-                year INTEGER,
-                url TEXT,
-                reason TEXT
-            )
-        """
-        )
-        c.execute("CREATE INDEX IF NOT EXISTS url_idx ON report_data (url)")
-        c.execute("CREATE INDEX IF NOT EXISTS url_idx ON webpage_result (url)")
-        c.execute("CREATE INDEX IF NOT EXISTS name_idx ON names (name)")
-    except sqlite3.IntegrityError:
-        print("Something went wrong creating the database")
-    finally:
-        conn.commit()
-        conn.close()
+    """Creates missing tables and applies pending schema migrations (schema.py)."""
+    schema.migrate(get_manager(DB_PATH).connection())
 
 
 def save_batch_report_urls(df):
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_manager(DB_PATH).transaction() as conn:
         try:
             name = df[["cik", "name"]].drop_duplicates()
             name = name.dropna()
@@ -516,8 +544,17 @@ def save_batch_report_urls(df):
         except:
             pass
         try:
-            report = df[["cik", "year", "url"]]
-            report.to_sql("report_data", conn, if_exists="append", index=False)
+            report = df.rename(columns={"type": "form_type"}).reindex(
+                columns=["cik", "year", "url", "form_type"]
+            )
+            # (url, cik, year) is unique: re-fetched reports are skipped, not failed
+            conn.executemany(
+                "INSERT OR IGNORE INTO report_data (cik, year, url, form_type) "
+                "VALUES (?, ?, ?, ?)",
+                report.astype(object).where(report.notna(), None).itertuples(
+                    index=False, name=None
+                ),
+            )
             return True
         except sqlite3.IntegrityError:
             debug_print(df.head())
@@ -531,8 +568,7 @@ def fetch_report_data(valid=True):
     try:
         return pd.read_csv(REPORT_CSV_PATH)
     except:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
+        c = get_manager(DB_PATH).connection().cursor()
         if valid:
             c.execute("SELECT * FROM report_data WHERE NOT url =''")
         else:
@@ -540,39 +576,51 @@ def fetch_report_data(valid=True):
         columns = [col[0] for col in c.description]
         rows = c.fetchall()
         pre_data = pd.DataFrame(rows, columns=columns)
-        conn.close()
         return pre_data
 
 
 def fetch_webpage_results():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM webpage_result")
-    columns = [col[0] for col in c.description]
-    rows = c.fetchall()
-    pre_data = pd.DataFrame(rows, columns=columns)
-    conn.close()
-    return pre_data
+    """Processed reports with their matches rebuilt from the sentences table."""
+    c = get_manager(DB_PATH).connection().cursor()
+    c.execute(
+        "SELECT w.url, s.category, unzstd(s.text) FROM webpage_result w "
+        "LEFT JOIN sentences s ON s.url = w.url ORDER BY w.url, s.idx"
+    )
+    pairs = {}
+    for url, category, text in c:
+        report = pairs.setdefault(url, [])
+        if text is not None:
+            report.append((category, text))
+    return pd.DataFrame(
+        {
+            "url": list(pairs),
+            "matches": [sentence_store.group_matches(p) for p in pairs.values()],
+        }
+    )
 
 
 def get_processed_urls() -> set:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    c = get_manager(DB_PATH).connection().cursor()
     c.execute("SELECT url FROM webpage_result")
     rows = c.fetchall()
-    conn.close()
     return set(rows)
 
 
 def save_process_result(df):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO webpage_result (url, matches) VALUES (?, ?)",
-        (df.url, json.dumps(df.matches)),
-    )
-    conn.commit()
-    conn.close()
+    with get_manager(DB_PATH).transaction() as conn:
+        # webpage_result only marks the report as processed; sentences holds the text
+        conn.execute("INSERT OR IGNORE INTO webpage_result (url) VALUES (?)", (df.url,))
+        sentence_store.save_sentences(conn, df.url, df.matches)
+        # Derivative tables are stored beside matches so they never reach the
+        # classifier. A re-parse that finds none must not leave the old ones behind.
+        conn.execute("DELETE FROM table_result WHERE url = ?", (df.url,))
+        if df.get("tables"):
+            conn.execute(
+                "INSERT OR REPLACE INTO table_result (url, tables) VALUES (?, ?)",
+                (df.url, json_codec.dumps(df.tables)),
+            )
+    # Start compressing sentences.text once enough paragraphs are stored
+    text_compression.maybe_bootstrap(get_manager(DB_PATH).connection())
 
 
 # =============================================================================
@@ -659,11 +707,38 @@ def get_cik_filings(cik: str) -> List[dict]:
 
 
 def extract_content(data: str, asHTML=True, max_len=600) -> str:
+    content, _ = extract_document(data, asHTML, max_len)
+    return content
+
+
+def extract_document(data: str, asHTML=True, max_len=600) -> tuple[str, list[dict]]:
+    """
+    Extracts prose content and derivative tables from a filing.
+
+    Numeric grids are pulled out of the text stream so they never reach
+    sentence splitting. Grids whose headers mention derivative terms are
+    returned as structured rows, ranked by header keyword hits.
+    """
     if not data:
-        return ""
+        return "", []
 
+    tables = []
     if asHTML:
         soup = BeautifulSoup(data, "html.parser")
+        for table in soup.find_all("table"):
+            if table.find_parent("table"):
+                continue
+            rows = clean_table_rows(parse_html_table(table))
+            if not is_numeric_grid(rows):
+                continue  # Layout table: its prose stays in the text stream
+            caption = table.find_previous(string=lambda s: s.strip())
+            derivative_table = rank_derivative_table(
+                rows, caption.strip()[:200] if caption else ""
+            )
+            if derivative_table:
+                tables.append(derivative_table)
+            table.decompose()
+
         text = soup.get_text(separator="\n\n", strip=True)
         text = keep_allowed_chars(text, True)
         paragraphs = [p.strip()
@@ -727,7 +802,12 @@ def extract_content(data: str, asHTML=True, max_len=600) -> str:
 
         for part in parts:
             if part.strip().lower().startswith("<table>"):
-                rows = parse_plain_text_table_fixed(part)
+                rows = clean_table_rows(parse_plain_text_table_fixed(part))
+                if is_numeric_grid(rows):
+                    derivative_table = rank_derivative_table(rows)
+                    if derivative_table:
+                        tables.append(derivative_table)
+                    continue
                 table_text = "\n".join(["\t".join(row) for row in rows])
                 paragraphs.append(table_text)
             else:
@@ -759,7 +839,8 @@ def extract_content(data: str, asHTML=True, max_len=600) -> str:
         elif para:
             cleaned_paragraphs.append(para)
 
-    return "\n\n".join(cleaned_paragraphs)
+    tables.sort(key=lambda t: (t["score"], len(t["rows"])), reverse=True)
+    return "\n\n".join(cleaned_paragraphs), tables
 
 
 def keep_allowed_chars(text, asHTML=False):
@@ -812,6 +893,76 @@ def parse_plain_text_table_fixed(block: str):
     return rows
 
 
+def parse_html_table(table) -> list[list[str]]:
+    rows = []
+    for tr in table.find_all("tr"):
+        cells = [
+            keep_allowed_chars(cell.get_text(" ", strip=True))
+            for cell in tr.find_all(["td", "th"])
+        ]
+        cells = [cell for cell in cells if cell]
+        if cells:
+            rows.append(cells)
+    return rows
+
+
+def clean_table_rows(rows: list[list[str]]) -> list[list[str]]:
+    """Drops leftover SGML markers (<TABLE>, <C>, ...) and empty cells."""
+    cleaned = []
+    for row in rows:
+        cells = [TABLE_TAG_PATTERN.sub("", cell).strip() for cell in row]
+        cells = [cell for cell in cells if cell]
+        if cells:
+            cleaned.append(cells)
+    return cleaned
+
+
+def is_numeric_grid(rows: list[list[str]]) -> bool:
+    """True when most value cells (every column but the row label) are figures."""
+    value_cells = [cell for row in rows for cell in row[1:] if cell]
+    if len(rows) < 2 or not value_cells:
+        return False
+    numeric = sum(1 for cell in value_cells if NUMERIC_CELL_PATTERN.match(cell))
+    return numeric / len(value_cells) >= NUMERIC_GRID_RATIO
+
+
+def rank_derivative_table(rows: list[list[str]], caption: str = "") -> dict | None:
+    """
+    Scores a numeric grid by derivative keywords in its caption and header rows.
+    Returns the structured table, or None when it is not a derivative table.
+    """
+    header_cells = [
+        cell
+        for row in rows[:TABLE_HEADER_ROWS]
+        for cell in row
+        if not NUMERIC_CELL_PATTERN.match(cell)
+    ]
+    header_text = " ".join([caption] + header_cells).lower()
+    if not any(pattern.search(header_text) for pattern in DERIVATIVE_TABLE_PATTERNS):
+        return None
+
+    # Header rows are the leading rows that carry no figures at all; a row of
+    # bare years ("2004 | 2003") is a column heading, not data
+    body_start = 0
+    while body_start < len(rows) and not any(
+        NUMERIC_CELL_PATTERN.match(cell) and not YEAR_CELL_PATTERN.match(cell)
+        for cell in rows[body_start]
+    ):
+        body_start += 1
+
+    return {
+        "score": sum(1 for pattern in TABLE_RANK_PATTERNS if pattern.search(header_text)),
+        "caption": caption,
+        "header": rows[:body_start],
+        "rows": rows[body_start:],
+    }
+
+
+# Set by fetch_url when SEC answered 429, so callers can tell throttling
+# (retry without penalty) from a missing or broken document
+_fetch_state = threading.local()
+
+
 def fetch_url(url: str, timeout: int = 10, rate_limiter: "ThreadSafeRateLimiter" = None) -> str | None:
     global SEC_RATE_LIMIT, SEC_RATE
     if not url:
@@ -826,6 +977,7 @@ def fetch_url(url: str, timeout: int = 10, rate_limiter: "ThreadSafeRateLimiter"
         )
         if resp.status_code == 429:
             print(f"Rate Limited {resp.status_code} for {url}")
+            _fetch_state.rate_limited = True
             return None
         if resp.status_code != 200:
             print(f"Error {resp.status_code} for {url}")
@@ -863,7 +1015,6 @@ def filter_by_keywords(
     OPTIMIZED: Pre-filter sentences by category before expansion.
     'gen' category can now expand with ANY other category.
     """
-    allowed_keywords = [kw.lower() for kw in ALLOWED_KEYWORDS]
 
     def get_keyword_category(text: str) -> str:
         try:
@@ -903,8 +1054,9 @@ def filter_by_keywords(
             return False, -1 if is_left else len(all_sentences), False
 
         sentence_to_add = all_sentences[next_idx]  # This is a full sentence
-        category = get_keyword_category(sentence_to_add)
-        is_allowed = should_allow(sentence_to_add)
+        # Category and keyword mask are precomputed once per sentence below
+        category = sentence_categories[next_idx][1]
+        is_allowed = allowed_masks[next_idx] != 0
 
         # Allow expansion if the next sentence has a matching category, is generic, is allowed, or has no category at all (is neutral).
         # Stop expansion only if it has a *different, non-generic* category.
@@ -946,10 +1098,6 @@ def filter_by_keywords(
             used_indices.add(next_idx)
             return True, -1 if is_left else len(all_sentences), True  # Was truncated
 
-    def should_allow(text: str) -> bool:
-        normalized = text.lower()
-        return any(kw in normalized for kw in allowed_keywords)
-
     def expand_context(
         all_sentences: list, target_idx: int, target_category: str, seen_counts: dict
     ) -> tuple[str, set, set]:
@@ -1004,11 +1152,13 @@ def filter_by_keywords(
     ]
     all_sentences = [clean_sentence(sentence) for sentence in raw_sentences]
 
-    # --- Pre-categorize ---
+    # --- Pre-categorize and precompute allowed-keyword masks ---
     sentence_categories = []
+    allowed_masks = []
     for i, sentence in enumerate(all_sentences):
         category = get_keyword_category(sentence)
         sentence_categories.append((i, category))
+        allowed_masks.append(ALLOWED_KEYWORD_AUTOMATON.mask(sentence))
     debug_print("Pre-categorized sentences")
     # Print the count of sentences per category for debugging
     category_counts = {}
@@ -1221,58 +1371,76 @@ def adjust_rate_in_background(
         )
 
 
-def fetch_raw_content(url: str, rate_limiter: ThreadSafeRateLimiter = None):
+def resolve_filing(
+    url: str, rate_limiter: ThreadSafeRateLimiter = None, form_type: str = None
+):
     """
-    Fetches raw text content from a URL. This is purely I/O-bound.
+    Picks the documents of a filing worth parsing for its form type (the
+    accession index is only fetched when the form's rule can use it).
+    Returns None if the filing is already in webpage_result, "RATE_LIMITED"
+    if SEC throttled the index request, else the list of document URLs.
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     # Check if the URL is already in the database to avoid re-fetching
-    # This is a quick check before the more expensive fetch_url call
-    # Note: This is a read-only operation, so it's thread-safe without locks
-    # for this specific use case.
-    c.execute("SELECT 1 FROM webpage_result WHERE url = ?", (url,))
-    exists = c.fetchone()
-    conn.close()
+    # This is a quick check before the more expensive fetch_url call.
+    # Each fetch thread reuses its own connection and the prepared statement.
+    exists = get_manager(DB_PATH).execute(
+        "SELECT 1 FROM webpage_result WHERE url = ?", (url,)
+    ).fetchone()
     if exists:
         return None
 
-    raw_text = fetch_url(url, rate_limiter=rate_limiter)
-    if raw_text:
-        return url, raw_text
-    elif raw_text is None and url: # Check if fetch_url returned None due to rate limit
-        # This is a signal that we might have been rate-limited
-        # We can return a special value to notify the main loop
-        return "RATE_LIMITED", url
+    _fetch_state.rate_limited = False
+    documents = resolve_filing_documents(
+        url, form_type, lambda index_url: fetch_url(index_url, rate_limiter=rate_limiter)
+    )
+    if _fetch_state.rate_limited:
+        return "RATE_LIMITED"
+    debug_print(f"Resolved {form_type} {url} to {documents}")
+    return documents
 
-    return None
 
+def fetch_document(document_url: str, rate_limiter: ThreadSafeRateLimiter = None):
+    """
+    Fetches one document of a filing. This is purely I/O-bound.
+    Returns (raw_text or None, whether SEC rate-limited the request).
+    """
+    _fetch_state.rate_limited = False
+    raw_text = fetch_url(document_url, rate_limiter=rate_limiter)
+    return raw_text, _fetch_state.rate_limited
 
-def parse_and_save_content(data):
+
+def parse_document(document_url: str, raw_text: str):
     """
-    Parses raw HTML/text, filters for keywords, and saves to the database.
+    Extracts prose and derivative tables from a single filing document.
     This is a CPU-bound task.
     """
-    if data is None:
+    try:
+        return extract_document(raw_text, document_url.endswith("htm"))
+    except Exception as e:
+        print(f"Parse error for {document_url}: {e}")
         return None
 
-    url, raw_text = data
 
-    try:
-        # 1. Extract clean content from raw text (CPU-intensive)
-        if url.endswith("htm"):
-            content = extract_content(raw_text, True)
-        else:
-            content = extract_content(raw_text, False)
-
-        if not content:
-            return None
+def filter_and_save_content(url: str, parsed_documents: list):
+    """
+    Filters the combined prose of a filing's documents for keywords and saves
+    the matches and tables to the database. This is a CPU-bound task.
+    """
+    parsed_documents = [doc for doc in parsed_documents if doc]
+    contents = [content for content, _ in parsed_documents if content]
+    if not contents:
+        return None
 
-        # 2. Filter for keywords to get relevant sentences (CPU-intensive)
-        # CPU-intensive parsing
-        categorized_sentences = filter_by_keywords(content)
-        # 3. Save the result to the database
-        result_row = pd.Series({"url": url, "matches": categorized_sentences})
+    try:
+        tables = [table for _, doc_tables in parsed_documents for table in doc_tables]
+        tables.sort(key=lambda t: (t["score"], len(t["rows"])), reverse=True)
+
+        # Filter for keywords to get relevant sentences (CPU-intensive)
+        categorized_sentences = filter_by_keywords("\n\n".join(contents))
+        # Save the result to the database
+        result_row = pd.Series(
+            {"url": url, "matches": categorized_sentences, "tables": tables}
+        )
 
         save_process_result(result_row)
         return True
@@ -1281,6 +1449,20 @@ def parse_and_save_content(data):
         return None
 
 
+def parse_and_save_content(data):
+    """
+    Parses every document of a fetched filing, filters for keywords, and saves
+    to the database in a single call.
+    """
+    if data is None:
+        return None
+
+    url, documents = data
+    return filter_and_save_content(
+        url, [parse_document(document_url, raw_text) for document_url, raw_text in documents]
+    )
+
+
 def format_time(seconds):
     hours, remainder = divmod(seconds, 3600)
     minutes, seconds = divmod(remainder, 60)
@@ -1296,17 +1478,19 @@ def process_all_reports_fully():
     # Initialize a thread-safe rate limiter for the fetching stage.
     rate_limiter = ThreadSafeRateLimiter(SEC_RATE_LIMIT)
 
-    processed_set = get_processed_urls()
-
-    reports_to_process = [
-        (r.url)
+    # Progress lives in the crawl_queue table: seeding is idempotent, so a
+    # restart (or a second crawler on the same DB) picks up where it left off.
+    queue = WorkQueue(DB_PATH)
+    queue.enqueue(
+        (r.url, getattr(r, "form_type", None))
         for r in existing_report_df.itertuples(index=False)
-        if (r.url,) not in processed_set and r.url
-    ]
+        if r.url
+    )
+    counts = queue.status_counts()
 
-    total_reports = len(reports_to_process)
-    print(f"Processing {total_reports:,} new reports")
-    print(f"Already processed: {len(processed_set):,} reports")
+    total_reports = counts[PENDING] + counts[LEASED]
+    print(f"Processing {total_reports:,} queued reports (worker {queue.worker_id})")
+    print(f"Already processed: {counts[DONE]:,} reports ({counts[FAILED]:,} parked as failed)")
     print(f"\n⚙️  Rate Limiting Configuration:")
     print(f"  • {NUM_FETCHERS} parallel fetchers")
     print(f"  • Each worker waits {SEC_RATE_LIMIT:.2f}s between requests")
@@ -1314,30 +1498,69 @@ def process_all_reports_fully():
     total_results = 0
     total_empty = 0
 
-    chunks = [
-        reports_to_process[i: i + CHUNK_SIZE]
-        for i in range(0, total_reports, CHUNK_SIZE)
-    ]
-
-    print(f"\nProcessing in {len(chunks)} chunks of {CHUNK_SIZE} reports each")
+    total_chunks = math.ceil(total_reports / CHUNK_SIZE)
+    print(f"\nProcessing in ~{total_chunks} chunks of {CHUNK_SIZE} reports each")
     print("=" * 70)
 
     chunk_times = []
     total_time = 0
+    chunk_idx = 0
+
+    while True:
+        # Lease the next batch; other workers never receive the same URLs
+        chunk = queue.lease(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk_idx += 1
+        completed_urls = []
+        failures = []  # (url, error) pairs, retried later with backoff
+        rate_limited_urls = []  # Released without using up an attempt
 
-    for chunk_idx, chunk in enumerate(chunks, 1):
         rate_limited_in_chunk = False
         start_chunk_time = time.time()
-        print(f"\n📦 Chunk {chunk_idx}/{len(chunks)} ({len(chunk)} reports)")
+        print(f"\n📦 Chunk {chunk_idx}/~{total_chunks} ({len(chunk)} reports)")
 
-        # Stage 1: Fetch this chunk
+        # Stage 1: Fetch this chunk. Filings are resolved to their documents
+        # first, then every document is fetched as its own task on the same
+        # pool, so a 40-F's exhibits are spread across fetchers too.
         print(f"  → Fetching with {NUM_FETCHERS} workers...")
         fetched_data = []
+        document_urls = {}  # Filing URL -> document URLs to fetch
         with ThreadPoolExecutor(max_workers=NUM_FETCHERS) as fetch_executor:
-            fetch_futures = [
-                fetch_executor.submit(fetch_raw_content, url, rate_limiter)
-                for url in chunk
-            ]
+            resolve_futures = {
+                fetch_executor.submit(resolve_filing, url, rate_limiter, form_type): url
+                for url, form_type in chunk
+            }
+            for future in tqdm(
+                as_completed(resolve_futures),
+                total=len(resolve_futures),
+                desc=f"  Resolving chunk {chunk_idx}",
+                leave=False,
+            ):
+                url = resolve_futures[future]
+                try:
+                    documents = future.result()
+                except Exception as e:
+                    print(f"Fetch error: {e}")
+                    failures.append((url, f"Fetch error: {e}"))
+                    continue
+                if documents is None:
+                    # Already in webpage_result
+                    completed_urls.append(url)
+                elif documents == "RATE_LIMITED":
+                    rate_limited_in_chunk = True
+                    rate_limited_urls.append(url)
+                else:
+                    document_urls[url] = documents
+
+            fetch_futures = {
+                fetch_executor.submit(fetch_document, document_url, rate_limiter): (url, position)
+                for url, documents in document_urls.items()
+                for position, document_url in enumerate(documents)
+            }
+            fetched_documents = {
+                url: [(None, False)] * len(documents) for url, documents in document_urls.items()
+            }
 
             # Create the tqdm bar instance
             tqdm_bar = tqdm(
@@ -1358,14 +1581,9 @@ def process_all_reports_fully():
 
             try:
                 for future in tqdm_bar:
+                    url, position = fetch_futures[future]
                     try:
-                        result = future.result()
-                        if result and result[0] != "RATE_LIMITED":
-                            fetched_data.append(result)
-                            debug_print(result)
-                        elif result and result[0] == "RATE_LIMITED":
-                            rate_limited_in_chunk = True
-
+                        fetched_documents[url][position] = future.result()
                     except Exception as e:
                         print(f"Fetch error: {e}")
             finally:
@@ -1373,6 +1591,22 @@ def process_all_reports_fully():
                 stop_event.set()
                 adjuster_thread.join(timeout=2)
 
+        for url, results in fetched_documents.items():
+            documents = [
+                (document_url, raw_text)
+                for document_url, (raw_text, _) in zip(document_urls[url], results)
+                if raw_text
+            ]
+            if any(rate_limited for _, rate_limited in results):
+                # Throttled rather than broken: retry the whole filing later
+                rate_limited_in_chunk = True
+                rate_limited_urls.append(url)
+            elif documents:
+                fetched_data.append((url, documents))
+                debug_print(url, [document_url for document_url, _ in documents])
+            else:
+                failures.append((url, "Fetch failed"))
+
         # If we were rate-limited in this chunk, enforce a cool-down
         if rate_limited_in_chunk:
             cool_down_period = 5  # seconds
@@ -1380,13 +1614,6 @@ def process_all_reports_fully():
             time.sleep(cool_down_period)
             # Optionally, you could also make the rate limiter more conservative here
 
-        chunk_time = time.time() - start_chunk_time
-        chunk_times.append(chunk_time)
-        total_time += chunk_time
-        avg_chunk_time = sum(chunk_times) / len(chunk_times)
-        remaining_chunks = len(chunks) - chunk_idx
-        est_time_remaining = avg_chunk_time * remaining_chunks
-
         print(f"  ✓ Fetched {len(fetched_data)} reports.")
 
         # Stage 2: Parse this chunk
@@ -1395,9 +1622,19 @@ def process_all_reports_fully():
         chunk_empty = 0
 
         with ProcessPoolExecutor(max_workers=NUM_PARSERS) as parse_executor:
-            parse_futures = [
-                parse_executor.submit(parse_and_save_content, data) for data in fetched_data
-            ]
+            # Every document is parsed as its own task, so a 40-F's exhibits are
+            # spread across workers; a filing is filtered and saved once all of
+            # its documents are back.
+            parse_futures = {
+                parse_executor.submit(parse_document, document_url, raw_text): (url, position)
+                for url, documents in fetched_data
+                for position, (document_url, raw_text) in enumerate(documents)
+            }
+            parsed_documents = {
+                url: [None] * len(documents) for url, documents in fetched_data
+            }
+            pending_documents = {url: len(documents) for url, documents in fetched_data}
+            save_futures = {}
 
             for future in tqdm(
                 as_completed(parse_futures),
@@ -1405,17 +1642,52 @@ def process_all_reports_fully():
                 desc=f"  Parsing chunk {chunk_idx}",
                 leave=False,
             ):
+                url, position = parse_futures[future]
+                try:
+                    parsed_documents[url][position] = future.result()
+                except Exception as e:
+                    print(f"Parse error: {e}")
+                pending_documents[url] -= 1
+                if pending_documents[url] == 0:
+                    save_future = parse_executor.submit(
+                        filter_and_save_content, url, parsed_documents.pop(url)
+                    )
+                    save_futures[save_future] = url
+
+            for future in tqdm(
+                as_completed(save_futures),
+                total=len(save_futures),
+                desc=f"  Filtering chunk {chunk_idx}",
+                leave=False,
+            ):
+                url = save_futures[future]
                 try:
                     result = future.result()
                     if result:
                         debug_print("Parse successful")
                         chunk_results += 1
+                        completed_urls.append(url)
                     else:
                         chunk_empty += 1
                         debug_print("Error with processing")
+                        failures.append((url, "No content extracted"))
                 except Exception as e:
                     print(f"Parse error: {e}")
                     chunk_empty += 1
+                    failures.append((url, f"Parse error: {e}"))
+
+        # Record the outcome of every leased URL before moving on
+        queue.complete(completed_urls)
+        queue.fail(failures)
+        queue.release(rate_limited_urls)
+
+        chunk_time = time.time() - start_chunk_time
+        chunk_times.append(chunk_time)
+        total_time += chunk_time
+        avg_chunk_time = sum(chunk_times) / len(chunk_times)
+        counts = queue.status_counts()
+        remaining = counts[PENDING] + counts[LEASED]
+        est_time_remaining = avg_chunk_time * math.ceil(remaining / CHUNK_SIZE)
 
         total_results += chunk_results
         total_empty += chunk_empty
@@ -1433,16 +1705,17 @@ def process_all_reports_fully():
 
         gc.collect()
         if IS_COLAB:
-            subprocess.Popen(SAVE_SHELL_CMD, shell=True)
-            print(f"  → Saving to database.")
+            # Only pages changed since the last chunk are written to Drive
+            save_snapshot(DB_PATH, SNAPSHOT_DIR)
 
         # Progress summary
-        processed_so_far = chunk_idx * CHUNK_SIZE
-        percent_complete = (processed_so_far / total_reports) * 100
+        percent_complete = (counts[DONE] / max(sum(counts.values()), 1)) * 100
         print(
-            f"  📊 Overall: {total_results:,}/{min(processed_so_far, total_reports):,} ({percent_complete:.1f}% complete)"
+            f"  📊 Overall: {total_results:,} parsed this run, {remaining:,} left in queue, "
+            f"{counts[FAILED]:,} failed ({percent_complete:.1f}% complete)"
         )
 
+    counts = queue.status_counts()
     print("\n" + "=" * 70)
     print(f"🎉 FINAL RESULTS:")
     print(f"  ✓ Successfully processed: {total_results:,} reports")
@@ -1451,6 +1724,10 @@ def process_all_reports_fully():
         print(
             f"  📈 Success rate: {(total_results/(total_results+total_empty)*100):.1f}%"
         )
+    if counts[PENDING]:
+        print(f"  ⏳ {counts[PENDING]:,} reports waiting on retry backoff; rerun to pick them up")
+    if counts[FAILED]:
+        print(f"  ⛔ {counts[FAILED]:,} reports exceeded their retry budget (see crawl_queue.last_error)")
     print("=" * 70)
 
 
@@ -8,7 +8,7 @@ from typing import List
 
 # Import existing classes from the analysis module
 from .analysis import Config
-from .analysis import DataLoader, LabelMapper
+from .analysis import DataLoader, LabelMapper, prob_columns, row_probabilities
 
 # =============================================================================
 # CONFIGURATION
@@ -61,72 +61,47 @@ class AccuracySampler:
         # Fallback to "Irrelevant" if no other labels are produced.
         return self.label_mapper.primary_id2label.get(24, "Irrelevant")
 
-    def _process_report_row(self, row) -> list:
-        """Processes a single report row to extract and label sentences."""
+    def _process_sentence_row(self, row) -> dict:
+        """Labels a single sentence row from the normalized sentence data."""
         global PRED_COUNT
-        
-        categorized_matches = row.get("matches")
-        predictions = row.get("server_response")
 
-        if not isinstance(categorized_matches, dict) or not isinstance(predictions, list):
-            return []
-
-        # Flatten the dictionary of categorized sentences into a single list
-        matches = []
-        if isinstance(categorized_matches, dict):
-            for category_sentences in categorized_matches.values():
-                if isinstance(category_sentences, list):
-                    matches.extend(category_sentences)
-        else:
-            # Fallback for old list format
-            matches = categorized_matches
-            
-        min_len = min(len(matches), len(predictions))
-        processed_sentences = []
-
-        for i in range(min_len):
-            prob_dict = predictions[i]
-            if not isinstance(prob_dict, dict) or "error" in prob_dict:
-                continue
-
-            primary_label_name = self.get_highest_priority_label(prob_dict)
-
-            top_preds = sorted(
-                prob_dict.items(), key=lambda item: item[1], reverse=True
-            )[:PRED_COUNT]
-            top_str = ", ".join(
-                [f"{label}:{score:.2f}" for label, score in top_preds]
-            )
+        prob_dict = row_probabilities(row, self.config.labels)
+        primary_label_name = self.get_highest_priority_label(prob_dict)
 
-            processed_sentences.append(
-                {
-                    "cik": row["cik"],
-                    "year": row["year"],
-                    "url": row["url"],
-                    "sentence": matches[i],
-                    "predicted_primary_label": primary_label_name,
-                    "predicted_multilabels": top_str,
-                }
-            )
+        top_preds = sorted(
+            prob_dict.items(), key=lambda item: item[1], reverse=True
+        )[:PRED_COUNT]
+        top_str = ", ".join(
+            [f"{label}:{score:.2f}" for label, score in top_preds]
+        )
 
-        return processed_sentences
+        return {
+            "cik": row["cik"],
+            "year": row["year"],
+            "url": row["url"],
+            "sentence": row["sentence"],
+            "predicted_primary_label": primary_label_name,
+            "predicted_multilabels": top_str,
+        }
 
     def _load_and_flatten_data(self) -> pd.DataFrame:
-        """Load sentence data from DB and flatten into one-row-per-sentence."""
+        """Load one-row-per-sentence data from DB and label each sentence."""
         print("Loading data from database...")
-        df = self.data_loader.load_sentence_data()
+        df = self.data_loader.load_sentence_data(
+            columns=["cik", "year", "url", "sentence", *prob_columns(self.config.labels)]
+        )
 
-        print(f"Flattening {len(df)} reports into individual sentences...")
+        print(f"Labeling {len(df):,} sentences...")
 
         # Convert DataFrame rows to a list of dictionaries for easier processing
-        report_rows = df.to_dict("records")
+        sentence_rows = df.to_dict("records")
 
         all_sentences = []
 
         # Use ProcessPoolExecutor for CPU-bound task of processing rows
         with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
             # Create chunks for better load balancing
-            chunks = self._chunkify(report_rows)
+            chunks = self._chunkify(sentence_rows)
 
             # Process chunks in parallel
             future_to_chunk = {
@@ -136,7 +111,7 @@ class AccuracySampler:
             for future in tqdm(
                 as_completed(future_to_chunk),
                 total=len(chunks),
-                desc="Processing reports",
+                desc="Labeling sentences",
             ):
                 all_sentences.extend(future.result())
 
@@ -165,11 +140,8 @@ class AccuracySampler:
         return flattened_df
 
     def _process_chunk(self, chunk: List[dict]) -> List[dict]:
-        """Helper function to process a chunk of report rows."""
-        chunk_results = []
-        for row in chunk:
-            chunk_results.extend(self._process_report_row(row))
-        return chunk_results
+        """Helper function to process a chunk of sentence rows."""
+        return [self._process_sentence_row(row) for row in chunk]
 
     def _create_stratified_sample(self, df: pd.DataFrame) -> pd.DataFrame:
         """Create a stratified sample based on the primary predicted label."""
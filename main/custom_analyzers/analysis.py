@@ -1,15 +1,30 @@
 # %%
 import pandas as pd
 import json
-import sqlite3
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from tqdm import tqdm
 import multiprocessing as mp
 import psutil
 from contextlib import contextmanager
 
+from db_connection import get_manager
+from quantization import SCALE, quantize
+import text_compression  # noqa: F401  (registers unzstd() on get_manager connections)
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional; DataLoader falls back to SQL
+    pa = ds = pq = None
+
+try:
+    import duckdb
+except ImportError:  # Config(engine="duckdb") falls back to pandas without it
+    duckdb = None
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -28,6 +43,8 @@ class Config:
     output_dir: Path = field(default_factory=lambda: Path("./analysis_output"))
     comparison_excel: str = "keyword_model_comparison.xlsx"
     sentences_dir: str = "labeled_sentences"
+    # Partitioned (year/category) Parquet export of sentences + probabilities
+    parquet_dir: str = "sentences_parquet"
 
     # Google Colab / Drive settings
     drive_path: str = "./drive/MyDrive/db"
@@ -42,6 +59,10 @@ class Config:
     # Processing settings
     num_workers: int = field(default_factory=mp.cpu_count)
     chunk_size: int = 1000
+    # Rows per chunk streamed from SQLite/Parquet (bounds loader memory)
+    read_chunk_size: int = 100_000
+    # "pandas" or "duckdb": where firm-year aggregation and merges run
+    engine: str = "pandas"
 
     def __post_init__(self):
         """Dynamically configure settings based on system resources."""
@@ -56,10 +77,13 @@ class Config:
         # Set chunk_size based on RAM
         if ram_gb > 32:  # High-RAM machine
             self.chunk_size = 10000
+            self.read_chunk_size = 500_000
         elif ram_gb > 16:  # Medium-RAM machine
             self.chunk_size = 5000
+            self.read_chunk_size = 200_000
         else:  # Low-RAM machine
             self.chunk_size = 2000
+            self.read_chunk_size = 100_000
 
         print(
             f"⚙️  Configuration: NUM_WORKERS={self.num_workers}, CHUNK_SIZE={self.chunk_size}"
@@ -369,53 +393,108 @@ class LabelMapper:
 # DATA LOADER
 # =============================================================================
 
+PROB_PREFIX = "p_"
+# Written next to the Parquet export: the fingerprint of the tables it came from
+PARQUET_MANIFEST = "_manifest.json"
+PARQUET_SOURCE_TABLES = ["sentences", "predictions", "report_data"]
+
+
+def prob_columns(labels: List[str]) -> List[str]:
+    """Column names of the per-label probabilities in the predictions table"""
+    return [f"{PROB_PREFIX}{label}" for label in labels]
+
+
+def row_probabilities(row, labels: List[str]) -> Dict[str, float]:
+    """Rebuild the {label: probability} dict of a sentence row"""
+    return {label: row[f"{PROB_PREFIX}{label}"] for label in labels}
+
+
 
 class DataLoader:
     """Handles loading data from database and CSV files"""
 
     def __init__(self, config: Config):
         self.config = config
+        self._engine = None
+        self._parquet_check = None  # (file mtimes, export is current)
+
+    def analytical_engine(self):
+        """
+        The DuckDBEngine when Config.engine is "duckdb" (created on first use),
+        otherwise None. Falls back to None (pandas) if duckdb is not installed
+        or the database can't be attached.
+        """
+        if self.config.engine != "duckdb":
+            return None
+        if self._engine is None:
+            if duckdb is None:
+                print("⚠️  duckdb is not installed; using the pandas engine")
+                self.config.engine = "pandas"
+                return None
+            from .duckdb_engine import DuckDBEngine
 
-    @contextmanager
-    def _get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.config.db_path)
-        try:
-            yield conn
-        finally:
-            conn.close()
-
-    def _parse_json_column(self, value):
-        """Safely parse JSON column"""
-        if isinstance(value, str):
             try:
-                return json.loads(value)
-            except json.JSONDecodeError:
+                self._engine = DuckDBEngine(self.config)
+            except duckdb.Error as e:
+                # e.g. the sqlite extension can't be downloaded offline
+                print(f"⚠️  DuckDB engine unavailable ({e}); using the pandas engine")
+                self.config.engine = "pandas"
                 return None
-        return value
+        return self._engine
+
+    @contextmanager
+    def _get_connection(self):
+        """This thread's shared connection (db_connection, with unzstd())"""
+        yield get_manager(self.config.db_path).connection()
+
+    def _prob_select(self, alias: str) -> str:
+        """Probability columns of the predictions table, e.g. 'p.p_ir, p.p_fx'"""
+        return ", ".join(f"{alias}.{col}" for col in prob_columns(self.config.labels))
+
+    def _concat(self, chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+        chunks = list(chunks)
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
 
     def load_model_predictions(self) -> pd.DataFrame:
-        """Load model predictions from database"""
-        query = """
+        """All per-report label counts in one frame (see iter_model_predictions)"""
+        return self._concat(self.iter_model_predictions())
+
+    def iter_model_predictions(
+        self, chunksize: Optional[int] = None
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Yield per-report label counts in chunks of `chunksize` reports: for each label, the number of sentences
+        whose probability reaches the confidence threshold. Counting happens in
+        SQL over the normalized predictions table, comparing the quantized
+        columns against the quantized threshold; failed rows (NULL
+        probabilities) count towards no label.
+        """
+        counts = ",\n                ".join(
+            f"COUNT(CASE WHEN p_{label} >= :threshold THEN 1 END) AS {label}"
+            for label in self.config.labels
+        )
+        query = f"""
             SELECT
                 r.cik,
                 r.year,
-                s.url,
-                s.server_response
-            FROM server_result s
-            JOIN report_data r ON s.url = r.url
+                c.*
+            FROM (
+                SELECT
+                    url,
+                    {counts}
+                FROM predictions
+                GROUP BY url
+            ) c
+            JOIN report_data r ON c.url = r.url
         """
 
         with self._get_connection() as conn:
-            df = pd.read_sql(query, conn)
-
-        # Parse JSON server response
-        df["server_response"] = df["server_response"].apply(self._parse_json_column)
-
-        # Remove rows with failed JSON parsing
-        df = df[df["server_response"].notna()].reset_index(drop=True)
-
-        return df
+            yield from pd.read_sql(
+                query,
+                conn,
+                params={"threshold": quantize(self.config.confidence_threshold)},
+                chunksize=chunksize or self.config.read_chunk_size,
+            )
 
     def load_keyword_data(self) -> pd.DataFrame:
         """Load keyword-based derivatives data"""
@@ -431,33 +510,145 @@ class DataLoader:
 
         return keyword_flags
 
-    def load_sentence_data(self) -> pd.DataFrame:
-        """Load sentence-level data with matches"""
-        query = """
+    def sentence_query(self) -> str:
+        """
+        One row per classified sentence: cik, year, url, idx, category,
+        sentence and a p_<label> probability column per label. Sentences whose
+        prediction failed are left out. Probabilities come back quantized;
+        pass the frame through decode_probabilities.
+        """
+        return f"""
             SELECT
                 r.cik,
                 r.year,
-                w.url,
-                w.matches,
-                s.server_response
-            FROM webpage_result w
-            JOIN report_data r ON w.url = r.url
-            JOIN server_result s ON w.url = s.url
+                s.url,
+                s.idx,
+                s.category,
+                unzstd(s.text) AS sentence,
+                {self._prob_select("p")}
+            FROM sentences s
+            JOIN predictions p ON p.url = s.url AND p.idx = s.idx
+            JOIN report_data r ON s.url = r.url
+            WHERE NOT p.failed
+            ORDER BY s.url, s.idx
         """
 
-        with self._get_connection() as conn:
-            df = pd.read_sql(query, conn)
+    def decode_probabilities(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Quantized milli-unit columns -> float probabilities, in place"""
+        cols = [col for col in prob_columns(self.config.labels) if col in df.columns]
+        df[cols] = df[cols] / SCALE
+        return df
 
-        # Parse JSON columns
-        df["matches"] = df["matches"].apply(self._parse_json_column)
-        df["server_response"] = df["server_response"].apply(self._parse_json_column)
+    @property
+    def parquet_path(self) -> Path:
+        return Path(self.config.output_dir) / self.config.parquet_dir
 
-        # Remove rows with failed JSON parsing
-        df = df[(df["matches"].notna()) & (df["server_response"].notna())].reset_index(
-            drop=True
+    def source_fingerprint(self) -> Dict[str, List[int]]:
+        """[row count, max rowid] of each table the Parquet export is built from"""
+        with self._get_connection() as conn:
+            return {
+                table: list(
+                    conn.execute(
+                        f"SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM {table}"
+                    ).fetchone()
+                )
+                for table in PARQUET_SOURCE_TABLES
+            }
+
+    def parquet_is_current(self) -> bool:
+        """
+        True when the Parquet export exists and its manifest still matches the
+        database. Any insert, delete or rewrite of a source table changes the
+        fingerprint, so a stale export is ignored (with a warning) in favour
+        of SQL instead of silently serving old rows.
+        """
+        manifest_path = self.parquet_path / PARQUET_MANIFEST
+        if not manifest_path.exists():
+            if self.parquet_path.exists():
+                print(f"⚠️  {self.parquet_path} has no {PARQUET_MANIFEST}; reading from SQL")
+            return False
+        # Re-fingerprint only when the manifest or the database files changed
+        db_path = Path(self.config.db_path)
+        mtime = tuple(
+            path.stat().st_mtime_ns if path.exists() else None
+            for path in (manifest_path, db_path, db_path.with_name(f"{db_path.name}-wal"))
         )
+        if self._parquet_check is None or self._parquet_check[0] != mtime:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            current = manifest.get("source") == self.source_fingerprint()
+            if not current:
+                print(
+                    f"⚠️  {self.parquet_path} is older than {self.config.db_path}; "
+                    "reading from SQL (re-run the Parquet export)"
+                )
+            self._parquet_check = (mtime, current)
+        return self._parquet_check[1]
 
-        return df
+    def sentence_dataset(self):
+        """
+        The exported Parquet dataset, or None if not exported, stale (see
+        parquet_is_current) or pyarrow is missing
+        """
+        if ds is None or not self.parquet_is_current():
+            return None
+        # `_`-prefixed files such as the manifest are skipped by pyarrow
+        return ds.dataset(self.parquet_path, format="parquet", partitioning="hive")
+
+    def load_sentence_data(
+        self,
+        columns: Optional[List[str]] = None,
+        urls: Optional[List[str]] = None,
+        years: Optional[List[int]] = None,
+    ) -> pd.DataFrame:
+        """All matching sentence rows in one frame (see iter_sentence_data)"""
+        return self._concat(self.iter_sentence_data(columns, urls, years))
+
+    def iter_sentence_data(
+        self,
+        columns: Optional[List[str]] = None,
+        urls: Optional[List[str]] = None,
+        years: Optional[List[int]] = None,
+        chunksize: Optional[int] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Yield sentence-level data (see sentence_query for the columns) in
+        chunks of at most `chunksize` rows.
+
+        Reads the Parquet export when it is current: record batches carry only
+        `columns` and the url/year filters are pushed down, so whole year
+        partitions and row groups are skipped. Otherwise streams the SQL join
+        and filters each chunk. Rows are only ordered by (url, idx) on the SQL
+        path.
+        """
+        chunksize = chunksize or self.config.read_chunk_size
+        dataset = self.sentence_dataset()
+        if dataset is not None:
+            expression = None
+            if urls is not None:
+                expression = ds.field("url").isin(list(urls))
+            if years is not None:
+                year_filter = ds.field("year").isin([int(y) for y in years])
+                expression = year_filter if expression is None else expression & year_filter
+            for batch in dataset.to_batches(
+                columns=columns, filter=expression, batch_size=chunksize
+            ):
+                if batch.num_rows:
+                    yield batch.to_pandas()
+            return
+
+        url_set = set(urls) if urls is not None else None
+        with self._get_connection() as conn:
+            for df in pd.read_sql(self.sentence_query(), conn, chunksize=chunksize):
+                self.decode_probabilities(df)
+                if url_set is not None:
+                    df = df[df["url"].isin(url_set)]
+                if years is not None:
+                    df = df[df["year"].isin(years)]
+                if columns is not None:
+                    df = df[columns]
+                if not df.empty:
+                    yield df.reset_index(drop=True)
 
 
 # =============================================================================
@@ -472,114 +663,85 @@ class PredictionsProcessor:
         self.config = config
         self.label_mapper = label_mapper
 
-    def _is_valid_prediction(self, prob_dict) -> bool:
-        """Check if prediction dictionary is valid"""
-        return isinstance(prob_dict, dict) and "error" not in prob_dict
-
-    def _count_labels(self, predictions: List[dict]) -> Dict[str, int]:
-        """Count label occurrences across all predictions"""
-        label_counts = {label: 0 for label in self.config.labels}
-
-        for prob_dict in predictions:
-            if not self._is_valid_prediction(prob_dict):
-                continue
-
-            # Apply confidence threshold
-            for label in self.config.labels:
-                if prob_dict.get(label, 0.0) >= self.config.confidence_threshold:
-                    label_counts[label] += 1
-
-        return label_counts
+    def _determine_user_flags(self, label_counts: pd.DataFrame) -> pd.DataFrame:
+        """Determine user flags from per-report label count columns"""
 
-    def _determine_user_flags(self, label_counts: Dict[str, int]) -> Dict[str, int]:
-        """Determine user flags based on label counts"""
-
-        # Helper to check if label exists with current context
-        def has_current_use(use_label: str) -> bool:
-            return (
-                label_counts.get(use_label, 0) > 0 and label_counts.get("curr", 0) > 0
-            )
+        def has(label: str) -> pd.Series:
+            return label_counts[label] > 0
 
         # Specific hedge types (must have current usage)
-        has_ir = has_current_use("ir_use")
-        has_fx = has_current_use("fx_use")
-        has_cp = has_current_use("cp_use")
-        has_eq = has_current_use("eq_use")
-        has_warr = label_counts.get("warr", 0) > 0 and label_counts.get("curr", 0) > 0
-        has_emb = label_counts.get("emb", 0) > 0 and label_counts.get("curr", 0) > 0
+        has_curr = has("curr")
+        has_ir = has("ir_use") & has_curr
+        has_fx = has("fx_use") & has_curr
+        has_cp = has("cp_use") & has_curr
+        has_eq = has("eq_use") & has_curr
+        has_warr = has("warr") & has_curr
+        has_emb = has("emb") & has_curr
 
         # Any use (current or historic)
-        any_use = any(
-            [
-                label_counts.get("ir_use", 0) > 0,
-                label_counts.get("fx_use", 0) > 0,
-                label_counts.get("cp_use", 0) > 0,
-                label_counts.get("eq_use", 0) > 0,
-                label_counts.get("warr", 0) > 0,
-                label_counts.get("emb", 0) > 0,
-            ]
+        any_use = (
+            has("ir_use")
+            | has("fx_use")
+            | has("cp_use")
+            | has("eq_use")
+            | has("warr")
+            | has("emb")
         )
 
-        return {
-            "model_ir_user": int(has_ir),
-            "model_fx_user": int(has_fx),
-            "model_cp_user": int(has_cp),
-            "model_eq_user": int(has_eq),
-            "model_warr_user": int(has_warr),
-            "model_emb_user": int(has_emb),
-            "model_user": int(
-                has_ir or has_fx or has_cp
-            ),  # Original: Any hedge (IR/FX/CP)
-            "model_user_all": int(any_use),  # All derivatives
-        }
-
-    def process_predictions(self, model_df: pd.DataFrame) -> pd.DataFrame:
-        """Aggregate model predictions to firm-year level"""
-        print(f"Processing {len(model_df):,} model predictions...")
+        return pd.DataFrame(
+            {
+                "model_ir_user": has_ir.astype(int),
+                "model_fx_user": has_fx.astype(int),
+                "model_cp_user": has_cp.astype(int),
+                "model_eq_user": has_eq.astype(int),
+                "model_warr_user": has_warr.astype(int),
+                "model_emb_user": has_emb.astype(int),
+                # Original: Any hedge (IR/FX/CP)
+                "model_user": (has_ir | has_fx | has_cp).astype(int),
+                "model_user_all": any_use.astype(int),  # All derivatives
+            }
+        )
 
-        results = []
-        skipped_count = 0
-
-        for _, row in tqdm(
-            model_df.iterrows(), total=len(model_df), desc="Aggregating predictions"
-        ):
-            predictions = row["server_response"]
-
-            if not predictions:
-                skipped_count += 1
-                continue
-
-            # Count labels across all sentences
-            label_counts = self._count_labels(predictions)
-
-            # Determine user flags
-            user_flags = self._determine_user_flags(label_counts)
-
-            results.append(
-                {
-                    "cik": row["cik"],
-                    "year": row["year"],
-                    "url": row["url"],
-                    **user_flags,
-                }
-            )
+    def _aggregate_firm_years(self, agg_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Max of each flag per cik-year, keeping the smallest URL: unlike the
+        first one encountered, it doesn't depend on row or chunk order, and it
+        matches DuckDBEngine.firm_year_flags.
+        """
+        agg_cols = [col for col in agg_df.columns if col.startswith("model_")]
+        return agg_df.groupby(["cik", "year"]).agg(
+            {**{col: 'max' for col in agg_cols}, 'url': 'min'}
+        ).reset_index()
 
-        if skipped_count > 0:
-            print(
-                f"⚠️  Skipped {skipped_count} reports with empty or invalid predictions"
+    def process_predictions(
+        self, model_df: Union[pd.DataFrame, Iterable[pd.DataFrame]]
+    ) -> pd.DataFrame:
+        """
+        Aggregate per-report label counts to firm-year level. Accepts one frame
+        or a stream of chunks (DataLoader.iter_model_predictions); each chunk
+        is reduced to firm-years before the next is read, so memory follows
+        the number of firm-years rather than the number of reports.
+        """
+        chunks = [model_df] if isinstance(model_df, pd.DataFrame) else model_df
+
+        partials = []
+        report_count = 0
+        for chunk in tqdm(chunks, desc="Aggregating predictions", unit="chunk"):
+            report_count += len(chunk)
+            flags = self._determine_user_flags(chunk)
+            partials.append(
+                self._aggregate_firm_years(
+                    pd.concat([chunk[["cik", "year", "url"]], flags], axis=1)
+                )
             )
+        print(f"Processed {report_count:,} model predictions")
 
-        agg_df = pd.DataFrame(results)
+        if not partials:
+            print("⚠️  No model predictions found")
+            return pd.DataFrame(columns=["cik", "year", "url"])
 
-        # Aggregate to firm-year level (max across multiple URLs)
-        # If a firm-year has multiple URLs, we need to decide which URL to keep.
-        # A simple approach is to keep the first one encountered for each group.
-        agg_cols = [col for col in agg_df.columns if col.startswith("model_")]
-        
-        # Group by cik and year, aggregate flags with max(), and keep the first URL.
-        firm_year_agg = agg_df.groupby(["cik", "year"]).agg(
-            {**{col: 'max' for col in agg_cols}, 'url': 'first'}
-        ).reset_index()
+        # A firm-year split across chunks is combined the same way (max / smallest URL)
+        firm_year_agg = self._aggregate_firm_years(pd.concat(partials, ignore_index=True))
 
         print(f"✅ Aggregated to {len(firm_year_agg):,} firm-year observations")
 
@@ -6,6 +6,9 @@ from typing import Dict, Optional, TYPE_CHECKING
 
 from .analysis import BaseAnalyzer, Config, LabelMapper
 
+if TYPE_CHECKING:
+    from .duckdb_engine import DuckDBEngine
+
 
 # =============================================================================
 # WORKBOOK MANAGER
@@ -73,10 +76,22 @@ class WorkbookManager:
 class ComparisonAnalyzer(BaseAnalyzer):
     """Analyzes differences between keyword and model predictions"""
 
+    def __init__(
+        self,
+        config: Config,
+        label_mapper: Optional[LabelMapper] = None,
+        engine: Optional["DuckDBEngine"] = None,
+    ):
+        super().__init__(config, label_mapper)
+        # DataLoader.analytical_engine(); None merges in pandas
+        self.engine = engine
+
     def merge_data(
         self, keyword_df: pd.DataFrame, model_df: pd.DataFrame
     ) -> pd.DataFrame:
         """Merge keyword and model data"""
+        if self.engine is not None:
+            return self.engine.merge_keyword_flags(keyword_df, model_df)
         # Inner merge to only compare firm-years processed by BOTH the model and keyword search
         merged = pd.merge(model_df, keyword_df, on=["cik", "year"], how="inner")
 
@@ -1,8 +1,6 @@
 import pandas as pd
 from pathlib import Path
 from typing import Dict, List, Optional
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from tqdm import tqdm
 
 from .analysis import Config, LabelMapper, DataLoader
 
@@ -32,69 +30,37 @@ class DisagreementSampler:
         self.random_state = random_state
         self.output_filename = "disagreement_analysis_sample.xlsx"
 
-    def _get_relevant_sentences(self, sentences: List[str], predictions: List[Dict]) -> List[str]:
-        """
-        Returns all sentences from the report's 'matches' field.
-        This provides the full context for analysis, as requested.
-        """
-        # Per user request, return all sentences to provide full context,
-        # not just the ones the model flagged as relevant.
-        return sentences
-
-    def _process_chunk(self, report_chunk: pd.DataFrame) -> List[Dict]:
-        """
-        Process a chunk of reports to extract relevant sentences.
-        Designed for parallel execution.
-        """
-        results = []
-        for _, report_row in report_chunk.iterrows():
-            sentences = self._get_relevant_sentences(
-                report_row["matches"], report_row["server_response"]
-            )
-            # Join sentences into a single text block for readability
-            sentence_block = "\n\n".join(sentences)
-
-            record = report_row.to_dict()
-            record["relevant_sentences"] = sentence_block
-            results.append(record)
-        return results
-
     def _get_sentences_for_reports(self, report_ciks: pd.DataFrame) -> pd.DataFrame:
         """
-        Fetches and processes sentences for a given DataFrame of reports.
+        Fetches all sentences of the given reports and joins them into one
+        'relevant_sentences' text block per report. All sentences are kept to
+        give full context, not just the ones the model flagged as relevant.
         """
         print(f"Fetching sentences for {len(report_ciks):,} reports...")
-        sentence_data = self.data_loader.load_sentence_data()
+        # Only the reports we need, and only the columns used below
+        sentence_data = self.data_loader.load_sentence_data(
+            columns=["cik", "year", "url", "idx", "sentence"],
+            urls=report_ciks["url"].unique().tolist(),
+        )
 
-        # Filter sentence_data to only include the reports we need
-        reports_with_sentences = pd.merge(
-            report_ciks, sentence_data, on=["cik", "year", "url"], how="inner"
+        report_sentences = pd.merge(
+            report_ciks,
+            sentence_data,
+            on=["cik", "year", "url"],
+            how="inner",
         )
 
-        if reports_with_sentences.empty:
+        if report_sentences.empty:
             print("⚠️ No matching reports with sentence data found.")
             return pd.DataFrame()
 
-        # Parallel process sentence extraction
-        num_chunks = self.config.num_workers * 4
-        chunk_size = (len(reports_with_sentences) + num_chunks - 1) // num_chunks
-        chunks = [
-            reports_with_sentences.iloc[i : i + chunk_size]
-            for i in range(0, len(reports_with_sentences), chunk_size)
-        ]
-
-        all_results = []
-        with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
-            futures = [executor.submit(self._process_chunk, chunk) for chunk in chunks]
-            for future in tqdm(
-                as_completed(futures), total=len(futures), desc="Extracting Sentences"
-            ):
-                all_results.extend(future.result())
-
-        if not all_results:
-            return pd.DataFrame()
-
-        return pd.DataFrame(all_results)
+        # Join sentences into a single text block for readability, in report order
+        return (
+            report_sentences.sort_values(["url", "idx"])
+            .groupby(["cik", "year", "url"], sort=False)["sentence"]
+            .agg("\n\n".join)
+            .reset_index(name="relevant_sentences")
+        )
 
     def analyze(self, detailed_comparison_df: pd.DataFrame):
         """
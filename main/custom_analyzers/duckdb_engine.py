@@ -0,0 +1,142 @@
+import pandas as pd
+from typing import List, Optional
+
+from quantization import quantize
+
+from .analysis import Config, duckdb
+
+# Firm-year flag columns, in the order PredictionsProcessor returns them
+FLAG_COLUMNS = [
+    "model_ir_user",
+    "model_fx_user",
+    "model_cp_user",
+    "model_eq_user",
+    "model_warr_user",
+    "model_emb_user",
+    "model_user",
+    "model_user_all",
+]
+
+
+# =============================================================================
+# DUCKDB ENGINE
+# =============================================================================
+
+
+class DuckDBEngine:
+    """
+    Runs the firm-year aggregation and the keyword/model merge as DuckDB SQL
+    instead of pandas. web_data.db is attached read-only through DuckDB's
+    sqlite extension (as `web`). Queries are vectorized and use
+    `config.num_workers` threads; results are the same DataFrames the pandas
+    path produces.
+    """
+
+    def __init__(self, config: Config):
+        if duckdb is None:
+            raise ImportError("duckdb is required for Config(engine='duckdb')")
+        self.config = config
+        self.conn = duckdb.connect()
+        self.conn.execute(f"SET threads = {int(config.num_workers)}")
+        self.conn.execute("INSTALL sqlite")
+        self.conn.execute("LOAD sqlite")
+        db_path = str(config.db_path).replace("'", "''")
+        self.conn.execute(f"ATTACH '{db_path}' AS web (TYPE sqlite, READ_ONLY)")
+
+    def query(self, sql: str, params: Optional[List] = None) -> pd.DataFrame:
+        return self.conn.execute(sql, params or []).df()
+
+    def firm_year_flags(self) -> pd.DataFrame:
+        """
+        PredictionsProcessor.process_predictions in one query: per-report
+        label counts above the threshold, the user flags derived from them
+        (same rules as PredictionsProcessor._determine_user_flags), then the
+        max of each flag per cik-year with its smallest URL (as
+        PredictionsProcessor._aggregate_firm_years picks it).
+        """
+        threshold = quantize(self.config.confidence_threshold)
+        counts = ",\n                    ".join(
+            f"count(*) FILTER (WHERE p_{label} >= {threshold}) > 0 AS has_{label}"
+            for label in self.config.labels
+        )
+        df = self.query(
+            f"""
+            WITH report_counts AS (
+                SELECT
+                    url,
+                    {counts}
+                FROM web.predictions
+                GROUP BY url
+            ),
+            report_flags AS (
+                SELECT
+                    r.cik,
+                    r.year,
+                    c.url,
+                    (has_ir_use AND has_curr) AS ir,
+                    (has_fx_use AND has_curr) AS fx,
+                    (has_cp_use AND has_curr) AS cp,
+                    (has_eq_use AND has_curr) AS eq,
+                    (has_warr AND has_curr) AS warr,
+                    (has_emb AND has_curr) AS emb,
+                    (has_ir_use OR has_fx_use OR has_cp_use OR has_eq_use
+                        OR has_warr OR has_emb) AS any_use
+                FROM report_counts c
+                JOIN web.report_data r ON c.url = r.url
+            )
+            SELECT
+                cik::BIGINT AS cik,
+                year::BIGINT AS year,
+                max(ir::BIGINT) AS model_ir_user,
+                max(fx::BIGINT) AS model_fx_user,
+                max(cp::BIGINT) AS model_cp_user,
+                max(eq::BIGINT) AS model_eq_user,
+                max(warr::BIGINT) AS model_warr_user,
+                max(emb::BIGINT) AS model_emb_user,
+                max((ir OR fx OR cp)::BIGINT) AS model_user,
+                max(any_use::BIGINT) AS model_user_all,
+                min(url) AS url
+            FROM report_flags
+            GROUP BY cik, year
+            ORDER BY cik, year
+        """
+        )
+        print(f"✅ Aggregated to {len(df):,} firm-year observations (DuckDB)")
+        return df
+
+    def merge_keyword_flags(
+        self, keyword_df: pd.DataFrame, model_df: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        ComparisonAnalyzer.merge_data as a join: firm-years present in both
+        frames, with missing numeric flags filled with 0 and cast to integers.
+        """
+        self.conn.register("model_flags", model_df)
+        self.conn.register("keyword_flags", keyword_df)
+        try:
+            keyword_cols = [c for c in keyword_df.columns if c not in ("cik", "year")]
+            columns = []
+            for frame, alias, cols in (
+                (model_df, "m", list(model_df.columns)),
+                (keyword_df, "k", keyword_cols),
+            ):
+                for col in cols:
+                    numeric = pd.api.types.is_numeric_dtype(frame[col])
+                    if numeric and col not in ("cik", "year", "url"):
+                        columns.append(f'coalesce({alias}."{col}", 0)::BIGINT AS "{col}"')
+                    else:
+                        columns.append(f'{alias}."{col}"')
+            return self.query(
+                f"""
+                SELECT {", ".join(columns)}
+                FROM model_flags m
+                JOIN keyword_flags k ON m.cik = k.cik AND m.year = k.year
+                ORDER BY m.cik, m.year
+            """
+            )
+        finally:
+            self.conn.unregister("model_flags")
+            self.conn.unregister("keyword_flags")
+
+    def close(self):
+        self.conn.close()
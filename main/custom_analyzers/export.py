@@ -0,0 +1,96 @@
+import json
+import shutil
+import time
+import pandas as pd
+from pathlib import Path
+from typing import List
+
+from .analysis import PARQUET_MANIFEST, Config, DataLoader, pa, pq, prob_columns
+
+# Partition value for sentences stored without a category (old list format)
+UNCATEGORIZED = "uncategorized"
+
+
+# =============================================================================
+# PARQUET EXPORTER
+# =============================================================================
+
+
+class ParquetExporter:
+    """
+    Exports sentences and their predictions to a Parquet dataset partitioned
+    by year and category (hive layout: year=2015/category=gen/...).
+    Probabilities are stored as float32; DataLoader.load_sentence_data reads
+    the dataset lazily while its _manifest.json matches the database.
+    """
+
+    def __init__(self, config: Config, batch_size: int = 200_000):
+        self.config = config
+        self.data_loader = DataLoader(config)
+        self.batch_size = batch_size
+
+    def schema(self) -> "pa.Schema":
+        return pa.schema(
+            [
+                ("cik", pa.int64()),
+                ("year", pa.int32()),
+                ("url", pa.string()),
+                ("idx", pa.int32()),
+                ("category", pa.string()),
+                ("sentence", pa.string()),
+                *[(col, pa.float32()) for col in prob_columns(self.config.labels)],
+            ]
+        )
+
+    def _to_table(self, chunk: pd.DataFrame, prob_cols: List[str]) -> "pa.Table":
+        chunk["category"] = chunk["category"].fillna(UNCATEGORIZED)
+        self.data_loader.decode_probabilities(chunk)
+        chunk[prob_cols] = chunk[prob_cols].astype("float32")
+        return pa.Table.from_pandas(chunk, schema=self.schema(), preserve_index=False)
+
+    def export(self) -> Path:
+        """Streams the SQL join into the dataset and swaps it in when complete"""
+        if pq is None:
+            raise ImportError("pyarrow is required for the Parquet export")
+
+        target = self.data_loader.parquet_path
+        staging = target.with_name(f"{target.name}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        prob_cols = prob_columns(self.config.labels)
+        # Taken before reading: rows written during the export make it stale
+        source = self.data_loader.source_fingerprint()
+
+        print(f"Exporting sentences to {target}...")
+        total = 0
+        with self.data_loader._get_connection() as conn:
+            chunks = pd.read_sql(
+                self.data_loader.sentence_query(), conn, chunksize=self.batch_size
+            )
+            for n, chunk in enumerate(chunks):
+                pq.write_to_dataset(
+                    self._to_table(chunk, prob_cols),
+                    root_path=str(staging),
+                    partition_cols=["year", "category"],
+                    basename_template=f"part-{n:05d}-{{i}}.parquet",
+                )
+                total += len(chunk)
+                print(f"  ... {total:,} sentences written")
+
+        if total == 0:
+            print("⚠️  No classified sentences to export")
+            return target
+
+        manifest = {
+            "db_path": str(self.config.db_path),
+            "exported_at": time.time(),
+            "rows": total,
+            "source": source,
+        }
+        with open(staging / PARQUET_MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Readers never see a half-written dataset
+        shutil.rmtree(target, ignore_errors=True)
+        staging.rename(target)
+        print(f"✅ Exported {total:,} sentences to {target}")
+        return target
@@ -1,14 +1,21 @@
 # %%
 import pandas as pd
-import json
-import sqlite3
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Dict, List, Optional
 from tqdm import tqdm
 
+from db_connection import get_manager
+import text_compression  # noqa: F401  (registers unzstd() on get_manager connections)
+
 # Import from existing modules
-from custom_analyzers.analysis import Config, LabelMapper
+from custom_analyzers.analysis import (
+    Config,
+    DataLoader,
+    LabelMapper,
+    prob_columns,
+    row_probabilities,
+)
 
 # =============================================================================
 # CONFIGURATION
@@ -42,17 +49,8 @@ class URLAnalyzer:
         self.label_mapper = label_mapper
 
     def _get_connection(self):
-        """Create database connection"""
-        return sqlite3.connect(self.config.db_path)
-
-    def _parse_json_safe(self, value):
-        """Safely parse JSON"""
-        if isinstance(value, str):
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return None
-        return value
+        """This thread's shared connection (db_connection, with unzstd())"""
+        return get_manager(self.config.db_path).connection()
 
     def load_urls_from_excel(self) -> pd.DataFrame:
         """Load URLs from the input Excel file"""
@@ -70,36 +68,55 @@ class URLAnalyzer:
 
         print(f"✅ Loaded {len(df)} URLs")
         return df
-    def fetch_sentences_for_url(self, url: str) -> Optional[pd.DataFrame]:
-        """Fetch all sentences and predictions for a specific URL"""
-        query = """
+    def prefetch_sentences(self, urls: List[str]) -> Optional[pd.DataFrame]:
+        """
+        Reads the sentences of all URLs in one pass over the Parquet export.
+        Returns None when there is no export; URLs are then queried one by one.
+        """
+        data_loader = DataLoader(self.config)
+        if data_loader.sentence_dataset() is None:
+            return None
+        columns = ["cik", "year", "url", "idx", "sentence", *prob_columns(self.config.labels)]
+        return data_loader.load_sentence_data(columns=columns, urls=urls)
+
+    def fetch_sentences_for_url(
+        self, url: str, prefetched: Optional[pd.DataFrame] = None
+    ) -> Optional[pd.DataFrame]:
+        """Fetch all sentences and predictions for a specific URL, one row per sentence"""
+        if prefetched is not None:
+            df = prefetched[prefetched["url"] == url]
+            df = df.drop_duplicates(subset=["idx"]).sort_values("idx")
+            if df.empty:
+                print(f"⚠️  No data found for URL: {url}")
+                return None
+            return df.reset_index(drop=True)
+
+        probs = ", ".join(f"p.{col}" for col in prob_columns(self.config.labels))
+        query = f"""
             SELECT
                 r.cik,
                 r.year,
-                w.url,
-                w.matches,
-                s.server_response
-            FROM webpage_result w
-            JOIN report_data r ON w.url = r.url
-            JOIN server_result s ON w.url = s.url
-            WHERE w.url = ?
+                s.url,
+                s.idx,
+                unzstd(s.text) AS sentence,
+                p.failed,
+                {probs}
+            FROM sentences s
+            JOIN predictions p ON p.url = s.url AND p.idx = s.idx
+            JOIN report_data r ON s.url = r.url
+            WHERE s.url = ?
+            ORDER BY s.idx
         """
 
-        conn = self._get_connection()
-        try:
-            df = pd.read_sql(query, conn, params=(url,))
-        finally:
-            conn.close()
+        df = pd.read_sql(query, self._get_connection(), params=(url,))
+        DataLoader(self.config).decode_probabilities(df)
 
         if df.empty:
             print(f"⚠️  No data found for URL: {url}")
             return None
 
-        # Parse JSON columns
-        df["matches"] = df["matches"].apply(self._parse_json_safe)
-        df["server_response"] = df["server_response"].apply(self._parse_json_safe)
-
-        return df
+        # A URL listed under several report_data rows comes back once per row
+        return df.drop_duplicates(subset=["idx"]).reset_index(drop=True)
 
     def process_url_sentences(self, url: str, cik: int, data: pd.DataFrame) -> pd.DataFrame:
         """Process all sentences for a URL and create detailed results"""
@@ -109,39 +126,16 @@ class URLAnalyzer:
         if data is None or data.empty:
             return pd.DataFrame()
 
-        # Should only be one row (one report per URL)
-        if len(data) > 1:
-            print(f"⚠️  Multiple records found for {url}, using first one")
-
-        row = data.iloc[0]
-        categorized_matches = row.get("matches")
-        predictions = row.get("server_response")
-
-        if not isinstance(categorized_matches, dict) or not isinstance(predictions, list):
-            print(f"⚠️  No sentences or predictions for {url}")
-            return pd.DataFrame()
-
-        # Flatten the dictionary of categorized sentences into a single list
-        matches = []
-        if isinstance(categorized_matches, dict):
-            for category_sentences in categorized_matches.values():
-                if isinstance(category_sentences, list):
-                    matches.extend(category_sentences)
-        else:
-            matches = categorized_matches
-            
         # Process each sentence
         sentences_data = []
-        min_len = min(len(matches), len(predictions))
-
-        for i in range(min_len):
-            sentence = matches[i]
-            prob_dict = predictions[i]
-
-            # Skip invalid predictions
-            if not isinstance(prob_dict, dict) or "error" in prob_dict:
+        for _, row in data.iterrows():
+            # Skip failed predictions (the Parquet export holds none to begin with)
+            if row.get("failed", 0):
                 continue
 
+            sentence = row["sentence"]
+            prob_dict = row_probabilities(row, self.config.labels)
+
             # Get primary label(s)
             primary_labels = self.label_mapper.get_primary_labels(prob_dict)
             primary_label_str = primary_labels[0] if primary_labels else "Irrelevant"
@@ -175,7 +169,7 @@ class URLAnalyzer:
 
             sentences_data.append(
                 {
-                    "sentence_num": i + 1,
+                    "sentence_num": row["idx"] + 1,
                     "sentence": sentence,
                     "primary_label": primary_label_str,
                     "all_primary_labels": all_primary_labels,
@@ -192,8 +186,8 @@ class URLAnalyzer:
         df = pd.DataFrame(sentences_data)
 
         # Add metadata
-        df.insert(0, "cik", row["cik"])
-        df.insert(1, "year", row["year"])
+        df.insert(0, "cik", data.iloc[0]["cik"])
+        df.insert(1, "year", data.iloc[0]["year"])
         df.insert(2, "url", url)
 
         print(f"    ✓ Processed {len(df)} sentences")
@@ -337,13 +331,14 @@ class URLAnalyzer:
         # Process each URL
         print(f"\n📊 Processing {len(urls_df)} URLs...")
         all_results = {}
+        prefetched = self.prefetch_sentences(urls_df["url"].tolist())
 
         for _, row in tqdm(
             urls_df.iterrows(), total=len(urls_df), desc="Processing URLs"
         ):
             url = row["url"]
             # Fetch data once to get CIK/year and to pass to process_url_sentences
-            report_data = self.fetch_sentences_for_url(url)
+            report_data = self.fetch_sentences_for_url(url, prefetched)
             if report_data is None or report_data.empty:
                 print(f"⚠️ Skipping URL, no data found in DB: {url}")
                 continue
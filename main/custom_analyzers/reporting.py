@@ -1,17 +1,30 @@
 import pandas as pd
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Tuple, Optional, Union
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
 # Import from analysis module
-from .analysis import Config, LabelMapper
+from .analysis import Config, LabelMapper, prob_columns, row_probabilities
 
 
 # =============================================================================
 # SENTENCE LABELER
 # =============================================================================
 
+# Label groupings for workbook consolidation
+LABEL_GROUPS = {
+    "General_Hedge": ["General_Derivative", "General_Derivative_Context"],
+    "IR_Hedge": ["IR_Derivative", "IR_Context"],
+    "FX_Hedge": ["FX_Derivative", "FX_Context"],
+    "CP_Hedge": ["Commodity_Derivative", "Commodity_Context"],
+    "EQ_Hedge": ["Equity_Derivative", "Equity_Context"],
+    "Warrant": ["Warrant"],
+    "Embedded_Derivative": ["Embedded_Derivative"],
+    "Speculation": ["Speculation"],  # Assuming 'Speculation' is a direct category
+    "Irrelevant": ["Irrelevant_Non-Hedge", "Irrelevant"],
+}
+
 
 class SentenceLabeler:
     """Creates sentence-level labeled files with user flags"""
@@ -20,108 +33,48 @@ class SentenceLabeler:
         self.config = config
         self.label_mapper = label_mapper
 
-    def process_sentence_chunk(self, chunk_data: List[Tuple]) -> List[Dict]:
-        """Process a chunk of sentences - designed for parallel processing"""
-        results = []
-
-        for cik, year, url, matches, predictions, user_flags in chunk_data:
-
-            # Flatten the dictionary of categorized sentences into a single list
-            flattened_matches = []
-            if isinstance(matches, dict):
-                for category_sentences in matches.values():
-                    if isinstance(category_sentences, list):
-                        flattened_matches.extend(category_sentences)
-            else:
-                # Fallback for old list format
-                flattened_matches = matches if isinstance(matches, list) else []
-
-            min_len = min(len(flattened_matches), len(predictions))
-
-            for i in range(min_len):
-                sentence = flattened_matches[i]
-                prob_dict = predictions[i]
-                # Defensive check: Ensure prob_dict is a dictionary
-                if not isinstance(prob_dict, dict):
-                    print(
-                        f"⚠️  Skipping invalid item in predictions. Expected a dict, but got {type(prob_dict)}."
-                    )
-                    print(f"   - Item: {prob_dict}")
-                    print(f"   - URL: {url}")
-                    continue
-
-                # Skip items that are error indicators
-                if "error" in prob_dict:
-                    continue
-
-                # Get primary labels
-                primary_labels = self.label_mapper.get_primary_labels(prob_dict)
-
-                # Get raw probabilities for each label
-                probabilities = {
-                    f"prob_{label}": prob_dict.get(label, 0.0)
-                    for label in self.config.labels
-                }
-
-                # Create base record
-                record = {
-                    "cik": cik,
-                    "year": year,
-                    "url": url,
-                    "sentence": sentence,
-                    "labels": ", ".join(primary_labels),
-                    **user_flags,  # Add all user flags
-                    **probabilities,  # Add all probability columns
-                }
-
-                results.append(record)
-
-        return results
-
-    def create_labeled_files(
-        self, sentence_df: pd.DataFrame, user_flags_df: pd.DataFrame
-    ):
-        """Create separate Excel files for each label category with user flags"""
-        print(f"Processing {len(sentence_df):,} sentences for labeled files...")
-
-        # Merge sentence data with user flags
-        merged_sentences = pd.merge(
-            sentence_df, user_flags_df, on=["cik", "year"], how="left"
-        )
+    def process_sentence_chunk(self, chunk_data: List[Dict]) -> List[str]:
+        """Label a chunk of sentence rows - designed for parallel processing"""
+        return [
+            ", ".join(
+                self.label_mapper.get_primary_labels(
+                    row_probabilities(row, self.config.labels)
+                )
+            )
+            for row in chunk_data
+        ]
+
+    def _label_sentences(
+        self,
+        sentence_df: pd.DataFrame,
+        flags_df: pd.DataFrame,
+        flag_cols: List[str],
+        executor: ProcessPoolExecutor,
+    ) -> pd.DataFrame:
+        """Labels one chunk of sentence rows and attaches firm-year user flags"""
+        # Merge sentence data with user flags (the sentence rows carry their own url)
+        merged_sentences = pd.merge(sentence_df, flags_df, on=["cik", "year"], how="left")
 
         # Fill NaN for any sentences whose firm-year didn't have flags
-        flag_cols = [col for col in user_flags_df.columns if col not in ["cik", "year"]]
         merged_sentences[flag_cols] = merged_sentences[flag_cols].fillna(0).astype(int)
 
-        # Prepare data for parallel processing
-        chunk_data = []
-        for _, row in merged_sentences.iterrows():
-            user_flags = {col: row[col] for col in flag_cols}
-            chunk_data.append(
-                (
-                    row["cik"],
-                    row["year"],
-                    row["url"],
-                    row["matches"],
-                    row["server_response"],
-                    user_flags,
-                )
-            )
+        # Only the probabilities are needed to label a sentence
+        prob_cols = prob_columns(self.config.labels)
+        prob_rows = merged_sentences[prob_cols].to_dict("records")
+
+        # Process chunks in parallel; map() keeps the labels in row order
+        labels = []
+        for chunk_labels in executor.map(
+            self.process_sentence_chunk, self._chunkify(prob_rows)
+        ):
+            labels.extend(chunk_labels)
 
-        # Process chunks in parallel
-        all_sentences = []
-        with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
-            futures = [
-                executor.submit(self.process_sentence_chunk, chunk)
-                for chunk in self._chunkify(chunk_data)
-            ]
-            for future in tqdm(
-                as_completed(futures), total=len(futures), desc="Processing sentences"
-            ):
-                all_sentences.extend(future.result())
-
-        sentences_df = pd.DataFrame(all_sentences)
-        print(f"Created {len(sentences_df):,} sentence records")
+        sentences_df = merged_sentences[["cik", "year", "url", "sentence"]].copy()
+        sentences_df["labels"] = labels
+        for col in flag_cols:
+            sentences_df[col] = merged_sentences[col]
+        for label, col in zip(self.config.labels, prob_cols):
+            sentences_df[f"prob_{label}"] = merged_sentences[col]
 
         # The 'labels' column contains a comma-separated string of prioritized labels.
         # The first label is the one with the highest priority.
@@ -137,77 +90,83 @@ class SentenceLabeler:
             )  # Default to irrelevant ID 24
             .apply(lambda x: self.label_mapper.get_label_category(x))
         )
+        return sentences_df
 
-        # Define label groupings for workbook consolidation
-        label_groups = {
-            "General_Hedge": ["General_Derivative", "General_Derivative_Context"],
-            "IR_Hedge": ["IR_Derivative", "IR_Context"],
-            "FX_Hedge": ["FX_Derivative", "FX_Context"],
-            "CP_Hedge": ["Commodity_Derivative", "Commodity_Context"],
-            "EQ_Hedge": ["Equity_Derivative", "Equity_Context"],
-            "Warrant": ["Warrant"],
-            "Embedded_Derivative": ["Embedded_Derivative"],
-            "Speculation": [
-                "Speculation"
-            ],  # Assuming 'Speculation' is a direct category
-            "Irrelevant": ["Irrelevant_Non-Hedge", "Irrelevant"],
-        }
-
-        print("\nWriting labeled sentence files concurrently...")
-        # Using ProcessPoolExecutor here is acceptable as pandas operations inside the writer can be CPU-intensive.
-        with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
-            futures = []
-            for workbook_name, categories_in_group in label_groups.items():
-                # Filter using the list of categories for this group
-                group_df = sentences_df[
-                    sentences_df["category"].isin(categories_in_group)
-                ].copy()
-
-                if group_df.empty:
-                    print(
-                        f"  - Skipping workbook for '{workbook_name}' (no sentences found in this group)."
-                    )
-                    continue
-
-                # The group_name is now the same for the file, sheet, and category filter.
-                future = executor.submit(
-                    self._write_group_workbook, workbook_name, group_df
+    def create_labeled_files(
+        self,
+        sentence_df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+        user_flags_df: pd.DataFrame,
+    ):
+        """
+        Create separate Excel files for each label category with user flags.
+
+        `sentence_df` may be one frame or a stream of chunks
+        (DataLoader.iter_sentence_data). Each chunk is labeled and appended to
+        the group workbooks before the next one is read; the workbooks are
+        written in constant-memory mode, so memory is bounded by the chunk size.
+        """
+        chunks = [sentence_df] if isinstance(sentence_df, pd.DataFrame) else sentence_df
+
+        flag_cols = [
+            col for col in user_flags_df.columns if col not in ["cik", "year", "url"]
+        ]
+        flags_df = user_flags_df[["cik", "year", *flag_cols]]
+
+        writers = {}  # workbook name -> [ExcelWriter, rows written]
+        total = 0
+        print("Labeling sentences and writing labeled sentence files...")
+        try:
+            with ProcessPoolExecutor(max_workers=self.config.num_workers) as executor:
+                for chunk in tqdm(chunks, desc="Processing sentences", unit="chunk"):
+                    sentences_df = self._label_sentences(chunk, flags_df, flag_cols, executor)
+                    total += len(sentences_df)
+                    for workbook_name, categories_in_group in LABEL_GROUPS.items():
+                        # Filter using the list of categories for this group
+                        group_df = sentences_df[
+                            sentences_df["category"].isin(categories_in_group)
+                        ]
+                        if not group_df.empty:
+                            self._append_to_workbook(writers, workbook_name, group_df)
+        finally:
+            for workbook_name, (writer, rows) in writers.items():
+                writer.close()
+                print(f"  ✓ Wrote {workbook_name} workbook ({rows:,} sentences) to {writer.path}")
+
+        print(f"Created {total:,} sentence records")
+        for workbook_name in LABEL_GROUPS:
+            if workbook_name not in writers:
+                print(
+                    f"  - Skipping workbook for '{workbook_name}' (no sentences found in this group)."
                 )
-                futures.append(future)
-
-            for future in tqdm(
-                as_completed(futures), total=len(futures), desc="Writing workbooks"
-            ):
-                try:
-                    result = future.result()
-                    if result:
-                        print(result)
-                except Exception as e:
-                    print(f"An error occurred while writing a workbook: {e}")
-
-    def _write_group_workbook(
-        self, workbook_name: str, group_df: pd.DataFrame
-    ) -> Optional[str]:
-        """Writes a single Excel workbook for a given group of sentences."""
-        if group_df.empty:
-            return f"  Skipping {workbook_name} (no data)"
-
-        filename = (
-            self.config.output_dir
-            / self.config.sentences_dir
-            / f"sentences_{workbook_name}.xlsx"
-        )
 
-        with pd.ExcelWriter(filename, engine="xlsxwriter") as writer:
-            workbook = writer.book
-            workbook.strings_to_urls = False
-            # Since the group is now one definitive category, we can write it directly.
-            sheet_name = workbook_name[:31]
-            # Drop the intermediate 'category' column before writing
-            group_df.drop(columns=["category"]).to_excel(
-                writer, sheet_name=sheet_name, index=False
+    def _append_to_workbook(
+        self, writers: Dict[str, list], workbook_name: str, group_df: pd.DataFrame
+    ):
+        """Appends a chunk of one group's sentences below the rows already written."""
+        if workbook_name not in writers:
+            filename = (
+                self.config.output_dir
+                / self.config.sentences_dir
+                / f"sentences_{workbook_name}.xlsx"
             )
-        return f"  ✓ Wrote {workbook_name} workbook ({len(group_df):,} sentences) to {filename}"
+            # constant_memory flushes each row to disk once written
+            writer = pd.ExcelWriter(
+                filename,
+                engine="xlsxwriter",
+                engine_kwargs={"options": {"constant_memory": True, "strings_to_urls": False}},
+            )
+            writers[workbook_name] = [writer, 0]
+
+        writer, rows = writers[workbook_name]
+        # Drop the intermediate 'category' column before writing
+        group_df.drop(columns=["category"]).to_excel(
+            writer,
+            sheet_name=workbook_name[:31],
+            index=False,
+            header=rows == 0,
+            startrow=0 if rows == 0 else rows + 1,
+        )
+        writers[workbook_name][1] = rows + len(group_df)
 
     def _chunkify(self, data: list) -> List[list]:
         """Splits a list into smaller chunks for parallel processing."""
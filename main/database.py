@@ -1,12 +1,27 @@
 # %%
 ## Initialization
+import re
 import sqlite3
+from pathlib import Path
+from typing import Iterator, List, Optional
+
 import pandas as pd
 
+import text_compression
+from db_connection import get_manager
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
 db_path = "./web_data.db"
+PAGE_SIZE = 20
+EXPORT_CHUNK_SIZE = 10_000
 
 
-def execute_sql(sql: str, head: int = 0) -> pd.DataFrame | int:
+def execute_sql(sql: str, head: int = 0, params=()) -> pd.DataFrame | int:
     """
     Execute a SQL statement on a SQLite database.
 
@@ -15,8 +30,10 @@ def execute_sql(sql: str, head: int = 0) -> pd.DataFrame | int:
     sql : str
         SQL statement to execute.
     head : int, default 0
-        If the query is a SELECT statement and head > 0, return the first `head` rows.
-        Otherwise, returns the full DataFrame.
+        If the query is a SELECT statement and head > 0, only the first `head`
+        rows are read from the cursor. Otherwise, returns the full DataFrame.
+    params : tuple, default ()
+        Values for ? placeholders in `sql`.
 
     Returns
     -------
@@ -24,34 +41,260 @@ def execute_sql(sql: str, head: int = 0) -> pd.DataFrame | int:
         - For SELECT queries, a pandas DataFrame containing the results.
         - For other queries (INSERT, UPDATE, DELETE, etc.), an integer representing the number of affected rows.
     """
-    conn = sqlite3.connect(db_path)
+    # Reuses this thread's connection (WAL, mmap and cache pragmas applied once)
+    conn = get_manager(db_path).connection()
     cursor = conn.cursor()
-    # Automatically determine if the query is a SELECT statement
-    is_select = sql.strip().upper().startswith("SELECT")
 
     try:
-        cursor.execute(sql)
-        if is_select:
-            # Fetch all results for SELECT
+        cursor.execute(sql, params)
+        # Any statement that returns rows (SELECT, PRAGMA, EXPLAIN) has a description
+        if cursor.description is not None:
             columns = [col[0] for col in cursor.description]
-            data = cursor.fetchall()
-            df = pd.DataFrame(data, columns=columns)
-            if head > 0:
-                return df.head(head)  # Return the top `head` rows
-            return df
+            # SQLite produces rows as they are stepped, so fetchmany stops early
+            data = cursor.fetchmany(head) if head > 0 else cursor.fetchall()
+            return pd.DataFrame(data, columns=columns)
         else:
             # Commit changes for INSERT, UPDATE, DELETE, etc.
             conn.commit()
             return cursor.rowcount
+    except sqlite3.Error:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        cursor.close()
+
+
+def iter_query(sql: str, params=(), chunksize: int = EXPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Streams a query's result as DataFrames of at most `chunksize` rows, with
+    compressed text (text_compression.py) decompressed.
+    """
+    conn = get_manager(db_path).connection()
+    codec = text_compression.get_codec(conn)
+    # A dedicated cursor, so other statements can run between chunks
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        columns = [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield text_compression.decompress_frame(pd.DataFrame(rows, columns=columns), codec)
+    finally:
+        cursor.close()
+
+
+def select_list(table: str) -> str:
+    """`table`'s columns for a SELECT, compressed ones read through unzstd()"""
+    compressed = {column for t, column in text_compression.COMPRESSED_COLUMNS if t == table}
+    columns = execute_sql(f"PRAGMA table_info({table})")["name"]
+    return ", ".join(
+        f"unzstd({column}) AS {column}" if column in compressed else column for column in columns
+    )
+
+
+# =============================================================================
+# PAGINATION
+# =============================================================================
+
+# "SELECT * FROM table" with nothing else can be paged by rowid (see has_rowid)
+_TABLE_SCAN_RE = re.compile(r"^\s*SELECT\s+\*\s+FROM\s+(\w+)\s*;?\s*$", re.IGNORECASE)
+_WITHOUT_ROWID_RE = re.compile(r"\bWITHOUT\s+ROWID\s*$", re.IGNORECASE)
+
+
+def has_rowid(name: str) -> bool:
+    """True when `name` is a table with a rowid (not a view or WITHOUT ROWID table)."""
+    row = get_manager(db_path).execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE",
+        (name,),
+    ).fetchone()
+    return row is not None and not _WITHOUT_ROWID_RE.search(row[0] or "")
+
+
+class Pager:
+    """
+    Pages through a SELECT without materializing it.
+
+    Whole-table scans of rowid tables use keyset pagination on rowid
+    (`WHERE rowid > ?`), so every page is an index seek no matter how deep it
+    is. Any other query (views and WITHOUT ROWID tables included) is wrapped
+    in LIMIT/OFFSET, which re-steps the skipped rows on each page.
+    Compressed text columns are shown decompressed.
+    """
+
+    def __init__(self, sql: str, page_size: int = PAGE_SIZE):
+        self.sql = sql.strip().rstrip(";")
+        self.page_size = page_size
+        match = _TABLE_SCAN_RE.match(self.sql)
+        self.table: Optional[str] = (
+            match.group(1) if match and has_rowid(match.group(1)) else None
+        )
+        self.page = 0
+        # Keyset mode: the last rowid before each page that has been shown
+        self._page_starts: List[int] = [0]
+        self._last_rowid = 0
+
+    def _fetch(self, page: int) -> pd.DataFrame:
+        if self.table is not None:
+            df = execute_sql(
+                f"SELECT rowid AS _rowid_, {select_list(self.table)} FROM {self.table} "
+                "WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                params=(self._page_starts[page], self.page_size),
+            )
+            if not df.empty:
+                self._last_rowid = int(df["_rowid_"].iloc[-1])
+            return df.drop(columns="_rowid_")
+        # Arbitrary queries may still select compressed columns directly
+        conn = get_manager(db_path).connection()
+        return text_compression.decompress_frame(
+            execute_sql(
+                f"SELECT * FROM ({self.sql}) LIMIT ? OFFSET ?",
+                params=(self.page_size, page * self.page_size),
+            ),
+            text_compression.get_codec(conn),
+        )
+
+    def first(self) -> pd.DataFrame:
+        self.page = 0
+        return self._fetch(0)
+
+    def next(self) -> pd.DataFrame:
+        if self.table is not None:
+            if self.page + 1 == len(self._page_starts):
+                self._page_starts.append(self._last_rowid)
+        self.page += 1
+        df = self._fetch(self.page)
+        if df.empty:
+            # Stay on the last non-empty page
+            self.page -= 1
+        return df
+
+    def prev(self) -> pd.DataFrame:
+        self.page = max(0, self.page - 1)
+        return self._fetch(self.page)
+
+
+def browse(sql: str, page_size: int = PAGE_SIZE) -> Optional[pd.DataFrame]:
+    """Interactive pager; returns the page shown last."""
+    pager = Pager(sql, page_size)
+    mode = f"keyset on {pager.table}.rowid" if pager.table else "LIMIT/OFFSET"
+    df = pager.first()
+    while True:
+        if df.empty:
+            print("(no more rows)")
+        else:
+            print(f"--- page {pager.page + 1} ({mode}) ---")
+            print(df)
+        action = input("[n]ext, [p]rev, [q]uit: ").strip().lower()
+        if action == "n":
+            df = pager.next()
+        elif action == "p":
+            df = pager.prev()
+        elif action == "q":
+            return df
+
+
+# =============================================================================
+# EXPORT
+# =============================================================================
+
+
+def _parquet_schema(sql: str, table: "pa.Table") -> "pa.Schema":
+    """
+    The Parquet schema for `sql`, from its first chunk. SQLite columns have
+    no fixed type, so a column that is NULL throughout the first chunk takes
+    the type of its first non-NULL value anywhere in the result.
+    """
+    fields = []
+    for field in table.schema:
+        if pa.types.is_null(field.type):
+            name = field.name.replace('"', '""')
+            probe = f'SELECT "{name}" FROM ({sql.strip().rstrip(";")}) WHERE "{name}" IS NOT NULL LIMIT 1'
+            sample = next(iter_query(probe), None)
+            if sample is not None:
+                field = field.with_type(pa.Table.from_pandas(sample, preserve_index=False).schema[0].type)
+        fields.append(field)
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+def export_query(sql: str, path: str, chunksize: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Streams a query to a .csv or .parquet file chunk by chunk and returns the
+    number of rows written (compressed text written as text). Memory use is
+    bounded by `chunksize`.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix not in (".csv", ".parquet"):
+        raise ValueError(f"Unsupported export format '{suffix}' (use .csv or .parquet)")
+    if suffix == ".parquet" and pq is None:
+        raise ImportError("pyarrow is required for Parquet export")
+
+    total = 0
+    writer = None
+    try:
+        for chunk in iter_query(sql, chunksize=chunksize):
+            if suffix == ".csv":
+                chunk.to_csv(path, mode="w" if total == 0 else "a", header=total == 0, index=False)
+            else:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, _parquet_schema(sql, table))
+                try:
+                    table = table.cast(writer.schema)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                    raise ValueError(
+                        f"Rows {total:,}+ don't fit the Parquet schema ({e}); "
+                        "CAST the mixed-type column in the query"
+                    ) from e
+                writer.write_table(table)
+            total += len(chunk)
+            print(f"  ... {total:,} rows written")
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
+# =============================================================================
+# QUERY PLAN
+# =============================================================================
+
+
+def explain(sql: str) -> pd.DataFrame:
+    """
+    EXPLAIN QUERY PLAN as a DataFrame. `full_scan` marks steps that read a
+    whole table without an index (SCAN without USING ... INDEX). SCAN CONSTANT
+    ROW (a SELECT without FROM) reads no table.
+    """
+    df = execute_sql(f"EXPLAIN QUERY PLAN {sql}")
+    detail = df["detail"]
+    df["full_scan"] = (
+        detail.str.startswith("SCAN")
+        & ~detail.str.contains("INDEX")
+        & (detail != "SCAN CONSTANT ROW")
+    )
+    return df
+
+
+def print_plan(sql: str):
+    plan = explain(sql)
+    depth = {0: -1}
+    for row in plan.itertuples(index=False):
+        depth[row.id] = depth.get(row.parent, -1) + 1
+        flag = "  ⚠️ full table scan" if row.full_scan else ""
+        print(f"{'  ' * depth[row.id]}{row.detail}{flag}")
 
 
 # %%
 ## Execute SELECT Statements
-#ff = execute_sql("SELECT * FROM report_data WHERE NOT url=''")
-#ff.to_csv("./report_data.csv", index=False)
-#len(ff)
+#export_query("SELECT * FROM report_data WHERE NOT url=''", "./report_data.csv")
+#ff = execute_sql("SELECT * FROM report_data WHERE NOT url=''", head=20)
+
+# %%
+## Check a query for unindexed scans
+#print_plan("SELECT * FROM report_data r JOIN server_result s ON s.url = r.url")
 
 
 # %%
@@ -60,13 +303,13 @@ def execute_sql(sql: str, head: int = 0) -> pd.DataFrame | int:
 # ff.head()
 
 # %%
-## Execute SELECT Statements on webpage result
-# ff = execute_sql("SELECT * FROM webpage_result")
+## Execute SELECT Statements on extracted paragraphs
+# ff = execute_sql("SELECT url, idx, category, unzstd(text) AS text FROM sentences")
 # ff.head()
 
 # %%
-## Execute SELECT Statements on server result
-#ff = execute_sql("SELECT * FROM server_result")
+## Execute SELECT Statements on predictions
+#ff = execute_sql("SELECT * FROM predictions")
 #ff.head()
 
 # %%
@@ -79,35 +322,59 @@ if __name__ == "__main__":
     last_df = None  # "Global" variable to hold the last queried DataFrame
     # Create a menu for common operations
     print("Database Operations Menu:")
-    print("1. SELECT * FROM webpage_result")
-    print("2. SELECT * FROM server_result")
+    print("1. Browse sentences")
+    print("2. Browse predictions")
     print("3. Custom SQL Query")
-    print("4. Inspect last DataFrame")
-    print("5. Exit")
+    print("4. Export query to CSV/Parquet")
+    print("5. Explain query plan")
+    print("6. Inspect last DataFrame")
+    print("7. Exit")
     print("-" * 30)
 
     while True:
-        choice = input("Enter your choice (1/2/3/4/5): ").strip()
+        choice = input("Enter your choice (1-7): ").strip()
         if choice == "1":
-            df = execute_sql("SELECT * FROM webpage_result")
-            last_df = df
-            print(df.head(20))
+            last_df = browse("SELECT * FROM sentences")
         elif choice == "2":
-            df = execute_sql("SELECT * FROM server_result")
-            last_df = df
-            print(df.head(20))
+            last_df = browse("SELECT * FROM predictions")
         elif choice == "3":
             custom_sql = input("Enter your SQL query: ").strip()
             if custom_sql:
-                result = execute_sql(custom_sql)
-                if isinstance(result, pd.DataFrame):
-                    last_df = result
-                    print(result)
-                else:
-                    print(f"Query executed successfully, {result} rows affected.")
+                try:
+                    if custom_sql.upper().startswith(("SELECT", "WITH")):
+                        last_df = browse(custom_sql)
+                    else:
+                        result = execute_sql(custom_sql)
+                        if isinstance(result, pd.DataFrame):  # PRAGMA and friends
+                            last_df = result
+                            print(result)
+                        else:
+                            print(f"Query executed successfully, {result} rows affected.")
+                except sqlite3.Error as e:
+                    print(f"Query failed: {e}")
             else:
                 print("No SQL query entered.")
         elif choice == "4":
+            custom_sql = input("Enter your SQL query: ").strip()
+            out_path = input("Output file (.csv or .parquet): ").strip()
+            if custom_sql and out_path:
+                try:
+                    rows = export_query(custom_sql, out_path)
+                    print(f"Exported {rows:,} rows to {out_path}")
+                except (ValueError, ImportError, sqlite3.Error) as e:
+                    print(f"Export failed: {e}")
+            else:
+                print("Both a query and an output file are required.")
+        elif choice == "5":
+            custom_sql = input("Enter your SQL query: ").strip()
+            if custom_sql:
+                try:
+                    print_plan(custom_sql)
+                except sqlite3.Error as e:
+                    print(f"Invalid query: {e}")
+            else:
+                print("No SQL query entered.")
+        elif choice == "6":
             if last_df is not None:
                 print("Last DataFrame is available as 'last_df'.")
                 print("You can perform operations like 'last_df.iloc[0]' or 'last_df.info()'.")
@@ -116,7 +383,7 @@ if __name__ == "__main__":
                 code.interact(local=locals())
             else:
                 print("No DataFrame has been loaded yet. Please run a query first.")
-        elif choice == "5":
+        elif choice == "7":
             print("Exiting the program.")
             break
         else:
@@ -0,0 +1,136 @@
+# =============================================================================
+# Shared SQLite connections (one per thread, per process)
+# =============================================================================
+# Opening a connection costs a file open, schema parse and pragma setup, and
+# throws away sqlite3's per-connection prepared-statement cache. The helpers
+# in colab.py / classify-new.py / database.py run once per URL, from fetch
+# threads and parse processes, so they share long-lived connections instead.
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+OpenHook = Callable[[sqlite3.Connection], None]
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers don't block the writer (and vice versa)
+    "synchronous": "NORMAL",  # Safe with WAL; fsync only at checkpoints
+    "mmap_size": 256 * 1024**2,
+    "cache_size": -64 * 1024,  # Negative = KiB: 64 MB page cache per connection
+    "temp_store": "MEMORY",
+}
+BUSY_TIMEOUT_SECONDS = 60  # Parse processes write concurrently
+STATEMENT_CACHE_SIZE = 512  # Prepared statements kept per connection, keyed by SQL text
+
+# Run on every connection any manager opens, after the pragmas (see add_open_hook)
+_open_hooks: List[OpenHook] = []
+
+
+def add_open_hook(hook: OpenHook):
+    """
+    Runs `hook(conn)` on every connection opened from now on, e.g. to register
+    SQL functions (text_compression adds unzstd() this way when imported).
+    """
+    if hook not in _open_hooks:
+        _open_hooks.append(hook)
+
+
+class ConnectionManager:
+    """
+    Hands every thread its own connection to `db_path`, opened once with
+    DEFAULT_PRAGMAS applied. Statements are compiled once per connection and
+    reused from sqlite3's statement cache as long as the SQL text is the same,
+    so hot paths should use constant SQL with ? parameters.
+
+    Connections are never shared across threads or inherited across fork():
+    a forked worker (ProcessPoolExecutor) opens its own on first use.
+    `on_open` hooks run on each new connection after the global ones.
+    """
+
+    def __init__(
+        self, db_path: str, pragmas: Optional[Dict] = None, on_open: Optional[List[OpenHook]] = None
+    ):
+        self.db_path = db_path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.on_open = list(on_open or [])
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._connections = []
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            # Only close_all() touches a connection from another thread
+            check_same_thread=False,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for hook in _open_hooks + self.on_open:
+            hook(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        if self._pid != os.getpid():
+            # Inherited from the parent process: drop (never close) its handles
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """
+        Yields this thread's connection; commits on success, rolls back on
+        error. `immediate` takes the write lock up front (BEGIN IMMEDIATE), for
+        read-then-write sequences that other processes must not interleave.
+        """
+        conn = self.connection()
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def close_all(self):
+        """Closes every connection of this process, e.g. before replacing the file."""
+        with self._lock:
+            if self._pid == os.getpid():
+                for conn in self._connections:
+                    try:
+                        conn.close()
+                    except sqlite3.Error:
+                        pass
+            self._reset()
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path: str) -> ConnectionManager:
+    """The process-wide manager for `db_path`."""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = ConnectionManager(db_path)
+        return _managers[key]
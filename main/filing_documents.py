@@ -0,0 +1,107 @@
+# =============================================================================
+# Which documents of a filing the crawler parses (colab.py)
+# =============================================================================
+# A filing URL in report_data points at its primary document. Some form types
+# put the disclosures in exhibits instead, which are only discoverable through
+# the accession's index.json. That index costs one more SEC request, so it is
+# only fetched for form types whose rule can pick up an exhibit, and each
+# accession's index is fetched once per process (co-registrants file the same
+# accession under several CIKs).
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import json_codec
+
+# Per form type: exhibit filenames worth parsing, and whether the primary
+# document still carries the disclosures once such exhibits exist.
+# 40-F primaries are mostly wrappers around the annual information form,
+# MD&A and financial statements filed as EX-99.x; 20-Fs sometimes ship the
+# annual report as EX-15/EX-99; older 10-K/10-KSB filings incorporate the
+# annual report to shareholders as EX-13.
+EX13_PATTERN = re.compile(r"ex(?:hibit)?[-_]?13", re.IGNORECASE)
+FORM_DOCUMENT_RULES = {
+    "40-F": {"exhibits": re.compile(r"ex(?:hibit)?[-_]?99", re.IGNORECASE), "keep_primary": False},
+    "20-F": {"exhibits": re.compile(r"ex(?:hibit)?[-_]?(?:15|99)", re.IGNORECASE), "keep_primary": True},
+    "10-K": {"exhibits": EX13_PATTERN, "keep_primary": True},
+    "10-KT": {"exhibits": EX13_PATTERN, "keep_primary": True},
+    "10-K405": {"exhibits": EX13_PATTERN, "keep_primary": True},
+    "10KSB": {"exhibits": EX13_PATTERN, "keep_primary": True},
+    "10KSB40": {"exhibits": EX13_PATTERN, "keep_primary": True},
+}
+# Unknown form types (including rows stored before form types were) are
+# parsed from the primary document alone, without an index request
+DEFAULT_DOCUMENT_RULE = {"exhibits": None, "keep_primary": True}
+MAX_FILING_DOCUMENTS = 6  # Upper bound on documents fetched per filing
+INDEX_CACHE_SIZE = 4096  # Accession indexes kept in memory
+
+_index_cache: "OrderedDict[str, List[Dict]]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def document_rule(form_type: Optional[str]) -> Dict:
+    return FORM_DOCUMENT_RULES.get(form_type, DEFAULT_DOCUMENT_RULE)
+
+
+def needs_index(url: str, form_type: Optional[str]) -> bool:
+    """Complete-submission .txt files already hold every document."""
+    return url.endswith("htm") and document_rule(form_type)["exhibits"] is not None
+
+
+def filing_index(base_url: str, fetch: Callable[[str], Optional[str]]) -> List[Dict]:
+    """
+    The `directory.item` entries of a filing's index.json, cached by
+    accession number. Failed fetches return [] and are not cached, so a
+    rate-limited index is requested again on the filing's next attempt.
+    """
+    accession = base_url.rstrip("/").rsplit("/", 1)[-1]
+    with _index_lock:
+        if accession in _index_cache:
+            _index_cache.move_to_end(accession)
+            return _index_cache[accession]
+
+    index_text = fetch(f"{base_url}/index.json")
+    if not index_text:
+        return []
+    try:
+        items = json_codec.loads(index_text).get("directory", {}).get("item", [])
+    except json_codec.DecodeError:
+        items = []
+    with _index_lock:
+        _index_cache[accession] = items
+        if len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return items
+
+
+def select_documents(url: str, form_type: Optional[str], items: List[Dict]) -> List[str]:
+    """The document URLs to parse, given the filing's index items."""
+    base_url, primary_doc = url.rsplit("/", 1)
+    rule = document_rule(form_type)
+    exhibits = sorted(
+        item["name"]
+        for item in items
+        if rule["exhibits"] is not None
+        and item.get("name", "").lower().endswith((".htm", ".html"))
+        and item["name"] != primary_doc
+        and rule["exhibits"].search(item["name"])
+    )
+    documents = [f"{base_url}/{name}" for name in exhibits]
+    if rule["keep_primary"] or not documents:
+        documents.insert(0, url)
+    return documents[:MAX_FILING_DOCUMENTS]
+
+
+def resolve_filing_documents(
+    url: str, form_type: Optional[str], fetch: Callable[[str], Optional[str]]
+) -> List[str]:
+    """
+    The documents to parse for a filing. `fetch(url)` returns the body or
+    None; it is only called for the index, and only when needs_index says so.
+    Any index failure falls back to the primary document alone.
+    """
+    if not needs_index(url, form_type):
+        return [url]
+    items = filing_index(url.rsplit("/", 1)[0], fetch)
+    return select_documents(url, form_type, items)
@@ -0,0 +1,176 @@
+# =============================================================================
+# Model backends for the derivative classifier
+# =============================================================================
+# server.py runs the classifier through one of these backends (MODEL_BACKEND):
+#
+#   torch   the Hugging Face model in fp32 PyTorch (GPU if available)
+#   onnx    an ONNX export with dynamic int8 quantization, run by ONNX
+#           Runtime on CPU; create it with `python onnx_export.py`
+#
+# Both take a padded batch of token IDs and return sigmoid probabilities as a
+# float32 NumPy matrix (one row of len(labels) per sequence, computed by
+# vectorized ops with no per-element conversion), and can be re-threaded after a
+# fork (set_num_threads) for worker_pool.WorkerPool. `revision` identifies
+# the weights (for prediction_cache). Heavy imports happen in
+# the backend that needs them, so an ONNX deployment doesn't need torch.
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence
+
+MODEL_PATH = "DerivedFunction/derivative-classifier"  # Hugging Face model
+ONNX_MODEL_PATH = "onnx/derivative-classifier-int8.onnx"
+MAX_LENGTH = 512
+# Inputs longer than MAX_LENGTH are split into windows overlapping by this
+# many tokens (sliding_windows), up to MAX_WINDOWS per input
+WINDOW_OVERLAP = 128
+MAX_WINDOWS = 16
+
+
+def physical_cores() -> int:
+    """Physical cores if psutil knows them; hyperthreads don't help GEMMs."""
+    try:
+        import psutil
+
+        return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    except ImportError:
+        return os.cpu_count() or 1
+
+
+def file_digest(path: str) -> str:
+    """Short content hash of a model file (changes whenever it is re-exported)."""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TorchBackend:
+    name = "torch"
+    tensor_type = "pt"  # tokenizer.pad(return_tensors=...)
+
+    def __init__(self, model_path: str = MODEL_PATH):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        self.torch = torch
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model.to(self.device)
+        self.model.eval()  # evaluation mode
+        # Hub commit of the downloaded weights (None for a local directory)
+        commit = getattr(self.model.config, "_commit_hash", None)
+        self.revision = f"{model_path}@{commit}" if commit else model_path
+
+    @property
+    def forkable(self) -> bool:
+        # CUDA contexts don't survive fork()
+        return self.device.type == "cpu"
+
+    def set_num_threads(self, num_threads: int):
+        self.torch.set_num_threads(num_threads)
+
+    def probabilities(self, inputs: Dict):
+        # Move inputs to the same device as the model
+        inputs = {key: val.to(self.device) for key, val in inputs.items()}
+        with self.torch.no_grad():
+            logits = self.model(**inputs).logits
+            return self.torch.sigmoid(logits).float().cpu().numpy()
+
+
+class OnnxBackend:
+    name = "onnx"
+    tensor_type = "np"
+    forkable = True
+
+    def __init__(self, onnx_path: str = ONNX_MODEL_PATH, intra_op_threads: Optional[int] = None):
+        import numpy as np
+        import onnxruntime as ort
+
+        self.np = np
+        self.ort = ort
+        self.onnx_path = onnx_path
+        self.revision = f"{onnx_path}@{file_digest(onnx_path)}"
+        self.set_num_threads(
+            intra_op_threads or int(os.environ.get("ORT_INTRA_OP_THREADS", physical_cores()))
+        )
+
+    def set_num_threads(self, num_threads: int):
+        """(Re)creates the session; also gives a forked worker its own session."""
+        ort = self.ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # One request batch at a time: all threads go to the operators themselves
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            self.onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def probabilities(self, inputs: Dict):
+        feed = {
+            key: self.np.asarray(val, dtype=self.np.int64)
+            for key, val in inputs.items()
+            if key in self.input_names
+        }
+        if "token_type_ids" in self.input_names and "token_type_ids" not in feed:
+            # Single-sequence inputs padded from bare input_ids
+            feed["token_type_ids"] = self.np.zeros_like(feed["input_ids"])
+        (logits,) = self.session.run(["logits"], feed)
+        return (1 / (1 + self.np.exp(-logits))).astype(self.np.float32)
+
+
+def sliding_windows(
+    input_ids: Sequence[int],
+    max_length: int = MAX_LENGTH,
+    overlap: int = WINDOW_OVERLAP,
+    prefix_length: int = 0,
+    max_windows: int = MAX_WINDOWS,
+) -> List[List[int]]:
+    """
+    `input_ids` ([CLS] ... [SEP]) as sequences of at most `max_length` tokens.
+    A longer input's body is cut into windows overlapping by `overlap`
+    tokens; each window keeps the first and last token and the first
+    `prefix_length` body tokens (the <reportYear> prefix). Text beyond
+    `max_windows` windows is dropped.
+    """
+    if len(input_ids) <= max_length:
+        return [list(input_ids)]
+    first, last = input_ids[0], input_ids[-1]
+    prefix = list(input_ids[1 : 1 + prefix_length])
+    body = input_ids[1 + prefix_length : -1]
+    size = max_length - 2 - len(prefix)
+    if size <= overlap:
+        return [list(input_ids[: max_length - 1]) + [last]]
+    windows = []
+    for start in range(0, len(body), size - overlap):
+        windows.append([first, *prefix, *body[start : start + size], last])
+        if start + size >= len(body) or len(windows) == max_windows:
+            break
+    return windows
+
+
+def load_backend(name: Optional[str] = None, **kwargs):
+    """The backend named by `name` or $MODEL_BACKEND (default: torch)."""
+    name = name or os.environ.get("MODEL_BACKEND", "torch")
+    if name == "torch":
+        return TorchBackend(**kwargs)
+    if name == "onnx":
+        return OnnxBackend(**kwargs)
+    raise ValueError(f"Unknown model backend '{name}' (use 'torch' or 'onnx')")
+
+
+def predict_probabilities(
+    backend, tokenizer, texts: Sequence[str], max_length: int = MAX_LENGTH
+):
+    """Tokenize + one padded forward pass (no bucketing); for checks and benchmarks."""
+    inputs = tokenizer(
+        list(texts),
+        padding=True,
+        truncation=True,
+        max_length=max_length,
+        return_tensors=backend.tensor_type,
+    )
+    return backend.probabilities(dict(inputs))
@@ -0,0 +1,110 @@
+# =============================================================================
+# JSON codec shared by every blob reader and writer
+# =============================================================================
+# matches / tables / server_response blobs and the /predict payloads are all
+# JSON. They go through this module so the fastest installed backend is used
+# everywhere: orjson, then msgspec, then the standard library. All backends
+# read what the others wrote (orjson and msgspec emit UTF-8 instead of
+# \u escapes, which json.loads reads back identically).
+import json
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+# Every backend's decode error (orjson's subclasses json.JSONDecodeError)
+DecodeError = (
+    (ValueError, msgspec.DecodeError) if msgspec is not None else (ValueError,)
+)
+
+if msgspec is not None:
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    class _PredictionResponse(msgspec.Struct):
+        """{"predictions": [{label: p}, ...]}; other response keys are skipped."""
+
+        predictions: List[Dict[str, float]] = []
+
+    # Typed decoders validate the shape while parsing, with no intermediate dicts
+    # of arbitrary values: a server response or the bare stored list
+    _prediction_list_decoder = msgspec.json.Decoder(List[Dict[str, float]])
+    _prediction_response_decoder = msgspec.json.Decoder(_PredictionResponse)
+
+
+def dumpb(obj: Any) -> bytes:
+    """Serializes to UTF-8 bytes (HTTP bodies)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    if msgspec is not None:
+        return _encoder.encode(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def dumps(obj: Any) -> str:
+    """Serializes to str (SQLite TEXT columns)."""
+    if orjson is None and msgspec is None:
+        return json.dumps(obj, separators=(",", ":"))
+    return dumpb(obj).decode()
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        return _decoder.decode(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def decode_predictions(data: Union[str, bytes]) -> List[dict]:
+    """
+    {label: probability} dicts, one per sentence ({"error": -1} on failure).
+    Accepts a server response ({"predictions": [...]}) or a stored bare list.
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if msgspec is not None:
+        head = data.lstrip()[:1]
+        if head in ("{", b"{"):
+            return _prediction_response_decoder.decode(data).predictions
+        return _prediction_list_decoder.decode(data)
+    value = loads(data)
+    if isinstance(value, dict):
+        value = value.get("predictions", [])
+    if not isinstance(value, list):
+        raise ValueError("Expected a list of predictions")
+    return value
+
+
+def decode_probabilities(
+    data: Union[str, bytes], labels: Sequence[str]
+) -> List[Optional[array]]:
+    """
+    Decodes predictions straight into float32 arrays in `labels` order, one per
+    sentence. Failed predictions decode to None; a missing label is NaN.
+    """
+    rows = []
+    nan = float("nan")
+    for prob_dict in decode_predictions(data):
+        if not isinstance(prob_dict, dict) or "error" in prob_dict:
+            rows.append(None)
+            continue
+        rows.append(array("f", [prob_dict.get(label, nan) for label in labels]))
+    return rows
@@ -0,0 +1,129 @@
+# =============================================================================
+# Export the classifier to int8 ONNX, check parity and benchmark
+# =============================================================================
+# python onnx_export.py                  export + quantize + parity check
+# python onnx_export.py --bench          ... and time it against PyTorch
+# python onnx_export.py --skip-export    check/benchmark an existing export
+#
+# The server then runs it with MODEL_BACKEND=onnx (see inference.py).
+import argparse
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from inference import MAX_LENGTH, MODEL_PATH, ONNX_MODEL_PATH, OnnxBackend, TorchBackend
+from inference import predict_probabilities
+from quantization import LABELS
+
+# int8 weights move probabilities a little; a label flips only if a
+# probability crosses the threshold by less than this
+PARITY_TOLERANCE = 0.05
+OPSET = 17
+
+PARITY_TEXTS = [
+    "We use interest rate swaps to convert a portion of our fixed-rate debt to floating rates.",
+    "The Company enters into foreign currency forward contracts to hedge forecasted purchases denominated in euros.",
+    "Commodity futures contracts are used to manage the price risk of natural gas purchases.",
+    "We do not use derivative financial instruments for trading or speculative purposes.",
+    "In prior years the Company held interest rate caps, all of which expired in 2012.",
+    "The warrants are classified as liabilities and remeasured at fair value each reporting period.",
+    "The conversion option embedded in the notes was bifurcated and accounted for as a derivative.",
+    "Revenue increased due to higher volumes in the retail segment.",
+    "Our headquarters are located in a leased facility in Chicago, Illinois.",
+    "Gains and losses on derivatives designated as cash flow hedges are deferred in other comprehensive income.",
+]
+
+
+def export(output: Path, model_path: str = MODEL_PATH) -> Path:
+    """Exports fp32 ONNX with dynamic batch/sequence axes, then quantizes to int8."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    model.eval()
+
+    sample = tokenizer(PARITY_TEXTS[:2], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fp32_path = output.with_name(output.stem.replace("-int8", "") + "-fp32.onnx")
+    print(f"Exporting {model_path} -> {fp32_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(fp32_path),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET,
+        )
+
+    print(f"Quantizing (dynamic int8) -> {output}")
+    # Weights stored as int8; activations quantized on the fly per batch
+    quantize_dynamic(str(fp32_path), str(output), weight_type=QuantType.QInt8)
+    print(
+        f"✅ {fp32_path.stat().st_size / 1024**2:.0f} MB fp32 -> "
+        f"{output.stat().st_size / 1024**2:.0f} MB int8"
+    )
+    return output
+
+
+def max_differences(expected: np.ndarray, actual: np.ndarray, labels: List[str]):
+    """Largest absolute probability difference per label."""
+    return dict(zip(labels, np.abs(expected - actual).max(axis=0).tolist()))
+
+
+def parity_check(torch_backend, onnx_backend, tokenizer, labels: List[str]) -> bool:
+    expected = predict_probabilities(torch_backend, tokenizer, PARITY_TEXTS)
+    actual = predict_probabilities(onnx_backend, tokenizer, PARITY_TEXTS)
+    diffs = max_differences(expected, actual, labels)
+    print(f"Parity on {len(PARITY_TEXTS)} texts (tolerance {PARITY_TOLERANCE}):")
+    for label, diff in diffs.items():
+        flag = "✓" if diff <= PARITY_TOLERANCE else "❌"
+        print(f"  {flag} {label:>8}: max |Δp| = {diff:.4f}")
+    ok = all(diff <= PARITY_TOLERANCE for diff in diffs.values())
+    print("✅ Parity check passed" if ok else "❌ Parity check failed")
+    return ok
+
+
+def benchmark(torch_backend, onnx_backend, tokenizer, batch_size: int = 32, repeat: int = 3):
+    """Texts/sec of both backends on paragraph-length inputs."""
+    texts = [" ".join(PARITY_TEXTS[i:] + PARITY_TEXTS[:i]) for i in range(batch_size)]
+    for backend in (torch_backend, onnx_backend):
+        predict_probabilities(backend, tokenizer, texts[:2])  # Warm-up
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            predict_probabilities(backend, tokenizer, texts, MAX_LENGTH)
+            best = min(best, time.perf_counter() - start)
+        print(f"{backend.name:>6}: {batch_size / best:7.1f} texts/s ({best * 1000:.0f} ms per batch of {batch_size})")
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    parser = argparse.ArgumentParser(description="Export the classifier to int8 ONNX")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--output", type=Path, default=Path(ONNX_MODEL_PATH))
+    parser.add_argument("--skip-export", action="store_true")
+    parser.add_argument("--bench", action="store_true")
+    args = parser.parse_args()
+
+    if not args.skip_export:
+        export(args.output, args.model)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    torch_backend = TorchBackend(args.model)
+    onnx_backend = OnnxBackend(str(args.output))
+
+    ok = parity_check(torch_backend, onnx_backend, tokenizer, LABELS)
+    if args.bench:
+        benchmark(torch_backend, onnx_backend, tokenizer)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,271 @@
+# =============================================================================
+# Server-side prediction cache
+# =============================================================================
+# The same boilerplate paragraphs ("We do not use derivative financial
+# instruments for trading purposes...") recur across thousands of filings.
+# server.py looks every text up here before batching it for the model:
+#
+#   memory  an LRU of recent rows, bounded by bytes
+#   disk    a SQLite table of every row computed, bounded by bytes (least
+#           recently used rows are evicted first); survives restarts
+#
+# Keys hash (model revision, normalized text or token IDs), and the file
+# remembers the revision it was filled with: starting the server with a
+# different model (or backend) clears it. Rows are the model's float32 probabilities, so a
+# cache hit returns exactly what the forward pass returned.
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from db_connection import ConnectionManager
+
+MAX_MEMORY_BYTES = 256 * 1024**2
+MAX_DISK_BYTES = 2 * 1024**3
+# Per-entry bookkeeping on top of key + row bytes (OrderedDict node, bytes objects)
+ENTRY_OVERHEAD = 160
+DISK_ROW_OVERHEAD = 40  # SQLite record + index entry, roughly
+EVICT_FRACTION = 0.1  # Share of rows dropped when the disk budget is exceeded
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of a text (the tokenizer ignores it too)."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(revision: str, text) -> bytes:
+    """Key of a text, or of a list of token IDs sent pre-tokenized."""
+    if isinstance(text, str):
+        data = f"{revision}\0{normalize_text(text)}".encode("utf-8")
+    else:
+        data = f"{revision}\0ids\0".encode("utf-8") + np.asarray(text, dtype="<i4").tobytes()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class PredictionCache:
+    """
+    get_many/put_many of float32 probability rows for texts under one model
+    `revision`. `path=None` keeps the cache in memory only. Thread-safe; hit
+    and miss counts are reported by snapshot().
+    """
+
+    def __init__(
+        self,
+        revision: str,
+        num_labels: int,
+        path: Optional[str] = None,
+        max_memory_bytes: int = MAX_MEMORY_BYTES,
+        max_disk_bytes: int = MAX_DISK_BYTES,
+    ):
+        self.revision = revision
+        self.num_labels = num_labels
+        self.row_bytes = num_labels * 4
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self.memory_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk = None
+        self.disk_rows = 0
+        if path:
+            self.disk = ConnectionManager(path)
+            self._open_disk()
+
+    def _open_disk(self):
+        with self.disk.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS prediction_cache (
+                    key BLOB PRIMARY KEY,
+                    probabilities BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                ) WITHOUT ROWID
+            """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_prediction_cache_last_used "
+                "ON prediction_cache(last_used)"
+            )
+            row = conn.execute(
+                "SELECT value FROM cache_meta WHERE key = 'revision'"
+            ).fetchone()
+            if row is None or row[0] != self.revision:
+                if row is not None:
+                    print(f"🗑️  Model revision changed ({row[0]} -> {self.revision}); clearing cache")
+                conn.execute("DELETE FROM prediction_cache")
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_meta VALUES ('revision', ?)", (self.revision,)
+                )
+            self.disk_rows = conn.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+
+    @property
+    def disk_bytes(self) -> int:
+        return self.disk_rows * (16 + self.row_bytes + DISK_ROW_OVERHEAD)  # 16-byte keys
+
+    def _disk_get(self, keys: List[bytes]) -> Dict[bytes, bytes]:
+        found = {}
+        now = time.time()
+        with self.disk.transaction() as conn:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                marks = ",".join("?" * len(chunk))
+                found.update(
+                    conn.execute(
+                        f"SELECT key, probabilities FROM prediction_cache WHERE key IN ({marks})",
+                        chunk,
+                    ).fetchall()
+                )
+            conn.executemany(
+                "UPDATE prediction_cache SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+        return found
+
+    def _disk_put(self, items: Dict[bytes, bytes]):
+        now = time.time()
+        with self.disk.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO prediction_cache VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items.items()],
+            )
+            inserted = conn.total_changes - before
+            with self._lock:
+                self.disk_rows += inserted
+            if self.disk_bytes > self.max_disk_bytes:
+                row_size = 16 + self.row_bytes + DISK_ROW_OVERHEAD
+                over = self.disk_rows - self.max_disk_bytes // row_size
+                # Evict down to the budget plus some headroom, not one row per insert
+                evict = max(over, int(self.disk_rows * EVICT_FRACTION), 1)
+                conn.execute(
+                    """
+                    DELETE FROM prediction_cache WHERE key IN (
+                        SELECT key FROM prediction_cache ORDER BY last_used LIMIT ?
+                    )
+                """,
+                    (evict,),
+                )
+                evicted = conn.execute("SELECT changes()").fetchone()[0]
+                with self._lock:
+                    self.disk_rows -= evicted
+
+    def _remember(self, key: bytes, value: bytes):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = value
+        self.memory_bytes += len(key) + len(value) + ENTRY_OVERHEAD
+        while self.memory_bytes > self.max_memory_bytes and self._memory:
+            old_key, old_value = self._memory.popitem(last=False)
+            self.memory_bytes -= len(old_key) + len(old_value) + ENTRY_OVERHEAD
+
+    def keys(self, texts: Sequence[str]) -> List[bytes]:
+        return [cache_key(self.revision, text) for text in texts]
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """The cached row for each key, or None."""
+        rows: List[Optional[np.ndarray]] = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._memory.get(key)
+                if value is None:
+                    missing.append(i)
+                    continue
+                self._memory.move_to_end(key)
+                rows[i] = np.frombuffer(value, dtype=np.float32)
+                self.memory_hits += 1
+
+        if missing and self.disk is not None:
+            found = self._disk_get(list({keys[i] for i in missing}))
+            with self._lock:
+                for key, value in found.items():
+                    self._remember(key, value)
+            still_missing = []
+            for i in missing:
+                value = found.get(keys[i])
+                if value is None:
+                    still_missing.append(i)
+                else:
+                    rows[i] = np.frombuffer(value, dtype=np.float32)
+            with self._lock:
+                self.disk_hits += len(missing) - len(still_missing)
+            missing = still_missing
+
+        with self._lock:
+            self.misses += len(missing)
+        return rows
+
+    def put_many(self, keys: Sequence[bytes], rows: Sequence[np.ndarray]):
+        items = {
+            key: np.asarray(row, dtype=np.float32).tobytes() for key, row in zip(keys, rows)
+        }
+        with self._lock:
+            for key, value in items.items():
+                self._remember(key, value)
+        if self.disk is not None and items:
+            self._disk_put(items)
+
+    def lookup(self, texts: Sequence) -> Tuple[List[bytes], List, Dict[bytes, int]]:
+        """
+        (keys, cached rows or None, pending): `pending` maps each distinct
+        uncached key to the index of its first text, the texts to predict.
+        """
+        keys = self.keys(texts)
+        rows = self.get_many(keys)
+        pending: Dict[bytes, int] = {}
+        for i, (key, row) in enumerate(zip(keys, rows)):
+            if row is None:
+                pending.setdefault(key, i)
+        return keys, rows, pending
+
+    def fill(self, keys, rows, pending, computed) -> List[np.ndarray]:
+        """Caches the rows `computed` for `pending` and completes `rows`."""
+        self.put_many(list(pending), computed)
+        by_key = dict(zip(pending, computed))
+        return [by_key[key] if row is None else row for key, row in zip(keys, rows)]
+
+    def predict(self, texts: Sequence, predict_fn: Callable) -> List[np.ndarray]:
+        """
+        One row per text: cached rows where available, the rest from
+        `predict_fn(texts) -> rows`, called once with each distinct uncached
+        text and cached afterwards.
+        """
+        keys, rows, pending = self.lookup(texts)
+        if pending:
+            computed = predict_fn([texts[i] for i in pending.values()])
+            rows = self.fill(keys, rows, pending, computed)
+        return rows
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "revision": self.revision,
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": self.disk_rows,
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close_all()
@@ -0,0 +1,126 @@
+# =============================================================================
+# Quantized probability storage
+# =============================================================================
+# The server rounds every probability to 3 decimals, so storing them as
+# uint16 milli-units (probability * 1000, 0..1000) is lossless.
+#
+# In web_data.db the milli-units live in the INTEGER p_<label> columns of
+# the predictions table (sentence_store.py), one row per sentence, rather than
+# in one packed BLOB per report: SQL can then filter and count by label
+# (DataLoader, DuckDBEngine) without decoding every report in Python. SQLite
+# stores values up to 1000 in 2 bytes, the same as the packed format.
+#
+# The packed format is used by the server's application/x-predictions
+# responses (built and parsed as NumPy matrices by encode_matrix /
+# decode_matrix) and is still read from legacy server_response blobs:
+#
+#     byte 0       format version (1)
+#     byte 1       number of labels N
+#     byte 2...    N little-endian uint16 per sentence, in LABELS order
+#
+# A failed prediction ({"error": -1}) is packed as N x MISSING.
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+import json_codec
+
+LABELS = [
+    "ir", "fx", "cp", "eq", "gen",
+    "ir_use", "fx_use", "cp_use", "eq_use", "gen_use",
+    "curr", "hist", "spec",
+    "warr", "emb",
+    "irr",
+]
+SCALE = 1000
+MISSING = 0xFFFF
+FORMAT_VERSION = 1
+HEADER_SIZE = 2
+
+
+def quantize(probability: Optional[float]) -> Optional[int]:
+    if probability is None or probability != probability:  # None or NaN
+        return None
+    return min(SCALE, max(0, int(round(probability * SCALE))))
+
+
+def dequantize(value: Optional[int]) -> Optional[float]:
+    if value is None or value == MISSING:
+        return None
+    return value / SCALE
+
+
+def quantize_row(prediction, labels: Sequence[str] = LABELS) -> Optional[List[Optional[int]]]:
+    """
+    Quantized values in `labels` order, or None for a failed prediction.
+    `prediction` is a {label: probability} dict (server response shape) or a
+    sequence already in label order (json_codec.decode_probabilities).
+    """
+    if isinstance(prediction, dict):
+        if "error" in prediction:
+            return None
+        return [quantize(prediction.get(label)) for label in labels]
+    if prediction is None or isinstance(prediction, (int, str)):
+        return None
+    return [quantize(p) for p in prediction]
+
+
+def encode_predictions(predictions: Sequence, labels: Sequence[str] = LABELS) -> bytes:
+    """Packs a report's predictions (see quantize_row) into a BLOB."""
+    values = array("H")
+    for prediction in predictions or []:
+        row = quantize_row(prediction, labels)
+        if row is None:
+            values.extend([MISSING] * len(labels))
+            continue
+        values.extend(MISSING if q is None else q for q in row)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return bytes([FORMAT_VERSION, len(labels)]) + values.tobytes()
+
+
+def encode_matrix(probabilities) -> bytes:
+    """A (sentences x labels) probability array as a BLOB, in one vectorized pass."""
+    import numpy as np
+
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    values = np.rint(np.clip(probabilities, 0, 1) * SCALE)
+    values = np.where(np.isnan(probabilities), MISSING, values).astype("<u2")
+    return bytes([FORMAT_VERSION, probabilities.shape[1]]) + values.tobytes()
+
+
+def decode_matrix(blob: bytes, dtype="float32"):
+    """A BLOB as a (sentences x labels) `dtype` array, NaN where MISSING."""
+    import numpy as np
+
+    if len(blob) < HEADER_SIZE or blob[0] != FORMAT_VERSION:
+        raise ValueError("Unknown prediction BLOB format")
+    values = np.frombuffer(blob, dtype="<u2", offset=HEADER_SIZE).reshape(-1, blob[1])
+    probabilities = values.astype(dtype) / SCALE
+    probabilities[values == MISSING] = np.nan
+    return probabilities
+
+
+def decode_predictions(blob: bytes, labels: Sequence[str] = LABELS) -> List[Dict]:
+    """
+    Inverse of encode_predictions, in the server's response shape. Building
+    the dicts costs more than the decode itself; readers that only need the
+    values should use decode_matrix.
+    """
+    predictions = []
+    # float64 division gives the same floats as value / SCALE in Python
+    for row in decode_matrix(blob, "float64").tolist():
+        prediction = {label: p for label, p in zip(labels, row) if p == p}  # NaN != NaN
+        predictions.append(prediction or {"error": -1})
+    return predictions
+
+
+def load_predictions(value, labels: Sequence[str] = LABELS):
+    """
+    Reads server_result.server_response in either format: a BLOB as a
+    (sentences x labels) decode_matrix array, legacy JSON as the server's
+    {label: probability} dicts. quantize_row accepts both row shapes.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decode_matrix(bytes(value))
+    return json_codec.decode_predictions(value)
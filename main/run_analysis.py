@@ -6,7 +6,9 @@ from custom_analyzers.analysis import (
     LabelMapper,
     PredictionsProcessor,
     pd,
+    prob_columns,
 )
+from custom_analyzers.export import ParquetExporter
 from custom_analyzers.comparison import ComparisonAnalyzer, WorkbookManager
 from custom_analyzers.reporting import SentenceLabeler
 from custom_analyzers.accuracy import AccuracySampler, AccuracyConfig
@@ -30,6 +32,8 @@ class RunOptions:
     run_custom_analyzers: bool = True
     run_disagreement_sampler: bool = False
     generate_sentence_files: bool = True
+    # Writes the Parquet dataset that later sentence-level steps read from
+    export_parquet: bool = False
 
 
 # =============================================================================
@@ -58,6 +62,7 @@ class AnalysisPipeline:
 
         # Map run options to pipeline methods for modular execution
         self._step_map = {
+            "export_parquet": self._run_parquet_export,
             "run_comparison": self._run_comparison_analysis,
             "run_custom_analyzers": self._run_custom_analyzers,
             "generate_sentence_files": self._run_sentence_generation,
@@ -130,24 +135,40 @@ class AnalysisPipeline:
 
         # 1. Load data
         print("\n[1/4] Loading data...")
-        model_df = self.data_loader.load_model_predictions()
         keyword_df = self.data_loader.load_keyword_data()
 
         # 2. Process model predictions
         print("\n[2/4] Processing predictions...")
-        model_agg = self.predictions_processor.process_predictions(model_df)
+        engine = self.data_loader.analytical_engine()
+        if engine is not None:
+            # One multithreaded DuckDB query over the attached database
+            model_agg = engine.firm_year_flags()
+        else:
+            # One chunk at a time (the per-URL prediction table is never
+            # held in memory as a whole)
+            model_agg = self.predictions_processor.process_predictions(
+                self.data_loader.iter_model_predictions()
+            )
 
         # Store data for other steps to use
-        self._pipeline_data["model_df"] = model_df
         self._pipeline_data["keyword_df"] = keyword_df
         self._pipeline_data["model_agg_df"] = model_agg
-        self._pipeline_data["original_model_agg_df"] = model_agg.copy() # Store a copy
+        # Comparison replaces model_agg_df with a new merged frame and never
+        # modifies this one in place, so no copy is needed
+        self._pipeline_data["original_model_agg_df"] = model_agg
         self._data_loaded = True
 
+    def _run_parquet_export(self):
+        """Exports sentences and predictions to the partitioned Parquet dataset."""
+        print("\n[Extra] Exporting sentences to Parquet...")
+        ParquetExporter(self.config).export()
+
     def _run_comparison_analysis(self):
         """Runs the keyword vs. model comparison and saves the workbook."""
         print("\n[Extra] Running Keyword vs. Model Comparison...")
-        comparison_analyzer = ComparisonAnalyzer(self.config, self.label_mapper)
+        comparison_analyzer = ComparisonAnalyzer(
+            self.config, self.label_mapper, engine=self.data_loader.analytical_engine()
+        )
         comparison_results = comparison_analyzer.analyze(
             keyword_df=self._pipeline_data["keyword_df"],
             model_df=self._pipeline_data["model_agg_df"],
@@ -190,10 +211,13 @@ class AnalysisPipeline:
     def _run_sentence_generation(self):
         """Generates labeled sentence files."""
         print("\n[Extra] Creating labeled sentence files (this may take a while)...")
-        sentence_df = self.data_loader.load_sentence_data()
+        # Streamed in read_chunk_size batches; each is labeled and written out
+        sentence_chunks = self.data_loader.iter_sentence_data(
+            columns=["cik", "year", "url", "sentence", *prob_columns(self.config.labels)]
+        )
         # Use the aggregated model data which now contains keyword flags if comparison was run
         user_flags_df = self._pipeline_data["model_agg_df"]
-        self.sentence_labeler.create_labeled_files(sentence_df, user_flags_df)
+        self.sentence_labeler.create_labeled_files(sentence_chunks, user_flags_df)
 
     def _run_accuracy_check(self):
         """Runs the accuracy sampling process."""
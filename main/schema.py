@@ -0,0 +1,271 @@
+# =============================================================================
+# web_data.db schema and versioned migrations
+# =============================================================================
+# The schema version lives in PRAGMA user_version. Each migration runs in its
+# own transaction and bumps the version, so `migrate` only applies what a
+# database is missing and can be called on every start-up (colab.py and
+# classify-new.py both do so from create_db).
+#
+# Run `python schema.py [web_data.db]` to migrate a database by hand, and
+# `python schema.py [web_data.db] --drop-legacy` to drop the JSON blob columns
+# once they have been backfilled (see drop_legacy_blobs).
+import sqlite3
+import sys
+from typing import Callable, List, Tuple
+
+import sentence_store
+import text_compression
+from db_connection import get_manager
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _v1_baseline(conn: sqlite3.Connection):
+    """Tables as colab.py / classify-new.py created them before versioning."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_data (
+            cik INTEGER,
+            year INTEGER,
+            url TEXT,
+            form_type TEXT
+        )
+    """
+    )
+    # Databases created before form types were stored lack the column
+    if "form_type" not in _columns(conn, "report_data"):
+        conn.execute("ALTER TABLE report_data ADD COLUMN form_type TEXT")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS names (
+            cik INTEGER,
+            name TEXT
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webpage_result (
+            url TEXT,
+            matches TEXT,
+            FOREIGN KEY (url) REFERENCES report_data(url)
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fail_results (
+            cik INTEGER,
+            year INTEGER,
+            url TEXT,
+            reason TEXT
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS table_result (
+            url TEXT PRIMARY KEY,
+            tables TEXT,
+            FOREIGN KEY (url) REFERENCES report_data(url)
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS server_result (
+            url TEXT PRIMARY KEY,
+            server_response BLOB,
+            FOREIGN KEY (url) REFERENCES report_data (url)
+        )
+    """
+    )
+    # Normalized one-row-per-paragraph copy of matches for SQL analysis
+    sentence_store.create_tables(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS name_idx ON names (name)")
+
+
+def _v2_keys_and_covering_indexes(conn: sqlite3.Connection):
+    """
+    - `url_idx` was created on report_data or server_result (whichever script
+      ran first); the second CREATE INDEX IF NOT EXISTS silently did nothing,
+      so webpage_result never got one. Replace it with uniquely named indexes.
+    - webpage_result gets url as PRIMARY KEY (INSERT OR REPLACE used to append
+      duplicates); the last row written for a URL wins.
+    - report_data gets a unique (url, cik, year) index: it enforces the key and
+      covers url joins that only need cik/year, without touching the table.
+    """
+    conn.execute("DROP INDEX IF EXISTS url_idx")
+
+    conn.execute(
+        """
+        CREATE TABLE webpage_result_new (
+            url TEXT PRIMARY KEY,
+            matches TEXT,
+            FOREIGN KEY (url) REFERENCES report_data(url)
+        )
+    """
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO webpage_result_new (url, matches) "
+        "SELECT url, matches FROM webpage_result WHERE url IS NOT NULL ORDER BY rowid"
+    )
+    conn.execute("DROP TABLE webpage_result")
+    conn.execute("ALTER TABLE webpage_result_new RENAME TO webpage_result")
+
+    conn.execute(
+        "DELETE FROM report_data WHERE rowid NOT IN "
+        "(SELECT MIN(rowid) FROM report_data GROUP BY url, cik, year)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS report_data_url_cik_year_idx "
+        "ON report_data (url, cik, year)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS report_data_cik_year_idx ON report_data (cik, year)"
+    )
+
+    # classify-new.py used to create fail_results without the reason column
+    if "reason" not in _columns(conn, "fail_results"):
+        conn.execute("ALTER TABLE fail_results ADD COLUMN reason TEXT")
+
+
+def _v3_text_dictionary(conn: sqlite3.Connection):
+    """zstd dictionaries for sentences.text / webpage_result.matches (text_compression.py)."""
+    text_compression.create_tables(conn)
+
+
+def _v4_backfill_normalized_tables(conn: sqlite3.Connection):
+    """
+    `sentences` / `predictions` become the copy the pipeline reads: reports
+    still held only in webpage_result.matches or server_result.server_response
+    are backfilled. The blob columns are left in place (reports that fail to
+    decode stay readable there) until drop_legacy_blobs is run by hand.
+    """
+    sentence_store.backfill(conn, commit=False)
+
+
+def _v5_crawl_queue(conn: sqlite3.Connection):
+    """
+    The durable crawl queue (work_queue.py). Reports already in
+    webpage_result are seeded as done, so the first queued run on an existing
+    database doesn't refetch them.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS crawl_queue (
+            url TEXT PRIMARY KEY,
+            form_type TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            lease_owner TEXT,
+            lease_expires REAL,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS crawl_queue_status_idx "
+        "ON crawl_queue (status, next_attempt_at)"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO crawl_queue (url, status, updated_at) "
+        "SELECT DISTINCT url, 'done', strftime('%s', 'now') FROM webpage_result "
+        "WHERE url IS NOT NULL"
+    )
+
+
+def _v6_prediction_failure_marker(conn: sqlite3.Connection):
+    """predictions.failed marks sentences the server returned an error for."""
+    sentence_store.create_tables(conn)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline tables", _v1_baseline),
+    (2, "unique keys and covering indexes", _v2_keys_and_covering_indexes),
+    (3, "text compression dictionaries", _v3_text_dictionary),
+    (4, "backfill sentences/predictions from the JSON blobs", _v4_backfill_normalized_tables),
+    (5, "durable crawl queue", _v5_crawl_queue),
+    (6, "explicit failure marker on predictions", _v6_prediction_failure_marker),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Applies pending migrations in order and returns the resulting version."""
+    conn.commit()  # Start from a clean transaction state
+    version = current_version(conn)
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        print(f"🗄️  Migrating database schema to v{target}: {description}")
+        conn.execute("SAVEPOINT schema_migration")
+        try:
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("RELEASE schema_migration")
+        except BaseException:
+            conn.execute("ROLLBACK TO schema_migration")
+            conn.execute("RELEASE schema_migration")
+            raise
+        conn.commit()
+        version = target
+    return version
+
+
+def drop_legacy_blobs(conn: sqlite3.Connection):
+    """
+    Opt-in (`python schema.py --drop-legacy`): drops webpage_result.matches
+    and server_result.server_response once every report in them has been
+    backfilled, then VACUUMs. Rolls back without dropping anything if a
+    single report could not be backfilled. Needs SQLite 3.35+ (DROP COLUMN).
+    """
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        raise RuntimeError(f"DROP COLUMN needs SQLite 3.35+, this is {sqlite3.sqlite_version}")
+    migrate(conn)
+    legacy = [
+        (table, column)
+        for table, column in (("webpage_result", "matches"), ("server_result", "server_response"))
+        if column in _columns(conn, table)
+    ]
+    if not legacy:
+        print("No legacy blob columns left")
+        return
+
+    conn.execute("SAVEPOINT drop_legacy")
+    try:
+        skipped = sentence_store.backfill(conn, commit=False)["skipped"]
+        if skipped:
+            raise ValueError(
+                f"{skipped} reports could not be backfilled; fix or delete them, "
+                "then drop the legacy columns again"
+            )
+        for table, column in legacy:
+            print(f"🗑️  Dropping {table}.{column}")
+            conn.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+        conn.execute("RELEASE drop_legacy")
+    except BaseException:
+        conn.execute("ROLLBACK TO drop_legacy")
+        conn.execute("RELEASE drop_legacy")
+        raise
+    conn.commit()
+    print("Reclaiming space (VACUUM)...")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # No-op outside WAL mode
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    db_path = args[0] if args else "web_data.db"
+    conn = get_manager(db_path).connection()
+    print(f"{db_path}: schema v{current_version(conn)} -> v{migrate(conn)}")
+    if "--drop-legacy" in sys.argv:
+        drop_legacy_blobs(conn)
@@ -0,0 +1,253 @@
+# =============================================================================
+# Normalized sentence / prediction storage (web_data.db)
+# =============================================================================
+# `sentences` holds one row per extracted paragraph and `predictions` one row
+# of per-label probabilities per paragraph, both keyed by (url, idx).
+# Probabilities are stored quantized as integer milli-units (see
+# quantization.py), which SQLite packs into 2 bytes instead of 8. idx is
+# the paragraph's position in the flattened `matches` dict, which is also the
+# position of its prediction in the legacy `server_response` list. text is
+# stored zstd-compressed once a dictionary is trained (text_compression.py).
+#
+# These tables are what the pipeline reads and writes: schema v4 (schema.py)
+# backfills them from the legacy blobs in webpage_result.matches /
+# server_result.server_response, which are kept (read-only) until
+# `python schema.py --drop-legacy` drops them. Run
+# `python sentence_store.py [web_data.db]` to backfill a database by hand.
+import sqlite3
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import json_codec
+import text_compression
+from db_connection import get_manager
+from quantization import LABELS, SCALE, dequantize, load_predictions, quantize_row
+
+PROB_COLUMNS = [f"p_{label}" for label in LABELS]
+MIGRATION_BATCH_SIZE = 500
+
+
+def _quantize_real_predictions(conn: sqlite3.Connection):
+    """Rewrites a predictions table that still holds REAL probabilities."""
+    columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(predictions)")}
+    if columns.get(PROB_COLUMNS[0], "").upper() != "REAL":
+        return
+    print("Quantizing predictions table to milli-units...")
+    conn.execute("ALTER TABLE predictions RENAME TO predictions_real")
+    _create_predictions(conn)
+    scaled = ", ".join(f"CAST(ROUND({col} * {SCALE}) AS INTEGER)" for col in PROB_COLUMNS)
+    conn.execute(
+        f"INSERT INTO predictions (url, idx, {', '.join(PROB_COLUMNS)}, failed) "
+        f"SELECT url, idx, {scaled}, {PROB_COLUMNS[0]} IS NULL FROM predictions_real"
+    )
+    conn.execute("DROP TABLE predictions_real")
+
+
+def _create_predictions(conn: sqlite3.Connection):
+    """
+    One row per sentence: p_<label> in milli-units, and `failed` = 1 when the
+    server returned an error marker for the sentence (probabilities NULL).
+    """
+    prob_columns = ",\n            ".join(f"{col} INTEGER" for col in PROB_COLUMNS)
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS predictions (
+            url TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            {prob_columns},
+            failed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (url, idx)
+        )
+    """
+    )
+    # Tables created before the marker flagged failures only by all-NULL rows
+    if "failed" not in {row[1] for row in conn.execute("PRAGMA table_info(predictions)")}:
+        conn.execute("ALTER TABLE predictions ADD COLUMN failed INTEGER NOT NULL DEFAULT 0")
+        all_null = " AND ".join(f"{col} IS NULL" for col in PROB_COLUMNS)
+        conn.execute(f"UPDATE predictions SET failed = 1 WHERE {all_null}")
+
+
+def create_tables(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sentences (
+            url TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            category TEXT,
+            text TEXT NOT NULL,
+            PRIMARY KEY (url, idx)
+        )
+    """
+    )
+    _quantize_real_predictions(conn)
+    _create_predictions(conn)
+    conn.execute("CREATE INDEX IF NOT EXISTS sentences_category_idx ON sentences (category)")
+
+
+def flatten_matches(matches) -> List[Tuple[Optional[str], str]]:
+    """(category, text) pairs in the order consumers have always flattened them."""
+    if isinstance(matches, dict):
+        return [
+            (category, text)
+            for category, texts in matches.items()
+            if isinstance(texts, list)
+            for text in texts
+        ]
+    if isinstance(matches, list):
+        # Old list format carried no categories
+        return [(None, text) for text in matches]
+    return []
+
+
+def group_matches(pairs: Iterable[Tuple[Optional[str], str]]):
+    """Inverse of flatten_matches: the categorized dict (or the old plain list)."""
+    matches: Dict[Optional[str], List[str]] = {}
+    for category, text in pairs:
+        matches.setdefault(category, []).append(text)
+    if list(matches) == [None]:
+        return matches[None]
+    return matches
+
+
+def prediction_row(url: str, idx: int, prediction) -> tuple:
+    """
+    (url, idx, *probabilities, failed). Error markers ({"error": -1}) keep
+    their row, so indices stay aligned, with NULL probabilities and failed = 1.
+    """
+    row = quantize_row(prediction)
+    if row is None:
+        return (url, idx) + (None,) * len(LABELS) + (1,)
+    return (url, idx) + tuple(row) + (0,)
+
+
+def prediction_rows(url: str, predictions: Iterable) -> List[tuple]:
+    if predictions is None:
+        return []
+    return [prediction_row(url, idx, prob) for idx, prob in enumerate(predictions)]
+
+
+def prediction_from_row(values: Sequence[Optional[int]], failed: bool = False) -> Dict:
+    """Inverse of prediction_row (probability columns, failed), in the server's response shape."""
+    if failed:
+        return {"error": -1}
+    return {
+        label: dequantize(value) for label, value in zip(LABELS, values) if value is not None
+    }
+
+
+def save_sentences(conn: sqlite3.Connection, url: str, matches):
+    codec = text_compression.get_codec(conn)
+    conn.execute("DELETE FROM sentences WHERE url = ?", (url,))
+    conn.executemany(
+        "INSERT INTO sentences (url, idx, category, text) VALUES (?, ?, ?, ?)",
+        [
+            (url, idx, category, codec.compress(text))
+            for idx, (category, text) in enumerate(flatten_matches(matches))
+        ],
+    )
+
+
+def save_predictions(conn: sqlite3.Connection, url: str, predictions: Iterable, rows=None):
+    """`rows` may carry prediction_rows(url, predictions) already built by the caller."""
+    placeholders = ", ".join("?" * (3 + len(PROB_COLUMNS)))
+    conn.execute("DELETE FROM predictions WHERE url = ?", (url,))
+    conn.executemany(
+        f"INSERT INTO predictions (url, idx, {', '.join(PROB_COLUMNS)}, failed) VALUES ({placeholders})",
+        prediction_rows(url, predictions) if rows is None else rows,
+    )
+
+
+def get_sentence_texts(conn: sqlite3.Connection, url: str) -> List[str]:
+    rows = conn.execute(
+        "SELECT text FROM sentences WHERE url = ? ORDER BY idx", (url,)
+    ).fetchall()
+    codec = text_compression.get_codec(conn)
+    return [codec.decompress(text) for (text,) in rows]
+
+
+# =============================================================================
+# MIGRATION FROM THE JSON-BLOB SCHEMA
+# =============================================================================
+
+
+def _migrate_table(
+    conn: sqlite3.Connection, source_sql: str, save_fn, parse_fn, label: str, commit: bool
+) -> Tuple[int, int]:
+    """(reports migrated, reports skipped because their blob could not be read)"""
+    migrated = skipped = 0
+    # A separate cursor streams the source rows while the connection writes
+    reader = conn.cursor()
+    reader.execute(source_sql)
+    while True:
+        rows = reader.fetchmany(MIGRATION_BATCH_SIZE)
+        if not rows:
+            break
+        for url, blob in rows:
+            try:
+                save_fn(conn, url, parse_fn(blob))
+                migrated += 1
+            except (*json_codec.DecodeError, TypeError) as e:
+                print(f"⚠️  Skipping {url} for {label}: {e}")
+                skipped += 1
+        if commit:
+            conn.commit()
+        print(f"  ... {migrated:,} reports migrated into {label}")
+    return migrated, skipped
+
+
+def backfill(conn: sqlite3.Connection, commit: bool = True) -> Dict[str, int]:
+    """
+    Backfills `sentences` and `predictions` from webpage_result.matches and
+    server_result.server_response (JSON or quantized BLOB), where those
+    columns still exist. URLs already present are skipped, so the backfill
+    can be interrupted and re-run. `commit=False` leaves committing to the
+    caller (schema.py runs it inside a migration). "skipped" counts the
+    reports whose blob could not be decoded; they stay only in the blob.
+    """
+    create_tables(conn)
+    codec = text_compression.get_codec(conn)
+    columns = {
+        table: {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for table in ("webpage_result", "server_result")
+    }
+    results = {"sentences": 0, "predictions": 0, "skipped": 0}
+    if "matches" in columns["webpage_result"]:
+        print("Migrating webpage_result.matches -> sentences...")
+        results["sentences"], skipped = _migrate_table(
+            conn,
+            "SELECT url, matches FROM webpage_result WHERE matches IS NOT NULL "
+            "AND url NOT IN (SELECT DISTINCT url FROM sentences)",
+            save_sentences,
+            lambda matches: json_codec.loads(codec.decompress(matches)),
+            "sentences",
+            commit,
+        )
+        results["skipped"] += skipped
+    if "server_response" in columns["server_result"]:
+        print("Migrating server_result.server_response -> predictions...")
+        results["predictions"], skipped = _migrate_table(
+            conn,
+            "SELECT url, server_response FROM server_result WHERE server_response IS NOT NULL "
+            "AND url NOT IN (SELECT DISTINCT url FROM predictions)",
+            save_predictions,
+            load_predictions,
+            "predictions",
+            commit,
+        )
+        results["skipped"] += skipped
+    return results
+
+
+def migrate(db_path: str = "web_data.db") -> Dict[str, int]:
+    with get_manager(db_path).transaction() as conn:
+        return backfill(conn)
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "web_data.db"
+    print("=" * 70)
+    print(f"Migrating {db_path} to the normalized sentence schema")
+    print("=" * 70)
+    counts = migrate(db_path)
+    print(f"✅ Migrated {counts['sentences']:,} reports into sentences")
+    print(f"✅ Migrated {counts['predictions']:,} reports into predictions")
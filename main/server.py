@@ -1,70 +1,430 @@
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import json
-
-app = Flask(__name__)
-
-# Paths
-MODEL_PATH = "DerivedFunction/derivative-classifier"  # your saved Hugging Face model
-# Load tokenizer & model
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-model.eval()  # evaluation mode
-
-# Correct labels for the multi-label model
-labels = [
-    "ir", "fx", "cp", "eq", "gen",
-    "ir_use", "fx_use", "cp_use", "eq_use", "gen_use",
-    "curr", "hist", "spec",
-    "warr", "emb",
-    "irr",
-]
-id2label = {i: label for i, label in enumerate(labels)}
-label2id = {label: i for i, label in enumerate(labels)}
-
-
-# Prediction function for batches
-def predict_batch(texts):
-    # Tokenize the batch
-    inputs = tokenizer(
-        texts, padding=True, truncation=True, max_length=512, return_tensors="pt"
+import asyncio
+import functools
+import math
+import os
+import queue
+import re
+import time
+
+# Forked inference workers (INFERENCE_WORKERS > 0) only run the model; this
+# process tokenizes, so the Rust tokenizer keeps its own thread pool
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+
+import io
+
+import numpy as np
+import uvicorn
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from transformers import AutoTokenizer
+
+import inference
+import json_codec
+import quantization
+from quantization import LABELS
+from batching import MicroBatcher, PaddingStats, length_buckets
+from prediction_cache import PredictionCache
+from worker_pool import WorkerPool
+
+# Load tokenizer & model. MODEL_BACKEND=onnx serves the int8 ONNX export
+# (python onnx_export.py) through ONNX Runtime instead of fp32 PyTorch.
+tokenizer = AutoTokenizer.from_pretrained(inference.MODEL_PATH)
+backend = inference.load_backend()
+print(f"Serving {inference.MODEL_PATH} with the {backend.name} backend")
+
+# Labels of the multi-label model, in the order predictions are stored
+id2label = {i: label for i, label in enumerate(LABELS)}
+label2id = {label: i for i, label in enumerate(LABELS)}
+
+
+# Prometheus metrics (GET /metrics)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REQUESTS = Counter("predict_requests_total", "/predict requests by response status", ["status"])
+TEXTS = Counter("predict_texts_total", "Texts received by /predict")
+BATCH_SIZE = Histogram(
+    "predict_batch_size", "Texts per micro-batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+STAGE_SECONDS = Histogram(
+    "predict_stage_seconds",
+    "Seconds per stage: queue (oldest text in a batch), tokenize and model "
+    "(per batch), request (per /predict call)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+TOKENS = Counter("predict_tokens_total", "Tokens run through the model, excluding padding")
+PADDED_TOKENS = Counter("predict_padded_tokens_total", "Tokens run through the model, including padding")
+QUEUE_DEPTH = Gauge("predict_queue_depth", "Texts waiting to be batched")
+TOKENS_PER_SECOND = Gauge("predict_tokens_per_second", "Tokens per second of model time since start-up")
+CACHE = Gauge("predict_cache", "Prediction cache counters since start-up and sizes", ["stat"])
+
+
+# Inputs longer than MAX_LENGTH tokens: LONG_INPUTS=window (default) scores
+# overlapping windows and keeps each label's highest probability; "truncate"
+# drops everything after the first MAX_LENGTH tokens
+LONG_INPUTS = os.environ.get("LONG_INPUTS", "window")
+if LONG_INPUTS not in ("window", "truncate"):
+    raise ValueError(f"LONG_INPUTS must be 'window' or 'truncate', not {LONG_INPUTS!r}")
+WINDOWED = LONG_INPUTS == "window"
+YEAR_PREFIX_RE = re.compile(r"<reportYear>\d+</reportYear> ")
+
+
+@functools.lru_cache(maxsize=256)
+def prefix_length(prefix):
+    """Tokens of a <reportYear> prefix, repeated at the start of every window"""
+    return len(tokenizer(prefix, add_special_tokens=False)["input_ids"])
+
+
+def truncate(ids):
+    """First MAX_LENGTH tokens, keeping the final [SEP]"""
+    if len(ids) <= inference.MAX_LENGTH:
+        return list(ids)
+    return list(ids[: inference.MAX_LENGTH - 1]) + list(ids[-1:])
+
+
+# Tokenizer stage: runs on TOKENIZER_THREADS threads ahead of the model, so
+# the next batch is tokenized while the current one runs
+@STAGE_SECONDS.labels("tokenize").time()
+def tokenize(items):
+    """
+    The model's input sequences for each item (one, or several windows of a
+    long input): texts are encoded in one call, token-ID lists sent by
+    clients are used as they are.
+    """
+    texts = [i for i, item in enumerate(items) if isinstance(item, str)]
+    input_ids = [None] * len(items)
+    if texts:
+        encodings = tokenizer(
+            [items[i] for i in texts],
+            truncation=not WINDOWED,
+            max_length=None if WINDOWED else inference.MAX_LENGTH,
+        )
+        for i, ids in zip(texts, encodings["input_ids"]):
+            input_ids[i] = ids
+
+    sequences = []
+    for item, ids in zip(items, input_ids):
+        if ids is None:
+            ids = item  # Pre-tokenized
+        if not WINDOWED:
+            sequences.append([truncate(ids)])
+            continue
+        prefix = YEAR_PREFIX_RE.match(item) if isinstance(item, str) else None
+        sequences.append(
+            inference.sliding_windows(
+                ids, prefix_length=prefix_length(prefix.group()) if prefix else 0
+            )
+        )
+    return sequences
+
+
+# Model stage
+def run_batch(sequences):
+    """
+    Runs the windows of every item together, one forward pass per bucket of
+    similar-length windows (padded only to that bucket's longest), then
+    max-pools each item's windows. Returns a float32 probability matrix in
+    the original item order and (token lengths, seconds) per pass.
+    """
+    input_ids = [ids for windows in sequences for ids in windows]
+    lengths = [len(ids) for ids in input_ids]
+    probabilities = np.empty((len(input_ids), len(LABELS)), dtype=np.float32)
+    passes = []
+
+    for bucket in length_buckets(lengths):
+        start = time.perf_counter()
+        inputs = tokenizer.pad(
+            {"input_ids": [input_ids[i] for i in bucket]},
+            return_tensors=backend.tensor_type,
+        )
+        probabilities[bucket] = backend.probabilities(dict(inputs))
+        passes.append(([lengths[i] for i in bucket], time.perf_counter() - start))
+
+    if len(input_ids) > len(sequences):
+        # First window of each item; a label scores its best window
+        starts = np.cumsum([0] + [len(windows) for windows in sequences[:-1]])
+        probabilities = np.maximum.reduceat(probabilities, starts, axis=0)
+    return probabilities, passes
+
+
+@STAGE_SECONDS.labels("model").time()
+def predict_batch(input_ids):
+    """run_batch in this process, or in the first idle worker process"""
+    probabilities, passes = pool.call(input_ids) if pool is not None else run_batch(input_ids)
+    for lengths, seconds in passes:
+        padding_stats.record(lengths, seconds)
+        TOKENS.inc(sum(lengths))
+        PADDED_TOKENS.inc(len(lengths) * max(lengths))
+    return list(probabilities)  # One row per item for the batcher
+
+
+def record_batch(batch_size, queued_seconds):
+    BATCH_SIZE.observe(batch_size)
+    STAGE_SECONDS.labels("queue").observe(queued_seconds)
+
+
+padding_stats = PaddingStats()
+pool = None
+if INFERENCE_WORKERS and not backend.forkable:
+    print("⚠️  INFERENCE_WORKERS needs a CPU backend; serving in-process")
+elif INFERENCE_WORKERS:
+    # Forked after the model is loaded: workers share its weights copy-on-write,
+    # each pinned to its own cores with that many intra-op threads
+    pool = WorkerPool(run_batch, INFERENCE_WORKERS, on_start=backend.set_num_threads)
+    print(f"Started {INFERENCE_WORKERS} inference workers on cores {pool.core_sets}")
+
+# Concurrent requests share forward passes: up to 256 texts are coalesced
+# (waiting at most 10 ms for more), tokenized, and split into length buckets.
+# With workers, one dispatcher per worker keeps every worker busy. Requests
+# that would queue more than MAX_QUEUED_TEXTS texts get 503 + Retry-After.
+TOKENIZER_THREADS = int(os.environ.get("TOKENIZER_THREADS", "2"))
+MAX_QUEUED_TEXTS = int(os.environ.get("MAX_QUEUED_TEXTS", "8192"))
+batcher = MicroBatcher(
+    predict_batch,
+    max_batch_size=256,
+    num_dispatchers=max(1, INFERENCE_WORKERS),
+    prepare_fn=tokenize,
+    prepare_workers=TOKENIZER_THREADS,
+    max_queue=MAX_QUEUED_TEXTS,
+    on_batch=record_batch,
+)
+QUEUE_DEPTH.set_function(lambda: batcher.queue_depth)
+TOKENS_PER_SECOND.set_function(lambda: padding_stats.snapshot()["tokens_per_second"])
+
+# The model was trained on "<reportYear>YYYY</reportYear> paragraph". Clients
+# send the year as a separate field and the server adds the prefix, with the
+# year rounded down to YEAR_BUCKET_SIZE years (0 leaves it out entirely), so a
+# paragraph repeated across the years of one bucket is one cache entry. The
+# cache key includes the prefix: with exact years (1) boilerplate carried from
+# one year to the next never hits; `python benchmark.py year_buckets` puts the
+# hit rate at ~0% for 1, ~60% for 5 and ~76% for 0.
+YEAR_PREFIX = "<reportYear>{year}</reportYear> "
+YEAR_BUCKET_SIZE = int(os.environ.get("YEAR_BUCKET_SIZE", "5"))
+
+
+def with_year(texts, year):
+    """The model inputs for `texts` from a report of `year` (None: as sent)"""
+    if year is None or YEAR_BUCKET_SIZE <= 0:
+        return texts
+    prefix = YEAR_PREFIX.format(year=year - year % YEAR_BUCKET_SIZE)
+    return [prefix + text for text in texts]
+
+
+# Repeated paragraphs are answered from the cache without reaching the model.
+# PREDICTION_CACHE="" keeps it in memory only; MODEL_REVISION overrides the
+# revision the backend reports (the on-disk cache is cleared when it changes).
+MODEL_REVISION = os.environ.get("MODEL_REVISION") or f"{backend.name}:{backend.revision}"
+cache = PredictionCache(
+    f"{MODEL_REVISION}:{LONG_INPUTS}",  # Windowed and truncated inputs score differently
+    len(LABELS),
+    path=os.environ.get("PREDICTION_CACHE", "prediction_cache.db"),
+    max_memory_bytes=int(os.environ.get("PREDICTION_CACHE_MB", "256")) * 1024**2,
+    max_disk_bytes=int(os.environ.get("PREDICTION_CACHE_DISK_MB", "2048")) * 1024**2,
+)
+for stat in ("memory_hits", "disk_hits", "misses", "hit_rate", "memory_bytes", "disk_bytes"):
+    CACHE.labels(stat).set_function(functools.partial(lambda s: cache.snapshot()[s], stat))
+
+# Request limits (413 beyond them)
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_MB", "16")) * 1024**2
+MAX_TEXTS_PER_REQUEST = int(os.environ.get("MAX_TEXTS_PER_REQUEST", "4096"))
+
+
+def json_response(obj, status=200, headers=None):
+    """A JSON response serialized with the fast json_codec backend"""
+    return Response(
+        json_codec.dumpb(obj), status_code=status, media_type="application/json", headers=headers
     )
-    # Move inputs to the same device as the model
-    inputs = {key: val.to(device) for key, val in inputs.items()}
-
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        probabilities = torch.sigmoid(logits)
-        
-    # Create a list of dictionaries with label probabilities
-    results = []
-    for text_probs in probabilities:
-        label_probs = {id2label[i]: round(prob.item(), 3) for i, prob in enumerate(text_probs)}
-        results.append(label_probs)
-
-    return {"predictions": results}
-
-
-# Flask route
-@app.route("/predict", methods=["POST"])
-def predict_endpoint():
-    data = request.json
-    if "texts" not in data or not isinstance(data["texts"], list):
-        return (
-            jsonify({"error": "Missing or invalid 'texts' field; must be a list"}),
-            400,
+
+
+# Binary /predict responses, chosen with the Accept header. Both carry the
+# label order once, in X-Labels, instead of repeating it for every text:
+#   application/x-predictions  quantization.py's BLOB (uint16 milli-units,
+#                              the same values the JSON rounds to)
+#   application/x-npy          float16 matrix (texts x labels) in .npy format
+PACKED_MIMETYPE = "application/x-predictions"
+NPY_MIMETYPE = "application/x-npy"
+
+
+def encode_npy(probabilities):
+    buffer = io.BytesIO()
+    np.save(buffer, probabilities.astype(np.float16), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def best_mimetype(accept, offered):
+    """The first of `offered` with the highest q-value in an Accept header"""
+    best, best_q = offered[0], 0.0
+    quality = {}
+    for part in (accept or "*/*").split(","):
+        mimetype, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[mimetype.strip()] = q
+    for mimetype in offered:
+        family = mimetype.split("/")[0] + "/*"
+        q = quality.get(mimetype, quality.get(family, quality.get("*/*", 0.0)))
+        if q > best_q:
+            best, best_q = mimetype, q
+    return best
+
+
+def predictions_response(probabilities, accept):
+    """The probability matrix in the format the client asked for"""
+    mimetype = best_mimetype(accept, ["application/json", PACKED_MIMETYPE, NPY_MIMETYPE])
+    if mimetype == "application/json":
+        # Vectorized rounding; float64 so 0.123 doesn't serialize as 0.12300000339
+        rows = np.round(probabilities.astype(np.float64), 3).tolist()
+        return json_response({"predictions": [dict(zip(LABELS, row)) for row in rows]})
+    if mimetype == PACKED_MIMETYPE:
+        body = quantization.encode_matrix(probabilities)
+    else:
+        body = encode_npy(probabilities)
+    return Response(body, media_type=mimetype, headers={"X-Labels": ",".join(LABELS)})
+
+
+vocab_size = len(tokenizer)
+
+
+def valid_input_ids(items):
+    """A list of non-empty token-ID lists the model's embeddings can look up"""
+    return isinstance(items, list) and all(
+        isinstance(ids, list)
+        and ids
+        and all(type(t) is int and 0 <= t < vocab_size for t in ids)
+        for ids in items
+    )
+
+
+def retry_after():
+    """Seconds until the queue should have drained, at the recent model throughput"""
+    texts_per_second = batcher.texts_run / padding_stats.seconds if padding_stats.seconds else 0
+    return max(1, math.ceil(batcher.queue_depth / texts_per_second)) if texts_per_second else 1
+
+
+async def predict_rows(items):
+    """Cached rows, the rest from the micro-batcher (awaited, not blocking the loop)"""
+    keys, rows, pending = await run_in_threadpool(cache.lookup, items)
+    if pending:
+        future = batcher.submit([items[i] for i in pending.values()])  # May raise queue.Full
+        computed = await asyncio.wrap_future(future)
+        rows = await run_in_threadpool(cache.fill, keys, rows, pending, computed)
+    return rows
+
+
+async def parse_predict_request(request):
+    """(model inputs, None) or (None, error response)"""
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        return None, json_response({"error": "Invalid Content-Length header"}, 400)
+    if content_length > MAX_REQUEST_BYTES:
+        return None, json_response({"error": f"Request body over {MAX_REQUEST_BYTES} bytes"}, 413)
+    body = await request.body()
+    if len(body) > MAX_REQUEST_BYTES:
+        return None, json_response({"error": f"Request body over {MAX_REQUEST_BYTES} bytes"}, 413)
+    try:
+        data = json_codec.loads(body)
+    except json_codec.DecodeError:
+        data = None
+
+    if isinstance(data, dict) and "input_ids" in data:
+        # Pre-tokenized by the client ([CLS]/[SEP] and any <reportYear>
+        # prefix included); skips the tokenizer stage
+        items = data["input_ids"]
+        if not valid_input_ids(items):
+            return None, json_response(
+                {"error": f"Invalid 'input_ids'; must be lists of token IDs below {vocab_size}"},
+                400,
+            )
+    else:
+        if not isinstance(data, dict) or not isinstance(data.get("texts"), list):
+            return None, json_response(
+                {"error": "Missing or invalid 'texts' field; must be a list"}, 400
+            )
+        year = data.get("year")
+        if year is not None and (not isinstance(year, int) or isinstance(year, bool)):
+            return None, json_response({"error": "Invalid 'year' field; must be an integer"}, 400)
+        items = with_year(data["texts"], year)
+
+    if len(items) > MAX_TEXTS_PER_REQUEST:
+        return None, json_response(
+            {"error": f"{len(items)} texts; at most {MAX_TEXTS_PER_REQUEST} per request"}, 413
         )
-    texts = data["texts"]
-    predictions = predict_batch(texts)
-    return jsonify(predictions)
+    return items, None
 
 
-# Run Flask app
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, threaded=True)
+async def predict_endpoint(request: Request):
+    start = time.perf_counter()
+    items, response = await parse_predict_request(request)
+    if response is None:
+        TEXTS.inc(len(items))
+        try:
+            rows = await predict_rows(items)
+        except queue.Full as e:
+            response = json_response(
+                {"error": f"Server saturated: {e}"}, 503, {"Retry-After": str(retry_after())}
+            )
+        except Exception:
+            REQUESTS.labels("500").inc()
+            raise
+        else:
+            probabilities = np.stack(rows) if rows else np.empty((0, len(LABELS)), np.float32)
+            response = predictions_response(probabilities, request.headers.get("accept"))
+    REQUESTS.labels(str(response.status_code)).inc()
+    STAGE_SECONDS.labels("request").observe(time.perf_counter() - start)
+    return response
+
+
+async def stats_endpoint(request: Request):
+    """Tokens/sec, the share of padded tokens and cache hits since start-up"""
+    return json_response({**padding_stats.snapshot(), "cache": cache.snapshot()})
+
+
+async def health_endpoint(request: Request):
+    """Liveness: the process is up and serving"""
+    return json_response({"status": "ok"})
 
-# gunicorn --workers {num_workers} --timeout 120 server:app --bind 0.0.0.0:5000"
+
+async def ready_endpoint(request: Request):
+    """Readiness: inference workers alive and room in the queue"""
+    if pool is not None and not pool.alive():
+        return json_response({"status": "inference worker died"}, 503)
+    if batcher.queue_depth >= MAX_QUEUED_TEXTS:
+        return json_response(
+            {"status": "saturated", "queue_depth": batcher.queue_depth},
+            503,
+            {"Retry-After": str(retry_after())},
+        )
+    return json_response({"status": "ready", "queue_depth": batcher.queue_depth})
+
+
+async def metrics_endpoint(request: Request):
+    """Prometheus text format"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+app = Starlette(
+    routes=[
+        Route("/predict", predict_endpoint, methods=["POST"]),
+        Route("/stats", stats_endpoint),
+        Route("/healthz", health_endpoint),
+        Route("/readyz", ready_endpoint),
+        Route("/metrics", metrics_endpoint),
+    ]
+)
+
+
+# Run the ASGI app. Batching, the cache and the worker pool live in this one
+# process: use INFERENCE_WORKERS for CPU parallelism, not uvicorn --workers.
+# uvicorn server:app --host 0.0.0.0 --port 5000
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules under test are top-level scripts in main/, imported by name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,41 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("pandas")
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "web_data.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, note TEXT, score INTEGER)")
+    conn.executemany(
+        "INSERT INTO t VALUES (?, ?, ?)",
+        [(i, f"note {i}" if i >= 25 else None, i if i % 2 else None) for i in range(40)],
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(database, "db_path", path)
+    return path
+
+
+def test_parquet_export_types_columns_null_in_the_first_chunk(db, tmp_path):
+    out = tmp_path / "t.parquet"
+    assert database.export_query("SELECT * FROM t ORDER BY id;", str(out), chunksize=10) == 40
+
+    table = pq.read_table(out)
+    note_type = table.schema.field("note").type
+    assert pa.types.is_string(note_type) or pa.types.is_large_string(note_type)
+    assert table.column("note").to_pylist() == [None] * 25 + [f"note {i}" for i in range(25, 40)]
+    assert table.column("score").to_pylist() == [i if i % 2 else None for i in range(40)]
+
+
+def test_parquet_export_keeps_all_null_columns(db, tmp_path):
+    out = tmp_path / "t.parquet"
+    database.export_query("SELECT id, NULL AS empty FROM t", str(out), chunksize=10)
+    assert pq.read_table(out).column("empty").null_count == 40
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import filing_documents
+from filing_documents import resolve_filing_documents
+
+BASE = "https://www.sec.gov/Archives/edgar/data/123/000012345621000001"
+INDEX = json.dumps(
+    {
+        "directory": {
+            "item": [
+                {"name": "primary.htm"},
+                {"name": "ex13.htm"},
+                {"name": "ex99-1.htm"},
+                {"name": "ex99-2.htm"},
+                {"name": "ex15.htm"},
+                {"name": "ex21.htm"},
+                {"name": "ex99.jpg"},
+            ]
+        }
+    }
+)
+
+
+class FakeFetch:
+    def __init__(self, body=INDEX):
+        self.body = body
+        self.requests = []
+
+    def __call__(self, url):
+        self.requests.append(url)
+        return self.body
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    filing_documents._index_cache.clear()
+
+
+@pytest.mark.parametrize(
+    "form_type, expected",
+    [
+        ("40-F", ["ex99-1.htm", "ex99-2.htm"]),
+        ("20-F", ["primary.htm", "ex15.htm", "ex99-1.htm", "ex99-2.htm"]),
+        ("10-K", ["primary.htm", "ex13.htm"]),
+        ("10KSB", ["primary.htm", "ex13.htm"]),
+    ],
+)
+def test_form_rules_pick_exhibits(form_type, expected):
+    fetch = FakeFetch()
+    documents = resolve_filing_documents(f"{BASE}/primary.htm", form_type, fetch)
+    assert documents == [f"{BASE}/{name}" for name in expected]
+    assert fetch.requests == [f"{BASE}/index.json"]
+
+
+@pytest.mark.parametrize(
+    "url, form_type",
+    [
+        (f"{BASE}/primary.htm", None),  # Stored before form types were
+        (f"{BASE}/primary.htm", "8-K"),
+        (f"{BASE}/0000123456-21-000001.txt", "40-F"),  # Complete submission
+    ],
+)
+def test_no_index_request_without_an_exhibit_rule(url, form_type):
+    fetch = FakeFetch()
+    assert resolve_filing_documents(url, form_type, fetch) == [url]
+    assert fetch.requests == []
+
+
+def test_index_is_cached_per_accession():
+    fetch = FakeFetch()
+    resolve_filing_documents(f"{BASE}/primary.htm", "10-K", fetch)
+    # A co-registrant lists the same accession under its own CIK
+    other = BASE.replace("/123/", "/456/")
+    assert resolve_filing_documents(f"{other}/primary.htm", "10-K", fetch) == [
+        f"{other}/primary.htm",
+        f"{other}/ex13.htm",
+    ]
+    assert len(fetch.requests) == 1
+
+
+@pytest.mark.parametrize("body", [None, "{not json"])
+def test_index_failure_falls_back_to_primary(body):
+    fetch = FakeFetch(body)
+    assert resolve_filing_documents(f"{BASE}/primary.htm", "40-F", fetch) == [f"{BASE}/primary.htm"]
+    # Failed fetches are retried on the next attempt; unreadable indexes are not
+    resolve_filing_documents(f"{BASE}/primary.htm", "40-F", fetch)
+    assert len(fetch.requests) == (2 if body is None else 1)
+
+
+def test_documents_are_capped(monkeypatch):
+    monkeypatch.setattr(filing_documents, "MAX_FILING_DOCUMENTS", 2)
+    documents = resolve_filing_documents(f"{BASE}/primary.htm", "20-F", FakeFetch())
+    assert documents == [f"{BASE}/primary.htm", f"{BASE}/ex15.htm"]
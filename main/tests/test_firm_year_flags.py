@@ -0,0 +1,78 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("psutil")
+pytest.importorskip("tqdm")
+
+import schema
+import sentence_store
+from custom_analyzers.analysis import Config, DataLoader, PredictionsProcessor
+from db_connection import get_manager
+from quantization import LABELS
+
+# (cik, year, url, labels above the threshold); cik 1's 2020 URLs are
+# inserted out of order, so "first encountered" and "smallest" differ
+REPORTS = [
+    (1, 2020, "https://example.com/1-2020-b", ["ir_use", "curr"]),
+    (1, 2020, "https://example.com/1-2020-a", ["fx_use"]),
+    (1, 2021, "https://example.com/1-2021", ["warr", "curr"]),
+    (2, 2020, "https://example.com/2-2020-c", []),
+    (2, 2020, "https://example.com/2-2020-a", ["eq_use", "hist"]),
+]
+
+
+@pytest.fixture
+def config(tmp_path):
+    db_path = str(tmp_path / "web_data.db")
+    with get_manager(db_path).transaction() as conn:
+        schema.migrate(conn)
+        for cik, year, url, labels in REPORTS:
+            conn.execute(
+                "INSERT INTO report_data (cik, year, url, form_type) VALUES (?, ?, ?, '10-K')",
+                (cik, year, url),
+            )
+            prediction = {label: 0.9 if label in labels else 0.1 for label in LABELS}
+            sentence_store.save_predictions(conn, url, [prediction, {"error": -1}])
+    return Config(
+        db_path=db_path,
+        output_dir=tmp_path / "analysis_output",
+        drive_path=str(tmp_path / "no-drive"),
+    )
+
+
+def test_firm_years_keep_smallest_url_regardless_of_chunking(config):
+    loader = DataLoader(config)
+    processor = PredictionsProcessor(config, label_mapper=None)
+    whole = processor.process_predictions(loader.load_model_predictions())
+    chunked = processor.process_predictions(loader.iter_model_predictions(chunksize=1))
+
+    pd.testing.assert_frame_equal(whole, chunked)
+    assert whole.set_index(["cik", "year"])["url"].to_dict() == {
+        (1, 2020): "https://example.com/1-2020-a",
+        (1, 2021): "https://example.com/1-2021",
+        (2, 2020): "https://example.com/2-2020-a",
+    }
+    assert whole.set_index(["cik", "year"]).loc[(1, 2020), "model_ir_user"] == 1
+
+
+def test_duckdb_engine_matches_pandas(config):
+    duckdb = pytest.importorskip("duckdb")
+    from custom_analyzers.duckdb_engine import FLAG_COLUMNS, DuckDBEngine
+
+    try:
+        engine = DuckDBEngine(config)
+    except duckdb.Error as e:  # The sqlite extension is downloaded on first use
+        pytest.skip(f"DuckDB sqlite extension unavailable: {e}")
+    try:
+        duck = engine.firm_year_flags()
+    finally:
+        engine.close()
+    pandas_flags = PredictionsProcessor(config, label_mapper=None).process_predictions(
+        DataLoader(config).load_model_predictions()
+    )
+
+    columns = ["cik", "year", *FLAG_COLUMNS, "url"]
+    pd.testing.assert_frame_equal(
+        duck[columns].astype({c: "int64" for c in columns if c != "url"}),
+        pandas_flags[columns].astype({c: "int64" for c in columns if c != "url"}),
+    )
@@ -0,0 +1,28 @@
+import pytest
+
+import json_codec
+
+LABELS = ["fx_use", "ir_use"]
+RESPONSE = b'{"model": "v2", "elapsed_ms": 12.5, "predictions": [{"fx_use": 0.9, "ir_use": 0.1}, {"error": -1}]}'
+
+
+@pytest.fixture(params=["orjson", "msgspec", "json"])
+def backend(request, monkeypatch):
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    if request.param != "orjson":
+        monkeypatch.setattr(json_codec, "orjson", None)
+    if request.param == "json":
+        monkeypatch.setattr(json_codec, "msgspec", None)
+    return request.param
+
+
+def test_response_keys_besides_predictions_are_ignored(backend):
+    assert json_codec.decode_predictions(RESPONSE) == [{"fx_use": 0.9, "ir_use": 0.1}, {"error": -1}]
+    rows = json_codec.decode_probabilities(RESPONSE, LABELS)
+    assert [list(row) for row in rows[:1]] == [pytest.approx([0.9, 0.1])] and rows[1] is None
+
+
+def test_bare_list_and_empty_response(backend):
+    assert json_codec.decode_predictions(b'[{"fx_use": 0.5}]') == [{"fx_use": 0.5}]
+    assert json_codec.decode_predictions('{"model": "v2"}') == []
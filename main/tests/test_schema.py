@@ -0,0 +1,178 @@
+import json
+import sqlite3
+
+import pytest
+
+import schema
+import sentence_store
+
+
+def _v1_database(path):
+    """A database as the pre-versioning scripts created it (schema v1 shapes)."""
+    conn = sqlite3.connect(path)
+    schema._v1_baseline(conn)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    return conn
+
+
+def test_malformed_blob_keeps_legacy_columns(tmp_path):
+    conn = _v1_database(tmp_path / "web_data.db")
+    conn.execute("INSERT INTO report_data VALUES (1, 2004, 'good', '10-K')")
+    conn.execute("INSERT INTO report_data VALUES (2, 2004, 'bad', '10-K')")
+    conn.execute(
+        "INSERT INTO webpage_result VALUES ('good', ?)", (json.dumps({"gen": ["p1", "p2"]}),)
+    )
+    conn.execute("INSERT INTO webpage_result VALUES ('bad', '{not json')")
+    conn.commit()
+
+    assert schema.migrate(conn) == schema.LATEST_VERSION
+    assert conn.execute("SELECT url, idx FROM sentences ORDER BY idx").fetchall() == [
+        ("good", 0),
+        ("good", 1),
+    ]
+    assert "matches" in schema._columns(conn, "webpage_result")
+
+    with pytest.raises(ValueError, match="1 reports could not be backfilled"):
+        schema.drop_legacy_blobs(conn)
+    assert "matches" in schema._columns(conn, "webpage_result")
+    assert "server_response" in schema._columns(conn, "server_result")
+    assert conn.execute("SELECT matches FROM webpage_result WHERE url = 'bad'").fetchone() == (
+        "{not json",
+    )
+
+    conn.execute("DELETE FROM webpage_result WHERE url = 'bad'")
+    conn.commit()
+    schema.drop_legacy_blobs(conn)
+    assert schema._columns(conn, "webpage_result") == {"url"}
+    assert schema._columns(conn, "server_result") == {"url"}
+    assert conn.execute("SELECT COUNT(*) FROM sentences").fetchone() == (2,)
+    conn.close()
+
+
+def test_failed_predictions_get_an_explicit_marker(tmp_path):
+    conn = _v1_database(tmp_path / "web_data.db")
+    schema.migrate(conn)
+    # A v5 predictions table: failures were only all-NULL rows
+    conn.execute("ALTER TABLE predictions DROP COLUMN failed")
+    conn.execute("INSERT INTO predictions (url, idx, p_ir) VALUES ('a', 0, 900)")
+    conn.execute("INSERT INTO predictions (url, idx) VALUES ('a', 1)")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+
+    assert schema.migrate(conn) == schema.LATEST_VERSION
+    assert conn.execute("SELECT idx, failed FROM predictions ORDER BY idx").fetchall() == [(0, 0), (1, 1)]
+
+    sentence_store.save_predictions(conn, "b", [{"ir": 0.25}, {"error": -1}])
+    rows = conn.execute("SELECT idx, failed, p_ir FROM predictions WHERE url = 'b' ORDER BY idx").fetchall()
+    assert rows == [(0, 0, 250), (1, 1, None)]
+    assert sentence_store.prediction_from_row([None] * 16, failed=1) == {"error": -1}
+
+
+# DDL of the last unversioned release (fadc14c), one block per script
+COLAB_BASELINE = """
+    CREATE TABLE IF NOT EXISTS report_data (cik INTEGER, year INTEGER, url TEXT);
+    CREATE TABLE IF NOT EXISTS names (cik INTEGER, name TEXT);
+    CREATE TABLE IF NOT EXISTS webpage_result (
+        url TEXT, matches TEXT, FOREIGN KEY (url) REFERENCES report_data(url)
+    );
+    CREATE TABLE IF NOT EXISTS fail_results (cik INTEGER, year INTEGER, url TEXT, reason TEXT);
+    CREATE INDEX IF NOT EXISTS url_idx ON report_data (url);
+    CREATE INDEX IF NOT EXISTS url_idx ON webpage_result (url);
+    CREATE INDEX IF NOT EXISTS name_idx ON names (name);
+"""
+CLASSIFY_BASELINE = """
+    CREATE TABLE IF NOT EXISTS server_result (
+        url TEXT PRIMARY KEY, server_response TEXT, FOREIGN KEY (url) REFERENCES report_data (url)
+    );
+    CREATE TABLE IF NOT EXISTS fail_results (cik INTEGER, year INTEGER, url TEXT PRIMARY KEY);
+    CREATE INDEX IF NOT EXISTS url_idx ON server_result (url);
+"""
+
+
+def _indexes(conn):
+    return dict(
+        conn.execute(
+            "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ).fetchall()
+    )
+
+
+def _count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+@pytest.mark.parametrize("first", ["colab", "classify"])
+def test_unversioned_database_upgrades_to_latest(tmp_path, first):
+    conn = sqlite3.connect(tmp_path / "web_data.db")
+    scripts = [COLAB_BASELINE, CLASSIFY_BASELINE]
+    for ddl in scripts if first == "colab" else scripts[::-1]:
+        conn.executescript(ddl)
+    # url_idx landed on whichever table the first script indexed
+    assert _indexes(conn)["url_idx"] == ("report_data" if first == "colab" else "server_result")
+
+    conn.executemany(
+        "INSERT INTO report_data VALUES (?, ?, ?)",
+        [(1, 2004, "a"), (1, 2004, "a"), (2, 2005, "b"), (3, 2006, "c")],  # "a" duplicated
+    )
+    conn.executemany("INSERT INTO names VALUES (?, ?)", [(1, "Acme"), (2, "Beta")])
+    conn.executemany(
+        "INSERT INTO webpage_result VALUES (?, ?)",
+        [
+            ("a", json.dumps({"gen": ["stale"]})),
+            ("a", json.dumps({"gen": ["p1", "p2"]})),  # INSERT OR REPLACE appended a duplicate
+            ("b", json.dumps({"ir": ["p3"]})),
+        ],
+    )
+    conn.execute(
+        "INSERT INTO server_result VALUES ('a', ?)",
+        (json.dumps([{"ir": 0.25}, {"error": -1}]),),
+    )
+    conn.execute("INSERT INTO fail_results (cik, year, url) VALUES (3, 2006, 'c')")
+    conn.commit()
+    assert schema.current_version(conn) == 0
+
+    assert schema.migrate(conn) == schema.LATEST_VERSION
+    counts = {
+        table: _count(conn, table)
+        for table in (
+            "report_data",
+            "names",
+            "webpage_result",
+            "server_result",
+            "fail_results",
+            "sentences",
+            "predictions",
+            "crawl_queue",
+        )
+    }
+    assert counts == {
+        "report_data": 3,
+        "names": 2,
+        "webpage_result": 2,
+        "server_result": 1,
+        "fail_results": 1,
+        "sentences": 3,
+        "predictions": 2,
+        "crawl_queue": 2,
+    }
+    assert sentence_store.get_sentence_texts(conn, "a") == ["p1", "p2"]
+    assert conn.execute("SELECT idx, failed, p_ir FROM predictions ORDER BY idx").fetchall() == [
+        (0, 0, 250),
+        (1, 1, None),
+    ]
+    assert {"form_type"} <= schema._columns(conn, "report_data")
+    assert {"reason"} <= schema._columns(conn, "fail_results")
+
+    assert _indexes(conn) == {
+        "name_idx": "names",
+        "report_data_url_cik_year_idx": "report_data",
+        "report_data_cik_year_idx": "report_data",
+        "sentences_category_idx": "sentences",
+        "crawl_queue_status_idx": "crawl_queue",
+    }
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    # Migrating again is a no-op
+    assert schema.migrate(conn) == schema.LATEST_VERSION
+    assert _count(conn, "report_data") == 3
+    conn.close()
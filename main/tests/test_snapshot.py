@@ -0,0 +1,128 @@
+import json
+import sqlite3
+
+import pytest
+
+import snapshot
+from snapshot import DatabaseSnapshotter
+
+
+def _insert(db_path, start, count):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS webpage_result (url TEXT PRIMARY KEY, matches TEXT)")
+    conn.executemany(
+        "INSERT INTO webpage_result VALUES (?, ?)",
+        [(f"https://example.com/{i}", json.dumps({"gen": ["x" * 200]})) for i in range(start, start + count)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT url, matches FROM webpage_result ORDER BY url").fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def snapshotter(tmp_path):
+    return DatabaseSnapshotter(str(tmp_path / "web_data.db"), str(tmp_path / "snapshots"))
+
+
+def test_checkpoint_mutate_checkpoint_restore(snapshotter, tmp_path):
+    _insert(snapshotter.db_path, 0, 500)
+    first = snapshotter.checkpoint()
+    assert first["segment"] == "000001.seg"
+
+    _insert(snapshotter.db_path, 500, 50)
+    conn = sqlite3.connect(snapshotter.db_path)
+    conn.execute("UPDATE webpage_result SET matches = '[]' WHERE url = 'https://example.com/7'")
+    conn.commit()
+    conn.close()
+    second = snapshotter.checkpoint()
+    assert second["segment"] == "000002.seg"
+    assert 0 < second["changed_pages"] < first["changed_pages"]
+
+    restored = snapshotter.restore(str(tmp_path / "restored.db"))
+    assert _rows(restored) == _rows(snapshotter.db_path)
+    assert restored.read_bytes() == snapshotter.db_path.read_bytes()
+
+
+def test_unchanged_database_writes_no_segment(snapshotter):
+    _insert(snapshotter.db_path, 0, 100)
+    snapshotter.checkpoint()
+    assert snapshotter.checkpoint() == {"changed_pages": 0, "bytes": 0, "segment": None}
+
+
+def test_compaction_rewrites_base_and_drops_old_segments(snapshotter, tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "COMPACT_RATIO", 0.5)
+    _insert(snapshotter.db_path, 0, 500)
+    snapshotter.checkpoint()
+    _insert(snapshotter.db_path, 500, 10)
+    snapshotter.checkpoint()  # Segments now exceed 0.5x the database: next one rebases
+
+    _insert(snapshotter.db_path, 510, 10)
+    stats = snapshotter.checkpoint()
+    manifest = snapshotter.load_manifest()
+    assert [s["name"] for s in manifest["segments"]] == [stats["segment"]] == ["000003.seg"]
+    assert stats["changed_pages"] == manifest["page_count"]
+    assert sorted(p.name for p in snapshotter.snapshot_dir.glob("*.seg")) == ["000003.seg"]
+
+    restored = snapshotter.restore(str(tmp_path / "restored.db"))
+    assert _rows(restored) == _rows(snapshotter.db_path)
+
+
+def test_restore_ignores_segment_not_yet_in_manifest(snapshotter, tmp_path):
+    _insert(snapshotter.db_path, 0, 200)
+    snapshotter.checkpoint()
+    expected = _rows(snapshotter.db_path)
+    manifest = snapshotter.manifest_path.read_text()
+
+    # Upload interrupted after the segment, before the manifest
+    _insert(snapshotter.db_path, 200, 200)
+    snapshotter.checkpoint()
+    snapshotter.manifest_path.write_text(manifest)
+
+    restored = snapshotter.restore(str(tmp_path / "restored.db"))
+    assert _rows(restored) == expected
+
+
+@pytest.mark.parametrize("damage", ["truncate", "delete"])
+def test_restore_from_partially_uploaded_segment_keeps_target(snapshotter, tmp_path, damage):
+    _insert(snapshotter.db_path, 0, 200)
+    snapshotter.checkpoint()
+    _insert(snapshotter.db_path, 200, 200)
+    segment = snapshotter.snapshot_dir / snapshotter.checkpoint()["segment"]
+    if damage == "truncate":
+        segment.write_bytes(segment.read_bytes()[: segment.stat().st_size // 2])
+    else:
+        segment.unlink()
+
+    target = tmp_path / "restored.db"
+    target.write_bytes(b"previous database")
+    with pytest.raises((ValueError, FileNotFoundError)):
+        snapshotter.restore(str(target))
+    assert target.read_bytes() == b"previous database"
+    assert not (tmp_path / "restored.db.restore-tmp").exists()
+
+
+def test_busy_database_skips_the_checkpoint(snapshotter, monkeypatch):
+    _insert(snapshotter.db_path, 0, 100)
+    writer = sqlite3.connect(snapshotter.db_path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")  # Holds the write lock throughout
+    connect = sqlite3.connect
+    monkeypatch.setattr(
+        snapshot.sqlite3, "connect", lambda path, **kwargs: connect(path, **{**kwargs, "timeout": 0.1})
+    )
+    try:
+        with pytest.raises(snapshot.DatabaseBusyError):
+            snapshotter.checkpoint()
+        assert snapshot.save_snapshot(str(snapshotter.db_path), str(snapshotter.snapshot_dir)) is None
+        assert snapshotter.load_manifest() is None
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+    monkeypatch.undo()
+    assert snapshot.save_snapshot(str(snapshotter.db_path), str(snapshotter.snapshot_dir))["segment"]
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+pytest.importorskip("zstandard")
+
+import schema
+import sentence_store
+import text_compression
+from db_connection import get_manager
+
+WORDS = "derivative swap hedge notional fair value interest rate currency forward contract".split()
+
+
+def _paragraph(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(60))
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_compression, "BOOTSTRAP_PARAGRAPHS", 300)
+    monkeypatch.setattr(text_compression, "BOOTSTRAP_CHECK_EVERY", 100)
+    monkeypatch.setattr(text_compression, "DICT_SIZE", 4096)
+    conn = get_manager(str(tmp_path / "web_data.db")).connection()
+    schema.migrate(conn)
+    return conn
+
+
+def _save(conn, rng, url):
+    with conn:
+        sentence_store.save_sentences(conn, url, {"gen": [_paragraph(rng) for _ in range(50)]})
+    return text_compression.maybe_bootstrap(conn)
+
+
+def test_first_dictionary_is_trained_on_the_write_path(conn):
+    rng = random.Random(0)
+    trained = [_save(conn, rng, f"https://example.com/{i}") for i in range(8)]
+    # 300 paragraphs are stored after the 6th report, checked every 100 writes
+    assert trained[:5] == [None] * 5
+    assert trained[5] is not None and trained[6:] == [trained[5]] * 2
+
+    types = dict(
+        conn.execute(
+            "SELECT url, group_concat(DISTINCT typeof(text)) FROM sentences GROUP BY url"
+        ).fetchall()
+    )
+    assert types["https://example.com/0"] == "text"
+    assert types["https://example.com/7"] == "blob"
+    for url in ("https://example.com/0", "https://example.com/7"):
+        assert all(len(text.split()) == 60 for text in sentence_store.get_sentence_texts(conn, url))
+
+
+def test_existing_dictionary_is_adopted_instead_of_retrained(conn):
+    rng = random.Random(1)
+    for i in range(6):
+        _save(conn, rng, f"https://example.com/{i}")
+    (dictionaries,) = conn.execute("SELECT COUNT(*) FROM text_dictionary").fetchone()
+
+    # A second process: fresh codec, the first process's dictionary in the table
+    text_compression._codecs.clear()
+    codec = text_compression.get_codec(conn)
+    codec.dict_id = None
+    codec.plain_writes = text_compression.BOOTSTRAP_CHECK_EVERY
+    assert text_compression.maybe_bootstrap(conn) is not None
+    assert conn.execute("SELECT COUNT(*) FROM text_dictionary").fetchone() == (dictionaries,)
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+import schema
+import work_queue
+from work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "web_data.db")
+
+
+def _row(db_path, url):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT status, attempts, lease_owner, next_attempt_at FROM crawl_queue WHERE url = ?",
+            (url,),
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def test_queue_is_created_by_migration_and_seeded_from_results(db_path):
+    conn = sqlite3.connect(db_path)
+    schema._v1_baseline(conn)
+    conn.execute("INSERT INTO webpage_result (url) VALUES ('https://example.com/parsed')")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    queue = WorkQueue(db_path, "w1")
+    assert queue.enqueue([("https://example.com/parsed", "10-K"), ("https://example.com/new", "10-K")]) == 1
+    assert queue.status_counts() == {PENDING: 1, LEASED: 0, DONE: 1, FAILED: 0}
+    assert queue.lease(10) == [("https://example.com/new", "10-K")]
+
+
+def test_workers_lease_disjoint_batches(db_path):
+    first, second = WorkQueue(db_path, "w1"), WorkQueue(db_path, "w2")
+    first.enqueue((f"https://example.com/{i}", None) for i in range(10))
+
+    a, b = first.lease(6), second.lease(6)
+    assert len(a) == 6 and len(b) == 4
+    assert not {url for url, _ in a} & {url for url, _ in b}
+    assert second.lease(6) == []
+
+
+def test_outcomes_only_apply_to_the_lease_holder(db_path):
+    owner, other = WorkQueue(db_path, "w1"), WorkQueue(db_path, "w2")
+    owner.enqueue([("https://example.com/a", None), ("https://example.com/b", None)])
+    owner.lease(2)
+
+    other.complete(["https://example.com/a"])
+    other.fail([("https://example.com/b", "boom")])
+    other.release(["https://example.com/a"])
+    assert _row(db_path, "https://example.com/a")[:3] == (LEASED, 0, "w1")
+    assert _row(db_path, "https://example.com/b")[:3] == (LEASED, 0, "w1")
+
+    owner.complete(["https://example.com/a"])
+    assert _row(db_path, "https://example.com/a")[:3] == (DONE, 0, None)
+
+
+def test_failures_back_off_then_park(db_path, monkeypatch):
+    queue = WorkQueue(db_path, "w1")
+    queue.enqueue([("https://example.com/a", None)])
+    delays = []
+    for attempt in range(1, work_queue.MAX_ATTEMPTS + 1):
+        # Make the backed-off URL due again
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE crawl_queue SET next_attempt_at = 0")
+        conn.commit()
+        conn.close()
+
+        assert queue.lease(1) == [("https://example.com/a", None)]
+        monkeypatch.setattr(work_queue.time, "time", lambda: 1000.0)
+        queue.fail([("https://example.com/a", "Fetch failed")])
+        monkeypatch.undo()
+        status, attempts, owner, next_attempt_at = _row(db_path, "https://example.com/a")
+        assert attempts == attempt and owner is None
+        assert status == (FAILED if attempt == work_queue.MAX_ATTEMPTS else PENDING)
+        delays.append(next_attempt_at - 1000.0)
+
+    assert delays == [work_queue.RETRY_BASE_SECONDS * 2**i for i in range(work_queue.MAX_ATTEMPTS)]
+    assert queue.lease(1) == []
+    assert queue.retry_failed() == 1
+    assert queue.lease(1) == [("https://example.com/a", None)]
+
+
+def test_release_does_not_use_an_attempt(db_path):
+    queue = WorkQueue(db_path, "w1")
+    queue.enqueue([("https://example.com/a", None)])
+    for _ in range(work_queue.MAX_ATTEMPTS + 1):
+        assert queue.lease(1) == [("https://example.com/a", None)]
+        queue.release(["https://example.com/a"])
+    assert _row(db_path, "https://example.com/a")[:3] == (PENDING, 0, None)
+
+
+def test_restart_reclaims_expired_leases(db_path):
+    crashed = WorkQueue(db_path, "host-111")
+    crashed.enqueue((f"https://example.com/{i}", None) for i in range(3))
+    crashed.lease(2, lease_seconds=-1)  # Lease already expired: the worker died
+    crashed.lease(1)  # Still held by a live worker
+
+    restarted = WorkQueue(db_path, "host-222")
+    reclaimed = restarted.lease(10)
+    assert sorted(url for url, _ in reclaimed) == ["https://example.com/0", "https://example.com/1"]
+
+    # The crashed worker's late outcome no longer applies
+    crashed.complete(["https://example.com/0"])
+    assert _row(db_path, "https://example.com/0")[:3] == (LEASED, 0, "host-222")
@@ -0,0 +1,274 @@
+# =============================================================================
+# Dictionary-compressed text storage (web_data.db)
+# =============================================================================
+# Paragraphs repeat the same hedge-policy boilerplate across firms and years,
+# which plain per-value compression can't exploit: each paragraph is too short
+# to contain its own repeats. A zstd dictionary trained on a sample of stored
+# paragraphs supplies that shared context, so sentences.text is stored as
+# zstd frames compressed against it.
+#
+# Frames carry the ID of their dictionary, and every dictionary ever trained
+# stays in `text_dictionary`, so old rows remain readable after retraining.
+# Values written before compression (or without zstandard installed) are plain
+# TEXT and read back unchanged. Once this module is imported, connections from
+# db_connection get the SQL function unzstd() (an open hook), so queries can
+# select `unzstd(s.text)` directly.
+#
+# Writers call maybe_bootstrap after they commit: once BOOTSTRAP_PARAGRAPHS
+# paragraphs are stored, the first dictionary is trained on them and later
+# writes are compressed. Rows written before that stay plain until
+# `python text_compression.py [web_data.db]` trains a fresh dictionary on the
+# whole table, recompresses existing rows and VACUUMs the file.
+import os
+import sqlite3
+import sys
+import threading
+from typing import Dict, Optional, Union
+
+from db_connection import add_open_hook, get_manager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LEVEL = 3  # Live writes (crawler, classifier): fast, the dictionary does most of the work
+RECOMPRESS_LEVEL = 19  # Offline compress_database: paragraphs are read many times
+DICT_SIZE = 112 * 1024
+TRAINING_SAMPLES = 50_000
+# Columns holding compressed text, as (table, column)
+COMPRESSED_COLUMNS = [("sentences", "text")]
+RECOMPRESS_BATCH_SIZE = 2000
+BOOTSTRAP_PARAGRAPHS = 20_000  # Stored paragraphs needed to train the first dictionary
+BOOTSTRAP_CHECK_EVERY = 1000  # Plain paragraphs written (per process) between checks
+
+
+def create_tables(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS text_dictionary (
+            dict_id INTEGER PRIMARY KEY,
+            data BLOB NOT NULL
+        )
+    """
+    )
+
+
+class TextCodec:
+    """
+    Compresses with the newest dictionary in `text_dictionary` and
+    decompresses with whichever dictionary a frame names. Without a trained
+    dictionary (or without zstandard) text is stored as-is.
+
+    zstandard (de)compressor objects are not thread-safe, so each thread
+    builds its own from the shared dictionaries.
+    """
+
+    def __init__(self, db_file: str, conn: Optional[sqlite3.Connection] = None):
+        self.db_file = db_file
+        self._dictionaries: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._local = threading.local()
+        self.dict_id: Optional[int] = None
+        self.plain_writes = 0  # Paragraphs stored uncompressed, for maybe_bootstrap
+        self.reload(conn)
+
+    def reload(self, conn: Optional[sqlite3.Connection] = None):
+        """
+        Re-reads the dictionaries, e.g. after another process trained one,
+        through `conn` or this thread's shared connection to the database.
+        """
+        if zstandard is None:
+            return
+        if conn is None:
+            conn = get_manager(self.db_file).connection()
+        try:
+            rows = conn.execute(
+                "SELECT dict_id, data FROM text_dictionary ORDER BY rowid"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []  # Schema not migrated yet
+        for dict_id, data in rows:
+            self._dictionaries.setdefault(dict_id, zstandard.ZstdCompressionDict(data))
+        if rows:
+            self.dict_id = rows[-1][0]
+
+    def compress(self, text: str, level: int = LEVEL) -> Union[bytes, str]:
+        if self.dict_id is None:
+            self.plain_writes += 1
+            return text
+        compressors = getattr(self._local, "compressors", None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+        compressor = compressors.get((self.dict_id, level))
+        if compressor is None:
+            compressor = compressors[(self.dict_id, level)] = zstandard.ZstdCompressor(
+                level=level, dict_data=self._dictionaries[self.dict_id]
+            )
+        return compressor.compress(text.encode("utf-8"))
+
+    def _decompressor(self, dict_id: int) -> "zstandard.ZstdDecompressor":
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        if dict_id not in decompressors:
+            if dict_id and dict_id not in self._dictionaries:
+                self.reload()
+            if dict_id and dict_id not in self._dictionaries:
+                raise ValueError(f"Unknown text dictionary {dict_id}")
+            decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self._dictionaries.get(dict_id)
+            )
+        return decompressors[dict_id]
+
+    def decompress(self, value: Union[bytes, str, None]) -> Optional[str]:
+        if not isinstance(value, (bytes, memoryview)):
+            return value  # Uncompressed TEXT (or NULL)
+        value = bytes(value)
+        if not value.startswith(ZSTD_MAGIC):
+            return value.decode("utf-8")
+        if zstandard is None:
+            raise ImportError("zstandard is required to read compressed text")
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        return self._decompressor(dict_id).decompress(value).decode("utf-8")
+
+
+_codecs: Dict[str, TextCodec] = {}
+
+
+def get_codec(conn: sqlite3.Connection) -> TextCodec:
+    """The process-wide codec for the (file) database `conn` is attached to."""
+    # Rows of PRAGMA database_list are (seq, name, file); main comes first
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if db_file not in _codecs:
+        _codecs[db_file] = TextCodec(db_file, conn)
+    return _codecs[db_file]
+
+
+def decompress_frame(df, codec: TextCodec):
+    """`df` with every zstd frame in it decompressed; other values (including
+    non-text BLOBs such as packed predictions) are left alone."""
+    for column in df.columns:
+        if df[column].dtype == object:
+            values = df[column]
+            is_frame = values.map(lambda v: isinstance(v, bytes) and v.startswith(ZSTD_MAGIC))
+            if is_frame.any():
+                df[column] = values.where(~is_frame, values[is_frame].map(codec.decompress))
+    return df
+
+
+def register(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Adds unzstd(value) to `conn`, decompressing with this database's codec."""
+    codec = get_codec(conn)
+    conn.create_function("unzstd", 1, codec.decompress, deterministic=True)
+    return conn
+
+
+add_open_hook(register)
+
+
+# =============================================================================
+# TRAINING AND RECOMPRESSION
+# =============================================================================
+
+
+def train(conn: sqlite3.Connection, samples: int = TRAINING_SAMPLES) -> int:
+    """Trains a dictionary on a random sample of paragraphs and makes it current."""
+    if zstandard is None:
+        raise ImportError("zstandard is required to train a text dictionary")
+    codec = get_codec(conn)
+    rows = conn.execute(
+        "SELECT text FROM sentences ORDER BY RANDOM() LIMIT ?", (samples,)
+    ).fetchall()
+    if not rows:
+        raise ValueError("No paragraphs in `sentences` to train on")
+    texts = [codec.decompress(text).encode("utf-8") for (text,) in rows]
+    dictionary = zstandard.train_dictionary(DICT_SIZE, texts, level=RECOMPRESS_LEVEL)
+    create_tables(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO text_dictionary (dict_id, data) VALUES (?, ?)",
+        (dictionary.dict_id(), dictionary.as_bytes()),
+    )
+    conn.commit()
+    codec.reload(conn)
+    return codec.dict_id
+
+
+_bootstrap_lock = threading.Lock()
+
+
+def maybe_bootstrap(conn: sqlite3.Connection) -> Optional[int]:
+    """
+    Trains the first dictionary once BOOTSTRAP_PARAGRAPHS paragraphs are
+    stored, so a crawl starts compressing without the offline step. Cheap
+    to call after every commit: it only looks at the table every
+    BOOTSTRAP_CHECK_EVERY plain writes, and never once a dictionary exists.
+    Returns the id of the dictionary it trained or found, else None.
+    """
+    codec = get_codec(conn)
+    if zstandard is None or codec.dict_id is not None:
+        return codec.dict_id
+    if codec.plain_writes < BOOTSTRAP_CHECK_EVERY or not _bootstrap_lock.acquire(blocking=False):
+        return None
+    try:
+        codec.plain_writes = 0
+        codec.reload(conn)  # Another process may have trained one already
+        if codec.dict_id is not None:
+            return codec.dict_id
+        (stored,) = conn.execute("SELECT COUNT(*) FROM sentences").fetchone()
+        if stored < BOOTSTRAP_PARAGRAPHS:
+            return None
+        dict_id = train(conn)
+        print(f"🗜️  Trained text dictionary {dict_id} on {stored:,} stored paragraphs")
+        return dict_id
+    finally:
+        _bootstrap_lock.release()
+
+
+def _recompress(conn: sqlite3.Connection, table: str, column: str, codec: TextCodec) -> int:
+    rewritten = 0
+    last_rowid = 0
+    while True:
+        # Keyset batches: the table is rewritten while it is being read
+        rows = conn.execute(
+            f"SELECT rowid, {column} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, RECOMPRESS_BATCH_SIZE),
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        conn.executemany(
+            f"UPDATE {table} SET {column} = ? WHERE rowid = ?",
+            [
+                (codec.compress(codec.decompress(value), RECOMPRESS_LEVEL), rowid)
+                for rowid, value in rows
+                if value is not None
+            ],
+        )
+        conn.commit()
+        rewritten += len(rows)
+        print(f"  ... {rewritten:,} {table} rows compressed")
+    return rewritten
+
+
+def compress_database(db_path: str = "web_data.db", samples: int = TRAINING_SAMPLES):
+    """Trains a fresh dictionary, recompresses all stored text and VACUUMs."""
+    size_before = os.path.getsize(db_path)
+    conn = get_manager(db_path).connection()
+    dict_id = train(conn, samples)
+    print(f"Trained text dictionary {dict_id}")
+    codec = get_codec(conn)
+    for table, column in COMPRESSED_COLUMNS:
+        _recompress(conn, table, column, codec)
+    print("Reclaiming space (VACUUM)...")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # So the file size reflects the VACUUM
+    size_after = os.path.getsize(db_path)
+    print(
+        f"✅ {db_path}: {size_before / 1024**2:,.1f} MB -> {size_after / 1024**2:,.1f} MB "
+        f"({size_before / max(size_after, 1):.1f}x smaller)"
+    )
+
+
+if __name__ == "__main__":
+    compress_database(sys.argv[1] if len(sys.argv) > 1 else "web_data.db")
@@ -2,6 +2,8 @@ from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
 import os
 
+from snapshot import DatabaseSnapshotter
+
 # --- AUTHENTICATION ---
 gauth = GoogleAuth()
 gauth.CommandLineAuth()
@@ -11,16 +13,18 @@ drive = GoogleDrive(gauth)
 # --- FOLDER LOGIC ---
 folder_name = 'db'
 file_to_upload = 'web_data.db'
+# Local mirror of the Drive snapshot folder: only new segments get uploaded
+snapshot_dir = 'snapshots'
 
 # 1. Check if the local file exists
 print(f"Looking for local file: {file_to_upload}")
 if not os.path.exists(file_to_upload):
     print(f"Error: File not found at '{file_to_upload}'")
-    print("Please make sure 'example.txt' is in the same directory.")
+    print(f"Please make sure '{file_to_upload}' is in the same directory.")
 else:
     # 2. Find the folder ID for 'db'
     print(f"Searching for folder '{folder_name}' in your Google Drive...")
-    
+
     # Query for the folder
     # 'root' is the alias for "My Drive"
     file_list = drive.ListFile({
@@ -45,19 +49,50 @@ else:
         folder_id = folder['id']
         print(f"Created folder '{folder_name}' with ID: {folder_id}")
 
-    # 3. Upload the file into that folder
-    print(f"Uploading '{file_to_upload}' to folder '{folder_name}'...")
-    
-    # Set metadata, including the parent folder
-    gfile = drive.CreateFile({
-        'title': os.path.basename(file_to_upload),
-        'parents': [{'id': folder_id}]  # This is the key change
-    })
-    
-    # Set the content of the file
-    gfile.SetContentFile(file_to_upload)
-    
-    # Upload the file
+    # 3. Find (or create) the 'snapshots' subfolder the Colab scripts restore from
+    file_list = drive.ListFile({
+        'q': f"title='{snapshot_dir}' and mimeType='application/vnd.google-apps.folder' and '{folder_id}' in parents and trashed=false"
+    }).GetList()
+    if len(file_list) > 0:
+        snapshot_folder_id = file_list[0]['id']
+    else:
+        snapshot_folder = drive.CreateFile({
+            'title': snapshot_dir,
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [{'id': folder_id}]
+        })
+        snapshot_folder.Upload()
+        snapshot_folder_id = snapshot_folder['id']
+
+    # 4. Checkpoint locally: only pages changed since the last upload go into a new segment
+    snapshotter = DatabaseSnapshotter(file_to_upload, snapshot_dir)
+    stats = snapshotter.checkpoint()
+    manifest = snapshotter.load_manifest()
+    print(f"Checkpoint: {stats['changed_pages']:,} changed pages ({stats['bytes'] / 1024**2:.1f} MB)")
+
+    remote_files = {
+        f['title']: f
+        for f in drive.ListFile({'q': f"'{snapshot_folder_id}' in parents and trashed=false"}).GetList()
+    }
+    live_segments = {segment['name'] for segment in manifest['segments']}
+
+    # 5. Upload segments Drive doesn't have yet, then the manifest that references them
+    for name in sorted(live_segments - set(remote_files)):
+        print(f"Uploading segment '{name}'...")
+        gfile = drive.CreateFile({'title': name, 'parents': [{'id': snapshot_folder_id}]})
+        gfile.SetContentFile(os.path.join(snapshot_dir, name))
+        gfile.Upload()
+
+    gfile = remote_files.get('manifest.json') or drive.CreateFile(
+        {'title': 'manifest.json', 'parents': [{'id': snapshot_folder_id}]}
+    )
+    gfile.SetContentFile(os.path.join(snapshot_dir, 'manifest.json'))
     gfile.Upload()
-    print(f"Success! File ID: {gfile['id']}")
-    print(f"File was uploaded to the '{folder_name}' folder.")
+
+    # 6. Drop segments superseded by a compaction
+    for name, gfile in remote_files.items():
+        if name.endswith('.seg') and name not in live_segments:
+            print(f"Removing stale segment '{name}'...")
+            gfile.Delete()
+
+    print(f"Success! Snapshot {manifest['digest'][:12]} uploaded to '{folder_name}/{snapshot_dir}'.")
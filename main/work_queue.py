@@ -0,0 +1,145 @@
+# =============================================================================
+# Durable crawl work queue (stored in web_data.db)
+# =============================================================================
+import os
+import socket
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import schema
+from db_connection import get_manager
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+LEASE_SECONDS = 3600  # A crashed worker's chunk becomes claimable again after this
+MAX_ATTEMPTS = 5  # After this many failures a URL is parked as FAILED
+RETRY_BASE_SECONDS = 60  # Backoff: 1m, 2m, 4m, ... capped at RETRY_MAX_SECONDS
+RETRY_MAX_SECONDS = 24 * 3600
+
+
+def default_worker_id() -> str:
+    """Identifies this crawler process across machines sharing the queue."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    A `crawl_queue` table with per-URL status, attempt count, last error and
+    lease timestamps. Workers lease disjoint batches inside an IMMEDIATE
+    transaction, so several processes can pull from the same database and a
+    restart resumes from the table instead of rescanning webpage_result.
+    """
+
+    def __init__(self, db_path: str, worker_id: Optional[str] = None):
+        self.db_path = db_path
+        self.worker_id = worker_id or default_worker_id()
+        # Per-thread shared connections (db_connection); each method is one transaction
+        self.db = get_manager(db_path)
+        schema.migrate(self.db.connection())  # crawl_queue is created by migration v5
+
+    def enqueue(self, reports: Iterable[Tuple[str, Optional[str]]]) -> int:
+        """Adds (url, form_type) pairs; URLs already queued keep their state."""
+        rows = [(url, form_type) for url, form_type in reports if url]
+        with self.db.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO crawl_queue (url, form_type) VALUES (?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def lease(
+        self, limit: int, lease_seconds: int = LEASE_SECONDS
+    ) -> List[Tuple[str, Optional[str]]]:
+        """
+        Claims up to `limit` due URLs for this worker: pending rows whose
+        backoff has elapsed, plus leases abandoned by crashed workers.
+        """
+        now = time.time()
+        with self.db.transaction(immediate=True) as conn:
+            rows = conn.execute(
+                """
+                SELECT url, form_type FROM crawl_queue
+                WHERE (status = ? AND next_attempt_at <= ?)
+                   OR (status = ? AND lease_expires < ?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            """,
+                (PENDING, now, LEASED, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE crawl_queue SET status = ?, lease_owner = ?, lease_expires = ?, "
+                "updated_at = ? WHERE url = ?",
+                [(LEASED, self.worker_id, now + lease_seconds, now, url) for url, _ in rows],
+            )
+            return rows
+
+    # complete/fail/release only touch rows this worker still holds: once a
+    # lease expires and another worker re-leases the URL, the late outcome
+    # from the original worker is ignored instead of clobbering the new lease.
+
+    def complete(self, urls: Iterable[str]):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE crawl_queue SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "last_error = NULL, updated_at = ? WHERE url = ? AND lease_owner = ?",
+                [(DONE, now, url, self.worker_id) for url in urls],
+            )
+
+    def fail(self, failures: Iterable[Tuple[str, str]], max_attempts: int = MAX_ATTEMPTS):
+        """
+        Records (url, error) failures. URLs go back to PENDING with exponential
+        backoff until they reach `max_attempts`, then stay FAILED.
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            for url, error in failures:
+                row = conn.execute(
+                    "SELECT attempts FROM crawl_queue WHERE url = ? AND lease_owner = ?",
+                    (url, self.worker_id),
+                ).fetchone()
+                if row is None:
+                    continue  # Lease lost to another worker
+                attempts = row[0] + 1
+                delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                status = FAILED if attempts >= max_attempts else PENDING
+                conn.execute(
+                    "UPDATE crawl_queue SET status = ?, attempts = ?, last_error = ?, "
+                    "lease_owner = NULL, lease_expires = NULL, next_attempt_at = ?, "
+                    "updated_at = ? WHERE url = ? AND lease_owner = ?",
+                    (status, attempts, str(error)[:500], now + delay, now, url, self.worker_id),
+                )
+
+    def release(self, urls: Iterable[str], delay: float = 0):
+        """
+        Hands leased URLs back as PENDING without using up an attempt, e.g.
+        when SEC rate-limited the fetch: the URL itself is fine, so it should
+        not drift towards FAILED. `delay` postpones the next lease.
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE crawl_queue SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "next_attempt_at = ?, updated_at = ? WHERE url = ? AND lease_owner = ?",
+                [(PENDING, now + delay, now, url, self.worker_id) for url in urls],
+            )
+
+    def retry_failed(self) -> int:
+        """Moves FAILED URLs back to PENDING with a fresh attempt budget."""
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE crawl_queue SET status = ?, attempts = 0, next_attempt_at = 0 "
+                "WHERE status = ?",
+                (PENDING, FAILED),
+            )
+            return cursor.rowcount
+
+    def status_counts(self) -> Dict[str, int]:
+        rows = self.db.execute("SELECT status, COUNT(*) FROM crawl_queue GROUP BY status").fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
@@ -0,0 +1,108 @@
+# =============================================================================
+# Forked CPU inference workers sharing one copy of the model
+# =============================================================================
+# Threads in one process can't scale CPU inference: every forward pass
+# competes for the same intra-op thread pool. gunicorn workers can, but each
+# loads its own copy of the model. WorkerPool instead forks N workers *after*
+# the model is loaded, so the weight tensors are shared copy-on-write (they
+# are never written during inference), and pins each worker to a disjoint
+# set of cores with a matching intra-op thread count.
+#
+# Core sets are contiguous ranges of the CPU IDs this process may use; on
+# Linux those follow the socket layout, so with one worker per socket each
+# worker keeps its threads and memory traffic on its own socket.
+import os
+import queue
+import traceback
+import multiprocessing as mp
+from typing import Callable, List, Optional, Sequence
+
+
+def split_cores(num_workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """`cores` (default: this process's affinity) cut into num_workers contiguous sets."""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if num_workers > len(cores):
+        raise ValueError(f"{num_workers} workers but only {len(cores)} cores")
+    size, extra = divmod(len(cores), num_workers)
+    sets, start = [], 0
+    for n in range(num_workers):
+        end = start + size + (1 if n < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def _worker_main(conn, fn: Callable, cores: List[int], on_start: Optional[Callable]):
+    os.sched_setaffinity(0, cores)
+    if on_start is not None:
+        on_start(len(cores))
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return  # Parent went away
+        try:
+            conn.send((True, fn(*args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+
+class WorkerPool:
+    """
+    Forks `num_workers` processes that each run `fn(*args)` on request.
+
+    `on_start(num_threads)` runs in each worker after pinning, e.g. to call
+    torch.set_num_threads. `call` blocks until a worker is idle, so callers
+    are routed to whichever worker frees up first; it is safe to call from
+    several threads at once.
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        num_workers: int,
+        on_start: Optional[Callable[[int], None]] = None,
+        cores: Optional[Sequence[int]] = None,
+    ):
+        ctx = mp.get_context("fork")  # Workers inherit the loaded model
+        self.core_sets = split_cores(num_workers, cores)
+        self._conns = []
+        self._processes = []
+        self._idle: "queue.Queue[int]" = queue.Queue()
+        for n, core_set in enumerate(self.core_sets):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(child_conn, fn, core_set, on_start),
+                name=f"inference-worker-{n}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+            self._idle.put(n)
+
+    @property
+    def num_workers(self) -> int:
+        return len(self._processes)
+
+    def alive(self) -> bool:
+        return all(process.is_alive() for process in self._processes)
+
+    def call(self, *args):
+        worker = self._idle.get()
+        try:
+            self._conns[worker].send(args)
+            ok, value = self._conns[worker].recv()
+        finally:
+            self._idle.put(worker)
+        if not ok:
+            raise RuntimeError(f"Inference worker {worker} failed:\n{value}")
+        return value
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        for process in self._processes:
+            process.join(timeout=5)